@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import shutil
+import zipfile
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import version_xlsx
+from synthetic_workbooks import write_synthetic_workbook
+
+"""
+Times the diff and textconv commands on two versions of a synthetic
+workbook, and compares them with a plain line diff of the same YML files
+by git. The second version changes a formula, a style and a shared
+string, and the script fails if the diff does not report those cells.
+"""
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'version_xlsx.py')
+
+# Write a copy of a workbook with some parts edited, the edits are pairs of text to replace in each part
+def write_edited_workbook(source_path, target_path, edits):
+	with zipfile.ZipFile(source_path) as source, zipfile.ZipFile(target_path, 'w', compression=zipfile.ZIP_DEFLATED) as target:
+		for zip_info in source.infolist():
+			data = source.read(zip_info)
+			for old, new in edits.get(zip_info.filename, []):
+				data = data.replace(old, new)
+			target.writestr(zip_info.filename, data)
+
+def timed_run(args):
+	start_time = time.perf_counter()
+	result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	elapsed = time.perf_counter() - start_time
+	if result.returncode not in [0, 1]:
+		raise RuntimeError('{0} failed: {1}'.format(' '.join(args), result.stderr.decode('utf-8', 'replace')))
+	return elapsed, result.stdout.decode('utf-8')
+
+def run_benchmark(sheets, rows, cols, encoding):
+	work_dir = tempfile.mkdtemp(prefix='version_xlsx_diff_')
+	try:
+		old_path = os.path.join(work_dir, 'old.xlsx')
+		new_path = os.path.join(work_dir, 'new.xlsx')
+		write_synthetic_workbook(old_path, sheets=sheets, rows=rows, cols=cols, media_bytes=20000)
+		write_edited_workbook(old_path, new_path, {
+			'xl/worksheets/sheet1.xml': [(b'<f>A3*2</f>', b'<f>A3*3</f>'), (b'<c r="A4">', b'<c r="A4" s="1">')],
+			'xl/sharedStrings.xml': [(b'<t>Label 3 &amp; text</t>', b'<t>Changed label</t>')]
+		})
+		for path in [old_path, new_path]:
+			version_xlsx.write_workbook_to_yml(path, False, {'worksheet_encoding': encoding})
+		print('YML size: {0:.1f} MB'.format(os.path.getsize(new_path + '.yml') / 1e6))
+
+		elapsed, output = timed_run([sys.executable, SCRIPT_PATH, 'diff', old_path + '.yml', new_path + '.yml'])
+		print('{0:<24} {1:8.3f} seconds {2:8} lines'.format('diff', elapsed, len(output.splitlines())))
+		for expected in ['~ Sheet1!C3 formula: "A3*2" -> "A3*3"', '~ Sheet1!A4 style: null -> "1"', 'value: "Label 3 & text" -> "Changed label"']:
+			if expected not in output:
+				raise RuntimeError('The diff does not report {0}'.format(expected))
+
+		elapsed, output = timed_run([sys.executable, SCRIPT_PATH, 'textconv', new_path + '.yml'])
+		print('{0:<24} {1:8.3f} seconds {2:8} lines'.format('textconv', elapsed, len(output.splitlines())))
+
+		elapsed, output = timed_run(['git', 'diff', '--no-index', old_path + '.yml', new_path + '.yml'])
+		print('{0:<24} {1:8.3f} seconds {2:8} lines'.format('git diff of the YML', elapsed, len(output.splitlines())))
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Time the diff and textconv commands on two versions of a synthetic workbook')
+	parser.add_argument('--sheets', type=int, default=2)
+	parser.add_argument('--rows', type=int, default=20000)
+	parser.add_argument('--cols', type=int, default=10)
+	parser.add_argument('--encoding', choices=['xml', 'cells'], default='xml', help='worksheet encoding of the YML files')
+	args = parser.parse_args()
+	run_benchmark(args.sheets, args.rows, args.cols, args.encoding)
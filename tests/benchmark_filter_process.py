@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import version_xlsx
+from synthetic_workbooks import write_synthetic_workbook
+
+"""
+Runs the filter-process mode against a local git in a temporary repo. The
+repo is set up with a .gitattributes file and a filter driver that runs
+the script, and synthetic workbooks are added, committed, removed and
+checked out again. The time taken by git add and by the checkout is
+reported, and the script fails if git stored anything other than YML or
+if a checked out workbook holds different parts than the same workbook
+converted to YML and back by the hooks.
+"""
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'version_xlsx.py')
+
+SETTINGS_TEMPLATE = '''options:
+  enabled: True
+  convert_xlsx: True
+  convert_xlsm: True
+  convert_vba_separate_file: False
+  enable_logging: False
+  logfile: 'log.txt'
+  worksheet_encoding: '{0}'
+exclude_directories:
+  - ".git"
+'''
+
+def run_git(repo_dir, args):
+	result = subprocess.run(['git'] + args, cwd=repo_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	if result.returncode != 0:
+		raise RuntimeError('git {0} failed: {1}'.format(' '.join(args), result.stderr.decode('utf-8', 'replace')))
+	return result.stdout
+
+def prepare_repo(repo_dir, encoding):
+	os.makedirs(repo_dir)
+	run_git(repo_dir, ['init', '-q'])
+	run_git(repo_dir, ['config', 'user.name', 'benchmark'])
+	run_git(repo_dir, ['config', 'user.email', 'benchmark@example.com'])
+	run_git(repo_dir, ['config', 'filter.version_xlsx.process', '"{0}" "{1}" filter-process'.format(sys.executable, SCRIPT_PATH)])
+	run_git(repo_dir, ['config', 'filter.version_xlsx.required', 'true'])
+	with open(os.path.join(repo_dir, '.gitattributes'), 'w', encoding="utf-8") as file:
+		file.write('*.xlsx filter=version_xlsx\n*.xlsm filter=version_xlsx\n')
+	with open(os.path.join(repo_dir, 'version_sheet_settings.yml'), 'w', encoding="utf-8") as file:
+		file.write(SETTINGS_TEMPLATE.format(encoding))
+	run_git(repo_dir, ['add', '.gitattributes', 'version_sheet_settings.yml'])
+	run_git(repo_dir, ['commit', '-q', '-m', 'settings'])
+
+def read_members(path):
+	with zipfile.ZipFile(path) as archive:
+		return dict((x, archive.read(x)) for x in archive.namelist())
+
+# Convert a copy of a workbook to YML and back as the hooks would, and read the parts of the result
+def read_hook_members(path, work_dir, settings):
+	os.makedirs(work_dir)
+	copy_path = os.path.join(work_dir, os.path.basename(path))
+	shutil.copyfile(path, copy_path)
+	version_xlsx.write_workbook_to_yml(copy_path, False, settings)
+	os.remove(copy_path)
+	version_xlsx.convert_yml_to_workbook(copy_path + '.yml', settings)
+	return read_members(copy_path)
+
+def run_benchmark(workbooks, rows, encoding):
+	work_root = tempfile.mkdtemp(prefix='version_xlsx_filter_')
+	try:
+		repo_dir = os.path.join(work_root, 'repo')
+		prepare_repo(repo_dir, encoding)
+		names = ['book{0}.xlsx'.format(x) for x in range(workbooks)]
+		originals = {}
+		for index, name in enumerate(names):
+			path = os.path.join(repo_dir, name)
+			write_synthetic_workbook(path, sheets=2, rows=rows, cols=10, media_bytes=20000, seed=index)
+			originals[name] = read_hook_members(path, os.path.join(work_root, 'hooks', name), {'worksheet_encoding': encoding})
+
+		start_time = time.perf_counter()
+		run_git(repo_dir, ['add'] + names)
+		add_seconds = time.perf_counter() - start_time
+		run_git(repo_dir, ['commit', '-q', '-m', 'workbooks'])
+
+		stored_bytes = 0
+		for name in names:
+			stored = run_git(repo_dir, ['show', 'HEAD:' + name])
+			if not stored.startswith(b'options:'):
+				raise RuntimeError('{0} was not stored as YML'.format(name))
+			stored_bytes += len(stored)
+
+		for name in names:
+			os.remove(os.path.join(repo_dir, name))
+		start_time = time.perf_counter()
+		run_git(repo_dir, ['checkout', '--'] + names)
+		checkout_seconds = time.perf_counter() - start_time
+
+		for name in names:
+			if read_members(os.path.join(repo_dir, name)) != originals[name]:
+				raise RuntimeError('{0} does not hold the same parts as after the hooks'.format(name))
+		if run_git(repo_dir, ['status', '--porcelain']).strip():
+			raise RuntimeError('The checked out workbooks are reported as modified')
+
+		return {
+			'workbooks': workbooks,
+			'rows': rows,
+			'worksheet_encoding': encoding,
+			'add_seconds': round(add_seconds, 4),
+			'checkout_seconds': round(checkout_seconds, 4),
+			'stored_yml_bytes': stored_bytes
+		}
+	finally:
+		shutil.rmtree(work_root, ignore_errors=True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Convert workbooks through the git filter-process mode in a temporary repo')
+	parser.add_argument('--workbooks', type=int, default=10)
+	parser.add_argument('--rows', type=int, default=1000)
+	parser.add_argument('--encoding', choices=['xml', 'cells'], default='xml', help='worksheet encoding used by the filter')
+	args = parser.parse_args()
+
+	print(json.dumps(run_benchmark(args.workbooks, args.rows, args.encoding), indent=1))
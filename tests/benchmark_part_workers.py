@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import version_xlsx
+from synthetic_workbooks import write_synthetic_workbook
+
+"""
+Times the conversion of a workbook holding many worksheets to YML with
+its parts converted on different numbers of threads, as set by the
+part_workers option. Each run converts its own copy of the workbook, and
+the script fails if any number of threads writes a different YML file
+than converting the parts one at a time.
+"""
+
+def run_benchmark(sheets, rows, cols, worker_counts, encoding, repeat):
+	work_dir = tempfile.mkdtemp(prefix='version_xlsx_workers_')
+	try:
+		source_path = os.path.join(work_dir, 'source.xlsx')
+		write_synthetic_workbook(source_path, sheets=sheets, rows=rows, cols=cols)
+		print('CPU cores: {0}'.format(os.cpu_count()))
+
+		expected = None
+		baseline = None
+		for workers in worker_counts:
+			workbook_path = os.path.join(work_dir, 'workers{0}.xlsx'.format(workers))
+			shutil.copyfile(source_path, workbook_path)
+			settings = {'part_workers': workers, 'worksheet_encoding': encoding}
+			timings = []
+			for i in range(repeat):
+				start_time = time.perf_counter()
+				version_xlsx.write_workbook_to_yml(workbook_path, False, settings)
+				timings.append(time.perf_counter() - start_time)
+			elapsed = min(timings)
+			baseline = baseline or elapsed
+			print('{0:>2} workers {1:8.3f} seconds {2:6.2f}x'.format(workers, elapsed, baseline / elapsed))
+
+			with open(workbook_path + '.yml', 'rb') as file:
+				output = file.read()
+			if expected is None:
+				expected = output
+			elif output != expected:
+				raise RuntimeError('The YML written with {0} workers differs from the YML written with {1}'.format(workers, worker_counts[0]))
+		print('YML size: {0:.1f} MB, identical for every number of workers'.format(len(expected) / 1e6))
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Time the conversion of a many-sheet workbook with its parts converted on several threads')
+	parser.add_argument('--sheets', type=int, default=50)
+	parser.add_argument('--rows', type=int, default=2000)
+	parser.add_argument('--cols', type=int, default=10)
+	parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='numbers of threads to compare, the first is the baseline')
+	parser.add_argument('--encoding', choices=['xml', 'cells'], default='xml', help='worksheet encoding of the YML files')
+	parser.add_argument('--repeat', type=int, default=3, help='runs for each number of threads, the fastest is reported')
+	args = parser.parse_args()
+	run_benchmark(args.sheets, args.rows, args.cols, args.workers, args.encoding, args.repeat)
@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_workbooks import write_synthetic_workbook
+
+"""
+Benchmarks how long the command line takes to start and finish when a
+hook runs it with nothing or very little to do. Each case runs the script
+in a new process, as the git hooks do, in a temporary repo holding a
+settings file and, for the one_file case, a single small workbook. The
+heavy modules that each case ended up importing are listed as well.
+"""
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'version_xlsx.py')
+HEAVY_MODULES = ['yaml', 'lxml', 'oletools', 'openpyxl', 'concurrent.futures']
+
+SETTINGS_TEMPLATE = '''options:
+  enabled: {0}
+  convert_xlsx: True
+  convert_xlsm: True
+  convert_vba_separate_file: True
+  enable_logging: False
+  logfile: 'log.txt'
+  incremental: True
+  manifest_file: 'manifest.json'
+exclude_directories:
+  - ".git"
+'''
+
+# Each case is the setting for enabled, whether a workbook is present and the arguments given to the script
+CASES = {
+	'disabled': (False, False, ['convert_to_yml']),
+	'no_match': (True, False, ['convert_to_yml']),
+	'one_file': (True, True, ['convert_to_yml', '--force'])
+}
+
+def prepare_repo(work_dir, enabled, with_workbook):
+	os.makedirs(work_dir)
+	with open(os.path.join(work_dir, 'version_sheet_settings.yml'), 'w', encoding="utf-8") as file:
+		file.write(SETTINGS_TEMPLATE.format(enabled))
+	if with_workbook:
+		write_synthetic_workbook(os.path.join(work_dir, 'book.xlsx'), sheets=1, rows=20, cols=5)
+
+# Run the script once, returning the wall clock time and the top level packages it imported
+def run_once(work_dir, args):
+	start_time = time.perf_counter()
+	result = subprocess.run([sys.executable, '-X', 'importtime', SCRIPT_PATH] + args, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+	elapsed = time.perf_counter() - start_time
+	imported = set()
+	for line in result.stderr.decode('utf-8', 'replace').splitlines():
+		if line.startswith('import time:'):
+			module = line.split('|')[-1].strip()
+			imported.update(x for x in HEAVY_MODULES if module == x or module.startswith(x + '.'))
+	return elapsed, sorted(imported)
+
+def run_benchmark(repeat):
+	work_root = tempfile.mkdtemp(prefix='version_xlsx_startup_')
+	try:
+		start_time = time.perf_counter()
+		subprocess.run([sys.executable, '-c', 'pass'])
+		results = {'python_baseline_seconds': round(time.perf_counter() - start_time, 4), 'cases': {}}
+		for name, (enabled, with_workbook, args) in CASES.items():
+			work_dir = os.path.join(work_root, name)
+			prepare_repo(work_dir, enabled, with_workbook)
+			# Importing with -X importtime adds a small overhead, which is the same for every case
+			runs = [run_once(work_dir, args) for _ in range(repeat)]
+			timings = sorted(x[0] for x in runs)
+			results['cases'][name] = {
+				'min_seconds': round(timings[0], 4),
+				'median_seconds': round(timings[len(timings) // 2], 4),
+				'heavy_modules': runs[-1][1]
+			}
+		return results
+	finally:
+		shutil.rmtree(work_root, ignore_errors=True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Measure the start up time of the command line')
+	parser.add_argument('--repeat', type=int, default=10)
+	parser.add_argument('--json', action='store_true', help='print the results as JSON')
+	args = parser.parse_args()
+
+	results = run_benchmark(args.repeat)
+	if args.json:
+		print(json.dumps(results, indent=1))
+	else:
+		print('python -c pass: {0:.3f} seconds'.format(results['python_baseline_seconds']))
+		for name, case in results['cases'].items():
+			print('{0:<10} min {1:.3f} s  median {2:.3f} s  imports: {3}'.format(name, case['min_seconds'], case['median_seconds'], ', '.join(case['heavy_modules']) or 'none'))
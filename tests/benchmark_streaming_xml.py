@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_workbooks import write_synthetic_workbook
+
+"""
+Benchmarks the conversion of a workbook holding one very large worksheet
+with and without streaming of XML parts. Each mode runs in a separate
+process so that the peak resident memory it reports only covers that
+conversion. The two YML files produced are compared at the end.
+"""
+
+# Peak resident set size of the current process in megabytes
+def peak_rss_mb():
+	import resource
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes and macOS reports bytes
+	if sys.platform == 'darwin':
+		return peak / (1024 * 1024)
+	return peak / 1024
+
+"""
+Convert the workbook in this process using the requested mode and print 
+the elapsed time and peak memory as JSON for the parent process.
+"""
+def run_child(mode, workbook_path):
+	import version_xlsx
+	settings = {'stream_xml_over_mb': 0 if mode == 'streaming' else None}
+	start_time = time.perf_counter()
+	version_xlsx.write_workbook_to_yml(workbook_path, False, settings)
+	elapsed = time.perf_counter() - start_time
+	print(json.dumps({'mode': mode, 'seconds': round(elapsed, 3), 'peak_rss_mb': round(peak_rss_mb(), 1)}))
+
+def run_benchmark(rows, cols):
+	work_dir = tempfile.mkdtemp(prefix='version_xlsx_bench_')
+	try:
+		results = []
+		outputs = []
+		for mode in ['full', 'streaming']:
+			mode_dir = os.path.join(work_dir, mode)
+			os.mkdir(mode_dir)
+			workbook_path = os.path.join(mode_dir, 'huge.xlsx')
+			write_synthetic_workbook(workbook_path, sheets=1, rows=rows, cols=cols)
+			output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', mode, workbook_path])
+			results.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+			outputs.append(workbook_path + '.yml')
+
+		with zipfile.ZipFile(os.path.join(work_dir, 'full', 'huge.xlsx')) as archive:
+			sheet_mb = archive.getinfo('xl/worksheets/sheet1.xml').file_size / 1e6
+		print('Worksheet XML size: {0:.1f} MB'.format(sheet_mb))
+		for result in results:
+			print('{0:<10} {1:8.3f} seconds {2:10.1f} MB peak RSS'.format(result['mode'], result['seconds'], result['peak_rss_mb']))
+
+		with open(outputs[0], 'rb') as full_file, open(outputs[1], 'rb') as streamed_file:
+			identical = full_file.read() == streamed_file.read()
+		print('YML output identical: {0}'.format(identical))
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compare peak memory of full and streaming XML conversion')
+	parser.add_argument('--rows', type=int, default=200000)
+	parser.add_argument('--cols', type=int, default=10)
+	parser.add_argument('--child', nargs=2, metavar=('MODE', 'WORKBOOK'), help=argparse.SUPPRESS)
+	args = parser.parse_args()
+	if args.child:
+		run_child(*args.child)
+	else:
+		run_benchmark(args.rows, args.cols)
@@ -0,0 +1,252 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import zipfile
+import platform
+import tempfile
+import argparse
+import subprocess
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_workbooks import write_synthetic_workbook
+
+"""
+Headless benchmark suite for the conversions run by the git hooks. Each
+scenario generates a synthetic workbook of a controlled size and shape,
+times write_workbook_to_yml and convert_yml_to_workbook in a separate
+process so that the peak memory reported only covers that conversion,
+and measures the size of a git pack holding two revisions of either the
+workbook itself or the files generated from it. Results are written as
+JSON so that runs from different releases can be compared.
+"""
+
+# Shapes of the synthetic workbooks, the rows and binary sizes are multiplied by the scale option
+SCENARIOS = {
+	'many_sheets': {'extension': '.xlsx', 'sheets': 50, 'rows': 200, 'cols': 10},
+	'huge_sheet': {'extension': '.xlsx', 'sheets': 1, 'rows': 100000, 'cols': 10},
+	'heavy_media': {'extension': '.xlsx', 'sheets': 2, 'rows': 500, 'cols': 10, 'media_bytes': 4000000, 'media_count': 4},
+	'vba': {'extension': '.xlsm', 'sheets': 3, 'rows': 1000, 'cols': 10, 'vba_bytes': 1000000}
+}
+
+# Size of a file, or of every file below a folder written in the split layout
+def output_size(path):
+	if os.path.isfile(path):
+		return os.path.getsize(path)
+	total_size = 0
+	for subdir, dirs, files in os.walk(path):
+		total_size += sum(os.path.getsize(os.path.join(subdir, file)) for file in files)
+	return total_size
+
+"""
+Run a single conversion in this process and print the elapsed time and
+peak memory as JSON for the parent process. The input file is relative
+to the working directory, which stands in for the root of the repo.
+"""
+def run_child(operation, work_dir, input_file, settings_json):
+	import version_xlsx
+	settings = json.loads(settings_json)
+	os.chdir(work_dir)
+
+	start_time = time.perf_counter()
+	if operation == 'to_yml':
+		result = version_xlsx.write_workbook_to_yml(input_file, True, settings)
+	else:
+		result = version_xlsx.convert_yml_to_workbook(input_file, settings)
+	elapsed = time.perf_counter() - start_time
+	print(json.dumps({'result': result, 'seconds': round(elapsed, 3), 'peak_rss_mb': version_xlsx.peak_rss_mb()}))
+
+def run_child_process(operation, work_dir, input_file, settings):
+	output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', operation, work_dir, input_file, json.dumps(settings)])
+	return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+"""
+Write the next revision of a workbook, changing one value as well as the
+fields that Excel changes on every save: the document properties and the
+order of the calculation chain, where the changed cell moves to the end.
+"""
+def revise_workbook(input_path, output_path):
+	with zipfile.ZipFile(input_path) as source, zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED) as target:
+		for zip_info in source.infolist():
+			data = source.read(zip_info)
+			if zip_info.filename == 'xl/worksheets/sheet1.xml':
+				data = re.sub(rb'<v>\d+</v>', b'<v>42</v>', data, count=1)
+			elif zip_info.filename == 'docProps/core.xml':
+				data = data.replace(b'2024-01-01T00:00:00Z</dcterms:modified>', b'2024-01-02T00:00:00Z</dcterms:modified>')
+				data = data.replace(b'<cp:lastModifiedBy>benchmark</cp:lastModifiedBy>', b'<cp:lastModifiedBy>reviewer</cp:lastModifiedBy>')
+			elif zip_info.filename == 'docProps/app.xml':
+				data = data.replace(b'<TotalTime>5</TotalTime>', b'<TotalTime>12</TotalTime>')
+			elif zip_info.filename == 'xl/calcChain.xml':
+				data = reorder_calc_chain(data)
+			target.writestr(zip_info, data)
+
+# Move the first cell of a calculation chain to the end, writing the sheet index only where it changes
+def reorder_calc_chain(data):
+	cells = []
+	sheet = None
+	for reference, index in re.findall(rb'<c r="([A-Z]+[0-9]+)"(?: i="([0-9]+)")?/>', data):
+		sheet = index or sheet
+		cells.append((reference, sheet))
+	cells = cells[1:] + cells[:1]
+	chain = []
+	previous = None
+	for reference, index in cells:
+		chain.append(b'<c r="' + reference + (b'" i="' + index if index != previous else b'') + b'"/>')
+		previous = index
+	start = data.index(b'<c ')
+	return data[:start] + b''.join(chain) + data[data.index(b'</calcChain>'):]
+
+# Run a git command in a folder, without the user configuration of the machine running the benchmark
+def run_git(repo_dir, args):
+	env = dict(os.environ, GIT_AUTHOR_NAME='benchmark', GIT_AUTHOR_EMAIL='benchmark@example.com', GIT_COMMITTER_NAME='benchmark', GIT_COMMITTER_EMAIL='benchmark@example.com', GIT_CONFIG_NOSYSTEM='1', HOME=repo_dir)
+	result = subprocess.run(['git'] + args, cwd=repo_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+	return result.stdout.decode('utf-8')
+
+"""
+Commit two revisions of a workbook into a new repository, either as the
+workbook itself or as the files generated from it, and return the size
+of the pack after an aggressive garbage collection. Returns None if git
+is not available.
+"""
+def measure_pack_bytes(work_dir, revisions, file_format, settings):
+	import version_xlsx
+	repo_dir = os.path.join(work_dir, 'repo_' + file_format)
+	os.mkdir(repo_dir)
+	current_dir = os.getcwd()
+	try:
+		run_git(repo_dir, ['init', '-q'])
+		os.chdir(repo_dir)
+		for index, revision_path in enumerate(revisions):
+			workbook_file = 'bench' + os.path.splitext(revision_path)[1]
+			shutil.copy(revision_path, workbook_file)
+			if file_format == 'yml':
+				version_xlsx.write_workbook_to_yml(workbook_file, True, settings)
+				os.remove(workbook_file)
+			run_git(repo_dir, ['add', '-A'])
+			run_git(repo_dir, ['commit', '-q', '-m', 'revision {0}'.format(index + 1)])
+		run_git(repo_dir, ['gc', '-q', '--aggressive', '--prune=now'])
+		counts = dict(line.split(': ') for line in run_git(repo_dir, ['count-objects', '-v']).splitlines())
+		return (int(counts['size-pack']) + int(counts['size'])) * 1024
+	except (OSError, subprocess.CalledProcessError):
+		return None
+	finally:
+		os.chdir(current_dir)
+
+def run_scenario(name, shape, scale, settings, measure_pack):
+	work_dir = tempfile.mkdtemp(prefix='version_xlsx_suite_')
+	try:
+		extension = shape['extension']
+		workbook_shape = dict((k, v) for k, v in shape.items() if k != 'extension')
+		workbook_shape['rows'] = max(1, int(workbook_shape['rows'] * scale))
+		for key in ['media_bytes', 'vba_bytes']:
+			if key in workbook_shape:
+				workbook_shape[key] = max(1, int(workbook_shape[key] * scale))
+
+		source_path = os.path.join(work_dir, 'source' + extension)
+		write_synthetic_workbook(source_path, **workbook_shape)
+		result = {'scenario': name, 'shape': workbook_shape, 'workbook_bytes': os.path.getsize(source_path)}
+
+		convert_dir = os.path.join(work_dir, 'convert')
+		os.mkdir(convert_dir)
+		workbook_file = 'bench' + extension
+		workbook_path = os.path.join(convert_dir, workbook_file)
+		shutil.copy(source_path, workbook_path)
+		result['to_yml'] = run_child_process('to_yml', convert_dir, workbook_file, settings)
+
+		# The index of the split layout stands in for the YML file
+		yml_file = workbook_file + '.yml'
+		output_path = os.path.join(convert_dir, yml_file)
+		if not os.path.isfile(output_path):
+			yml_file = os.path.join(workbook_file + '.d', 'index.yml')
+			output_path = os.path.join(convert_dir, workbook_file + '.d')
+		result['to_yml']['output_bytes'] = output_size(output_path)
+
+		os.remove(workbook_path)
+		result['to_excel'] = run_child_process('to_excel', convert_dir, yml_file, settings)
+		result['to_excel']['output_bytes'] = os.path.getsize(workbook_path)
+
+		if measure_pack:
+			revised_path = os.path.join(work_dir, 'revised' + extension)
+			revise_workbook(source_path, revised_path)
+			result['pack_bytes'] = {}
+			for file_format in ['xlsx', 'yml']:
+				result['pack_bytes'][file_format] = measure_pack_bytes(work_dir, [source_path, revised_path], file_format, settings)
+		return result
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+# Describe the machine and the version of the code that produced the results
+def run_metadata(scale, settings):
+	try:
+		commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode('utf-8').strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {
+		'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+		'commit': commit,
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'cpu_count': os.cpu_count(),
+		'scale': scale,
+		'settings': settings
+	}
+
+"""
+Print the ratio of each measurement to the same measurement in a previous
+results file, so that a value below 1 is an improvement.
+"""
+def print_comparison(results, baseline):
+	baseline_results = dict((x['scenario'], x) for x in baseline['results'])
+	print('{0:<14} {1:<24} {2:>12} {3:>12} {4:>8}'.format('scenario', 'measurement', 'baseline', 'current', 'ratio'))
+	for result in results['results']:
+		previous = baseline_results.get(result['scenario'])
+		if previous is None:
+			continue
+		measurements = []
+		for operation in ['to_yml', 'to_excel']:
+			for key in ['seconds', 'peak_rss_mb', 'output_bytes']:
+				measurements.append(('{0}.{1}'.format(operation, key), result[operation].get(key), previous[operation].get(key)))
+		for file_format in ['xlsx', 'yml']:
+			measurements.append(('pack_bytes.' + file_format, (result.get('pack_bytes') or {}).get(file_format), (previous.get('pack_bytes') or {}).get(file_format)))
+		for label, current, old in measurements:
+			if current is None or not old:
+				continue
+			print('{0:<14} {1:<24} {2:>12} {3:>12} {4:>8.2f}'.format(result['scenario'], label, old, current, current / old))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark workbook conversions on synthetic workbooks')
+	parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='scenario to run, may be repeated, all scenarios run by default')
+	parser.add_argument('--scale', type=float, default=1.0, help='multiplier for the number of rows and the size of binary parts')
+	parser.add_argument('--settings', help='settings file whose options are used for the conversions')
+	parser.add_argument('--no-pack', action='store_true', help='skip measuring the size of git packs')
+	parser.add_argument('--output', help='write the results to this JSON file instead of standard output')
+	parser.add_argument('--compare', help='previous results file to compare against')
+	parser.add_argument('--child', nargs=4, metavar=('OPERATION', 'FOLDER', 'INPUT', 'SETTINGS'), help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.child:
+		run_child(*args.child)
+		sys.exit(0)
+
+	settings = {}
+	if args.settings:
+		with open(args.settings, encoding="utf-8") as file:
+			settings = yaml.safe_load(file)['options']
+
+	results = {'metadata': run_metadata(args.scale, settings), 'results': []}
+	for name in args.scenario or sorted(SCENARIOS):
+		print('Running {0}'.format(name), file=sys.stderr)
+		results['results'].append(run_scenario(name, SCENARIOS[name], args.scale, settings, not args.no_pack))
+
+	if args.output:
+		with open(args.output, 'w', encoding="utf-8") as file:
+			json.dump(results, file, indent=1)
+	else:
+		print(json.dumps(results, indent=1))
+
+	if args.compare:
+		with open(args.compare, encoding="utf-8") as file:
+			print_comparison(results, json.load(file))
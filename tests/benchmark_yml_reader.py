@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import version_xlsx
+from synthetic_workbooks import write_synthetic_workbook
+
+"""
+Benchmarks the streaming reader for generated YML files against the YAML
+loaders it replaces. A synthetic workbook is converted to YML once, then
+the file is loaded repeatedly with each reader and the best time of the
+repeats is reported along with the time to rebuild the workbook. The 
+workbook is removed before each rebuild, as a workbook that already 
+matches the checksums of the YML file is left untouched, which is timed
+on its own.
+"""
+
+# Return the best wall clock time of several runs of a function, calling setup before each run without timing it
+def best_time(function, repeat, setup=None):
+	timings = []
+	for _ in range(repeat):
+		if setup is not None:
+			setup()
+		start_time = time.perf_counter()
+		function()
+		timings.append(time.perf_counter() - start_time)
+	return min(timings)
+
+def load_pure_python(yml_path):
+	with open(yml_path, encoding="utf-8") as file:
+		yaml.load(file, Loader=yaml.SafeLoader)
+
+def load_libyaml(yml_path):
+	with open(yml_path, encoding="utf-8") as file:
+		yaml.load(file, Loader=yaml.CSafeLoader)
+
+def load_streaming(yml_path):
+	with open(yml_path, encoding="utf-8") as file:
+		for key, value in version_xlsx.iter_yml_document(file):
+			pass
+
+def run_benchmark(sheets, rows, cols, repeat):
+	work_dir = tempfile.mkdtemp(prefix='version_xlsx_bench_')
+	try:
+		workbook_path = os.path.join(work_dir, 'bench.xlsx')
+		write_synthetic_workbook(workbook_path, sheets=sheets, rows=rows, cols=cols)
+		version_xlsx.write_workbook_to_yml(workbook_path, False)
+		yml_path = workbook_path + '.yml'
+		print('YML size: {0:.1f} MB'.format(os.path.getsize(yml_path) / 1e6))
+
+		readers = [('yaml.safe_load (pure Python)', load_pure_python)]
+		if hasattr(yaml, 'CSafeLoader'):
+			readers.append(('yaml CSafeLoader (libyaml)', load_libyaml))
+		readers.append(('iter_yml_document (streaming)', load_streaming))
+		for name, reader in readers:
+			elapsed = best_time(lambda: reader(yml_path), repeat)
+			print('{0:<32} {1:8.3f} seconds'.format(name, elapsed))
+
+		rebuild = lambda: version_xlsx.convert_yml_to_workbook(yml_path)
+		elapsed = best_time(rebuild, repeat, lambda: os.remove(workbook_path) if os.path.exists(workbook_path) else None)
+		print('{0:<32} {1:8.3f} seconds'.format('convert_yml_to_workbook', elapsed))
+		elapsed = best_time(rebuild, repeat)
+		print('{0:<32} {1:8.3f} seconds'.format('  workbook already up to date', elapsed))
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compare YML readers on a synthetic workbook')
+	parser.add_argument('--sheets', type=int, default=4)
+	parser.add_argument('--rows', type=int, default=5000)
+	parser.add_argument('--cols', type=int, default=12)
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+	run_benchmark(args.sheets, args.rows, args.cols, args.repeat)
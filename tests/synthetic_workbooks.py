@@ -0,0 +1,400 @@
+import math
+import random
+import struct
+import zipfile
+
+"""
+Generates synthetic workbooks of a controlled size and shape for the 
+benchmark scripts. Workbooks are written directly as Office Open XML 
+parts so that no spreadsheet library is needed and so that the number 
+of sheets, rows, columns and the size of media parts are exact.
+"""
+
+CONTENT_TYPES_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/><Default Extension="png" ContentType="image/png"/>'
+SHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+"""
+Convert a zero based column index into the letters used in a cell reference
+"""
+def column_letters(index):
+	letters = ''
+	index += 1
+	while index > 0:
+		index, remainder = divmod(index - 1, 26)
+		letters = chr(65 + remainder) + letters
+	return letters
+
+"""
+Build the XML of a single worksheet. Cells alternate between numbers,
+shared strings and formulas so the part resembles a typical data sheet.
+"""
+def sheet_xml(rows, cols, shared_string_count, rng):
+	lines = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{0}" xmlns:r="{1}"><dimension ref="A1:{2}{3}"/><sheetData>'.format(SHEET_NS, REL_NS, column_letters(cols - 1), rows)]
+	for row in range(1, rows + 1):
+		cells = []
+		for col in range(cols):
+			ref = '{0}{1}'.format(column_letters(col), row)
+			kind = col % 3
+			if kind == 0:
+				cells.append('<c r="{0}"><v>{1}</v></c>'.format(ref, rng.randint(0, 1000000)))
+			elif kind == 1:
+				cells.append('<c r="{0}" t="s"><v>{1}</v></c>'.format(ref, rng.randrange(shared_string_count)))
+			else:
+				cells.append('<c r="{0}" s="1"><f>A{1}*2</f><v>{2}</v></c>'.format(ref, row, rng.random()))
+		lines.append('<row r="{0}" spans="1:{1}">{2}</row>'.format(row, cols, ''.join(cells)))
+	lines.append('</sheetData><pageMargins left="0.7" right="0.7" top="0.75" bottom="0.75" header="0.3" footer="0.3"/></worksheet>')
+	return ''.join(lines)
+
+"""
+Build the calculation chain of the formula cells. As in the chains Excel
+writes, the sheet index is only given when it differs from the previous
+cell.
+"""
+def calc_chain_xml(sheets, rows, cols):
+	cells = []
+	for index in range(1, sheets + 1):
+		for row in range(1, rows + 1):
+			for col in range(2, cols, 3):
+				sheet = ' i="{0}"'.format(index) if not cells or (row == 1 and col == 2) else ''
+				cells.append('<c r="{0}{1}"{2}/>'.format(column_letters(col), row, sheet))
+	return '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<calcChain xmlns="{0}">{1}</calcChain>'.format(SHEET_NS, ''.join(cells))
+
+# Special sector numbers of a compound file
+FREE_SECTOR = 0xFFFFFFFF
+END_OF_CHAIN = 0xFFFFFFFE
+FAT_SECTOR = 0xFFFFFFFD
+DIFAT_SECTOR = 0xFFFFFFFC
+NO_STREAM = 0xFFFFFFFF
+
+"""
+Compress data as the streams of a VBA project are compressed, a chunk of
+4096 bytes at a time. Each chunk is a sequence of tokens, either a literal
+byte or a copy of earlier bytes of the chunk, found here by looking up the
+last position of the next three bytes.
+"""
+def compress_vba(data):
+	container = bytearray(b'\x01')
+	for chunk_start in range(0, len(data), 4096):
+		chunk = data[chunk_start:chunk_start + 4096]
+		body = bytearray()
+		last_seen = {}
+		position = 0
+		while position < len(chunk):
+			flag_index = len(body)
+			body.append(0)
+			for bit in range(8):
+				if position >= len(chunk):
+					break
+				match = last_seen.get(chunk[position:position + 3])
+				length = 0
+				if match is not None:
+					bit_count = max((position - 1).bit_length(), 4)
+					max_length = min((0xFFFF >> bit_count) + 3, len(chunk) - position)
+					while length < max_length and chunk[match + length] == chunk[position + length]:
+						length += 1
+				if length >= 3:
+					body += struct.pack('<H', ((position - match - 1) << (16 - bit_count)) | (length - 3))
+					body[flag_index] |= 1 << bit
+				else:
+					length = 1
+					body.append(chunk[position])
+				for index in range(position, position + length):
+					last_seen[chunk[index:index + 3]] = index
+				position += length
+		if len(body) > 4096:
+			# A chunk that does not compress is written as it is, which is only allowed for a whole chunk
+			container += struct.pack('<H', 0x3FFF) + chunk
+		else:
+			container += struct.pack('<H', 0xB000 | (len(body) - 1)) + body
+	return bytes(container)
+
+# A record of the dir stream of a VBA project
+def dir_record(record_id, data):
+	return struct.pack('<HI', record_id, len(data)) + data
+
+"""
+Build the dir stream of a VBA project, which describes the project and
+its modules. The project has no references and every module is a
+procedural module whose source starts at the beginning of its stream.
+"""
+def vba_dir_stream(module_names):
+	records = [
+		dir_record(0x0001, struct.pack('<I', 1)),
+		dir_record(0x0002, struct.pack('<I', 0x0409)),
+		dir_record(0x0014, struct.pack('<I', 0x0409)),
+		dir_record(0x0003, struct.pack('<H', 1252)),
+		dir_record(0x0004, b'VBAProject'),
+		dir_record(0x0005, b''), dir_record(0x0040, b''),
+		dir_record(0x0006, b''), dir_record(0x003D, b''),
+		dir_record(0x0007, struct.pack('<I', 0)),
+		dir_record(0x0008, struct.pack('<I', 0)),
+		struct.pack('<HIIH', 0x0009, 4, 1, 0),
+		dir_record(0x000C, b''), dir_record(0x003C, b''),
+		dir_record(0x000F, struct.pack('<H', len(module_names))),
+		dir_record(0x0013, struct.pack('<H', 0xFFFF))
+	]
+	for name in module_names:
+		records += [
+			dir_record(0x0019, name.encode('cp1252')),
+			dir_record(0x0047, name.encode('utf-16-le')),
+			dir_record(0x001A, name.encode('cp1252')), dir_record(0x0032, name.encode('utf-16-le')),
+			dir_record(0x001C, b''), dir_record(0x0048, b''),
+			dir_record(0x0031, struct.pack('<I', 0)),
+			dir_record(0x001E, struct.pack('<I', 0)),
+			dir_record(0x002C, struct.pack('<H', 0xFFFF)),
+			dir_record(0x0021, b''),
+			dir_record(0x002B, b'')
+		]
+	records.append(dir_record(0x0010, b''))
+	return b''.join(records)
+
+"""
+Encrypt the protection fields of the PROJECT stream the way the VBA
+editor does, as the hexadecimal text it writes. The key is taken from
+the project id, and each byte is mixed with the two bytes before it.
+"""
+def encrypt_project_field(project_id, data, rng):
+	seed = rng.randrange(256)
+	project_key = sum(project_id.encode('ascii')) & 0xFF
+	output = [seed, seed ^ 2, seed ^ project_key]
+	unencrypted_1, encrypted_1, encrypted_2 = project_key, output[2], output[1]
+	ignored = bytes(rng.randrange(256) for i in range((seed & 6) // 2))
+	for value in ignored + struct.pack('<I', len(data)) + data:
+		encrypted = value ^ ((encrypted_2 + unencrypted_1) & 0xFF)
+		output.append(encrypted)
+		encrypted_2, encrypted_1, unencrypted_1 = encrypted_1, encrypted, value
+	return bytes(output).hex().upper()
+
+# The PROJECT stream of a VBA project without a password, which the VBA editor reads its settings from
+def vba_project_stream(module_names, rng):
+	project_id = '{' + '{0:08X}-{1:04X}-{2:04X}-{3:04X}-{4:012X}'.format(rng.getrandbits(32), rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(48)) + '}'
+	lines = ['ID="{0}"'.format(project_id)]
+	lines += ['Module={0}'.format(name) for name in module_names]
+	lines += ['Name="VBAProject"', 'HelpContextID="0"', 'VersionCompatible32="393222000"',
+		'CMG="{0}"'.format(encrypt_project_field(project_id, struct.pack('<I', 0), rng)),
+		'DPB="{0}"'.format(encrypt_project_field(project_id, b'\x00', rng)),
+		'GC="{0}"'.format(encrypt_project_field(project_id, b'\xff', rng)),
+		'', '[Host Extender Info]', '&H00000001={3832D640-CF90-11CF-8E43-00A0C911005A};VBE;&H00000000', '']
+	return '\r\n'.join(lines).encode('cp1252') + b'\r\n'
+
+"""
+Build the source of a standard module of about the given size, made of
+small functions reading a cell of the active sheet.
+"""
+def vba_module_code(name, size, rng):
+	lines = ['Attribute VB_Name = "{0}"'.format(name), 'Option Explicit', '']
+	length = sum(len(x) + 2 for x in lines)
+	index = 0
+	while length < size:
+		index += 1
+		function = ['Public Function Total{0}(ByVal factor As Double) As Double'.format(index),
+			'    Total{0} = Range("A{1}").Value * factor + {2}'.format(index, rng.randint(1, 100000), rng.randint(0, 1000000)),
+			'End Function', '']
+		lines += function
+		length += sum(len(x) + 2 for x in function)
+	return '\r\n'.join(lines).encode('cp1252')
+
+"""
+Order the entries of a storage as a balanced tree of a compound file,
+which compares names by length first. The tree is perfectly balanced but
+for its deepest level, which is coloured red so that every path holds
+the same number of black entries. Returns the entry at the root.
+"""
+def sibling_tree(entries, children):
+	children = sorted(children, key=lambda x: (len(entries[x]['name']), entries[x]['name'].upper()))
+	depths = {}
+	def build(low, high, depth):
+		if low >= high:
+			return NO_STREAM
+		middle = (low + high) // 2
+		depths[children[middle]] = depth
+		entries[children[middle]]['left'] = build(low, middle, depth + 1)
+		entries[children[middle]]['right'] = build(middle + 1, high, depth + 1)
+		return children[middle]
+	root = build(0, len(children), 0)
+	deepest = max(depths.values(), default=0)
+	for index, depth in depths.items():
+		entries[index]['red'] = depth == deepest and depth > 0
+	return root
+
+"""
+Write a compound file, the OLE format of vbaProject.bin, holding the
+given streams, which are named by their path such as 'VBA/dir'. Streams
+smaller than 4096 bytes are kept in the mini stream as the format
+requires. The file uses 512 byte sectors, and sectors listing the FAT
+sectors are added when the header has no room for all of them.
+"""
+def compound_file(streams):
+	entries = [{'name': 'Root Entry', 'type': 5, 'children': [], 'data': b''}]
+	storages = {'': 0}
+	for path in sorted(streams):
+		parent = ''
+		for name in path.split('/')[:-1]:
+			storage = parent + '/' + name
+			if storage not in storages:
+				storages[storage] = len(entries)
+				entries[storages[parent]]['children'].append(len(entries))
+				entries.append({'name': name, 'type': 1, 'children': [], 'data': b''})
+			parent = storage
+		entries[storages[parent]]['children'].append(len(entries))
+		entries.append({'name': path.split('/')[-1], 'type': 2, 'children': [], 'data': streams[path]})
+
+	sectors = []
+	fat = []
+	def allocate(data, size):
+		if not data:
+			return END_OF_CHAIN
+		start = len(sectors)
+		for offset in range(0, len(data), size):
+			sectors.append(data[offset:offset + size].ljust(size, b'\x00'))
+		fat.extend(range(start + 1, len(sectors)))
+		fat.append(END_OF_CHAIN)
+		return start
+
+	mini_stream = bytearray()
+	mini_fat = []
+	for entry in entries:
+		data = entry['data']
+		entry['start'] = 0
+		if entry['type'] == 2 and len(data) >= 4096:
+			entry['start'] = allocate(data, 512)
+		elif entry['type'] == 2 and data:
+			entry['start'] = len(mini_stream) // 64
+			mini_stream += data.ljust(-(-len(data) // 64) * 64, b'\x00')
+			mini_fat.extend(range(entry['start'] + 1, len(mini_stream) // 64))
+			mini_fat.append(END_OF_CHAIN)
+	entries[0]['start'] = allocate(bytes(mini_stream), 512)
+	entries[0]['data'] = mini_stream
+	mini_fat_sectors = -(-len(mini_fat) // 128)
+	mini_fat += [FREE_SECTOR] * (mini_fat_sectors * 128 - len(mini_fat))
+	mini_fat_start = allocate(struct.pack('<{0}I'.format(len(mini_fat)), *mini_fat), 512)
+
+	for entry in entries:
+		entry.setdefault('left', NO_STREAM)
+		entry.setdefault('right', NO_STREAM)
+		entry.setdefault('red', False)
+	for entry in entries:
+		entry['child'] = sibling_tree(entries, entry['children']) if entry['children'] else NO_STREAM
+	directory = bytearray()
+	for entry in entries:
+		name = entry['name'].encode('utf-16-le') + b'\x00\x00'
+		size = len(entry['data']) if entry['type'] != 1 else 0
+		directory += struct.pack('<64sHBBIII16sIQQIQ', name, len(name), entry['type'], 0 if entry['red'] else 1, entry['left'], entry['right'], entry['child'], b'', 0, 0, 0, entry['start'], size)
+	while len(directory) % 512:
+		directory += struct.pack('<64sHBBIII16sIQQIQ', b'', 0, 0, 0, NO_STREAM, NO_STREAM, NO_STREAM, b'', 0, 0, 0, 0, 0)
+	directory_start = allocate(bytes(directory), 512)
+
+	# The FAT also lists its own sectors and those of the DIFAT
+	fat_count, difat_count = 1, 0
+	while True:
+		needed_fat = -(-(len(sectors) + fat_count + difat_count) // 128)
+		needed_difat = max(0, -(-(needed_fat - 109) // 127))
+		if (needed_fat, difat_count) == (fat_count, needed_difat):
+			break
+		fat_count, difat_count = needed_fat, needed_difat
+	fat_start = len(sectors)
+	fat += [FAT_SECTOR] * fat_count + [DIFAT_SECTOR] * difat_count
+	fat += [FREE_SECTOR] * (fat_count * 128 - len(fat))
+	fat_sectors = list(range(fat_start, fat_start + fat_count))
+	for index in range(fat_count):
+		sectors.append(struct.pack('<128I', *fat[index * 128:(index + 1) * 128]))
+	difat_start = len(sectors) if difat_count else END_OF_CHAIN
+	listed = fat_sectors[109:]
+	for index in range(difat_count):
+		entries_of_sector = listed[index * 127:(index + 1) * 127]
+		entries_of_sector += [FREE_SECTOR] * (127 - len(entries_of_sector))
+		next_sector = len(sectors) + 1 if index + 1 < difat_count else END_OF_CHAIN
+		sectors.append(struct.pack('<128I', *(entries_of_sector + [next_sector])))
+
+	header_difat = fat_sectors[:109] + [FREE_SECTOR] * (109 - len(fat_sectors[:109]))
+	header = struct.pack('<8s16sHHHHH6sIIIIIIIII109I', b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', b'', 0x003E, 0x0003, 0xFFFE, 9, 6, b'',
+		0, fat_count, directory_start, 0, 4096, mini_fat_start, mini_fat_sectors, difat_start, difat_count, *header_difat)
+	return header + b''.join(sectors)
+
+"""
+Build a vbaProject.bin holding standard modules with about the given
+number of bytes of VBA source in total, so that extracting its macros
+takes as long as it would for a real project of that size. Modules are
+kept under 64 KB of source, as the VBA editor expects.
+"""
+def vba_project_bin(source_bytes, rng):
+	module_count = max(1, math.ceil(source_bytes / 60000))
+	module_names = ['Module{0}'.format(index) for index in range(1, module_count + 1)]
+	streams = {
+		'PROJECT': vba_project_stream(module_names, rng),
+		'VBA/_VBA_PROJECT': struct.pack('<HHBH', 0x61CC, 0xFFFF, 0, 0),
+		'VBA/dir': compress_vba(vba_dir_stream(module_names))
+	}
+	for name in module_names:
+		streams['VBA/' + name] = compress_vba(vba_module_code(name, source_bytes // module_count, rng))
+	return compound_file(streams)
+
+"""
+Write a synthetic workbook to the given path. The extension of the path
+decides between .xlsx and .xlsm. Media parts are filled with random 
+bytes of the requested size, and the VBA part is a valid VBA project
+holding about vba_bytes of module source, so that its macros are really
+extracted. The document properties and the calculation chain hold the fields that Excel
+changes on every save.
+"""
+def write_synthetic_workbook(path, sheets=1, rows=100, cols=10, media_bytes=0, media_count=1, vba_bytes=0, seed=0, core_modified='2024-01-01T00:00:00Z'):
+	rng = random.Random(seed)
+	shared_string_count = max(1, rows)
+	content_types = [CONTENT_TYPES_HEADER]
+	workbook_rels = []
+	sheet_entries = []
+
+	with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+		for index in range(1, sheets + 1):
+			content_types.append('<Override PartName="/xl/worksheets/sheet{0}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'.format(index))
+			workbook_rels.append('<Relationship Id="rId{0}" Type="{1}/worksheet" Target="worksheets/sheet{0}.xml"/>'.format(index, REL_NS))
+			sheet_entries.append('<sheet name="Sheet{0}" sheetId="{0}" r:id="rId{0}"/>'.format(index))
+
+		content_types.append('<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>')
+		content_types.append('<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>')
+		content_types.append('<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>')
+		content_types.append('<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>')
+		content_types.append('<Override PartName="/docProps/app.xml" ContentType="application/vnd.openxmlformats-officedocument.extended-properties+xml"/>')
+		if cols > 2:
+			content_types.append('<Override PartName="/xl/calcChain.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.calcChain+xml"/>')
+		if vba_bytes:
+			content_types.append('<Override PartName="/xl/vbaProject.bin" ContentType="application/vnd.ms-office.vbaProject"/>')
+		content_types.append('</Types>')
+		archive.writestr('[Content_Types].xml', ''.join(content_types))
+
+		archive.writestr('_rels/.rels', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="{0}"><Relationship Id="rId1" Type="{1}/officeDocument" Target="xl/workbook.xml"/><Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="docProps/core.xml"/><Relationship Id="rId3" Type="{1}/extended-properties" Target="docProps/app.xml"/></Relationships>'.format(PACKAGE_REL_NS, REL_NS))
+		archive.writestr('docProps/core.xml', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><dc:creator>benchmark</dc:creator><cp:lastModifiedBy>benchmark</cp:lastModifiedBy><dcterms:created xsi:type="dcterms:W3CDTF">2024-01-01T00:00:00Z</dcterms:created><dcterms:modified xsi:type="dcterms:W3CDTF">{0}</dcterms:modified></cp:coreProperties>'.format(core_modified))
+		archive.writestr('docProps/app.xml', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties" xmlns:vt="http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes"><Application>Microsoft Excel</Application><TotalTime>5</TotalTime><DocSecurity>0</DocSecurity><AppVersion>16.0300</AppVersion></Properties>')
+
+		rel_index = sheets
+		for extra in ['sharedStrings', 'styles']:
+			rel_index += 1
+			workbook_rels.append('<Relationship Id="rId{0}" Type="{1}/{2}" Target="{2}.xml"/>'.format(rel_index, REL_NS, extra))
+		if cols > 2:
+			rel_index += 1
+			workbook_rels.append('<Relationship Id="rId{0}" Type="{1}/calcChain" Target="calcChain.xml"/>'.format(rel_index, REL_NS))
+		if vba_bytes:
+			rel_index += 1
+			workbook_rels.append('<Relationship Id="rId{0}" Type="http://schemas.microsoft.com/office/2006/relationships/vbaProject" Target="vbaProject.bin"/>'.format(rel_index))
+
+		archive.writestr('xl/workbook.xml', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<workbook xmlns="{0}" xmlns:r="{1}"><sheets>{2}</sheets></workbook>'.format(SHEET_NS, REL_NS, ''.join(sheet_entries)))
+		archive.writestr('xl/_rels/workbook.xml.rels', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="{0}">{1}</Relationships>'.format(PACKAGE_REL_NS, ''.join(workbook_rels)))
+
+		for index in range(1, sheets + 1):
+			archive.writestr('xl/worksheets/sheet{0}.xml'.format(index), sheet_xml(rows, cols, shared_string_count, rng))
+
+		strings = ''.join('<si><t>Label {0} &amp; text</t></si>'.format(i) for i in range(shared_string_count))
+		archive.writestr('xl/sharedStrings.xml', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<sst xmlns="{0}" count="{1}" uniqueCount="{1}">{2}</sst>'.format(SHEET_NS, shared_string_count, strings))
+		archive.writestr('xl/styles.xml', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<styleSheet xmlns="{0}"><numFmts count="1"><numFmt numFmtId="164" formatCode="0.00"/></numFmts><fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts><fills count="1"><fill><patternFill patternType="none"/></fill></fills><borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders><cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs><cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs></styleSheet>'.format(SHEET_NS))
+
+		if cols > 2:
+			archive.writestr('xl/calcChain.xml', calc_chain_xml(sheets, rows, cols))
+
+		if media_bytes:
+			for index in range(1, media_count + 1):
+				archive.writestr('xl/media/image{0}.png'.format(index), rng.randbytes(media_bytes))
+		if vba_bytes:
+			archive.writestr('xl/vbaProject.bin', vba_project_bin(vba_bytes, rng))
+	return path
@@ -0,0 +1,81 @@
+import os
+import sys
+import zlib
+import random
+import zipfile
+import io
+import struct
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import version_xlsx
+
+"""
+Writes a workbook archive with members deflated on several threads, and
+with the serial fallback used where zipfile does not take members that
+were deflated by another thread. Every member is read back and its CRC
+compared with the CRC of the bytes that were written.
+"""
+
+def sample_parts():
+	rng = random.Random(1)
+	parts = [('[Content_Types].xml', b'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"/>')]
+	for i in range(6):
+		rows = ''.join('<row r="{0}"><c r="A{0}"><v>{1}</v></c></row>'.format(r, rng.random()) for r in range(3000 + i * 500))
+		parts.append(('xl/worksheets/sheet{0}.xml'.format(i + 1), '<worksheet><sheetData>{0}</sheetData></worksheet>'.format(rows).encode('utf-8')))
+	parts.append(('xl/media/image1.png', bytes(rng.getrandbits(8) for i in range(100000))))
+	parts.append(('xl/sharedStrings.xml', b'<sst>' + b'<si><t>text</t></si>' * 5000 + b'</sst>'))
+	return parts
+
+def write_archive(parts, workers, precompressed):
+	saved = (os.cpu_count, version_xlsx.ArchivePartWriter.precompressed_supported)
+	os.cpu_count = lambda: workers
+	version_xlsx.ArchivePartWriter.precompressed_supported = precompressed
+	try:
+		buffer = io.BytesIO()
+		# The shared strings are streamed as chunks, the way large parts are read from YML
+		streamed = [(name, iter([data[:50000], data[50000:]]) if name == 'xl/sharedStrings.xml' else data) for name, data in parts]
+		version_xlsx.write_workbook_archive(buffer, streamed, {'compression_profile': 'balanced'})
+		return buffer.getvalue()
+	finally:
+		os.cpu_count, version_xlsx.ArchivePartWriter.precompressed_supported = saved
+
+def check_crcs(archive_bytes, parts):
+	with zipfile.ZipFile(io.BytesIO(archive_bytes)) as archive:
+		assert archive.testzip() is None
+		assert archive.namelist() == [name for name, data in parts]
+		for name, data in parts:
+			info = archive.getinfo(name)
+			assert info.CRC == zlib.crc32(data), name
+			assert info.file_size == len(data), name
+			assert archive.read(name) == data, name
+		return dict((x.filename, (x.compress_type, x.compress_size)) for x in archive.infolist())
+
+def test_precompressed_deflate_works():
+	assert version_xlsx.precompressed_deflate_works()
+
+def test_parallel_and_serial_archives_match():
+	parts = sample_parts()
+	parallel = check_crcs(write_archive(parts, 4, True), parts)
+	serial = check_crcs(write_archive(parts, 4, False), parts)
+	assert parallel == serial
+	assert parallel['xl/media/image1.png'][0] == zipfile.ZIP_STORED
+
+# Whether the local header of each member holds an extra field, which is where zip64 sizes are kept
+def local_extra_lengths(archive_bytes):
+	with zipfile.ZipFile(io.BytesIO(archive_bytes)) as archive:
+		return dict((x.filename, struct.unpack('<H', archive_bytes[x.header_offset + 28:x.header_offset + 30])[0]) for x in archive.infolist())
+
+def test_zip64_only_for_unbounded_chunks():
+	data = b'\x89PNG' + bytes(range(256)) * 40
+	parts = [('[Content_Types].xml', b'<Types/>'), ('xl/media/image1.png', version_xlsx.PartChunks(iter([data]), len(data))), ('xl/embeddings/oleObject1.bin', iter([data]))]
+	buffer = io.BytesIO()
+	version_xlsx.write_workbook_archive(buffer, parts, {'compression_profile': 'fast'})
+	extras = local_extra_lengths(buffer.getvalue())
+	assert extras['xl/media/image1.png'] == 0
+	assert extras['xl/embeddings/oleObject1.bin'] > 0
+
+if __name__ == '__main__':
+	test_precompressed_deflate_works()
+	test_parallel_and_serial_archives_match()
+	test_zip64_only_for_unbounded_chunks()
+	print('Archive members match their CRCs with and without parallel deflate')
@@ -1,27 +1,89 @@
-from openpyxl import Workbook
-from openpyxl import load_workbook
 import json
-import yaml 
 import sys
 import zipfile
-import pathlib
-from lxml import etree 
+import posixpath
+import re
 import os
 import base64
+import binascii
 import shutil
-from oletools.olevba import VBA_Parser, TYPE_OLE, TYPE_OpenXML, TYPE_Word2003_XML, TYPE_MHTML
 import gzip
-from sys import exit
-import csv
 import time
+import subprocess
+import hashlib
+import collections
+import select
+import errno
+import struct
+import contextlib
+import zlib
+import io
+import itertools
+import threading
+
+# lxml, oletools, yaml, difflib and concurrent.futures are imported where they are first needed, so that runs with nothing to convert start quickly
 
 # Global setting to add an extra level of compression to binaries internal to the format
 setting_compress_binary = False
 
+# Name of the index file written into the folder of a workbook in the split layout
+SPLIT_INDEX_FILE = 'index.yml'
+
+# The part holding the VBA project of a macro enabled workbook, the only OLE part kept in memory while converting
+VBA_PROJECT_PART = 'xl/vbaProject.bin'
+
+# OLE files such as vbaProject.bin start with this signature
+OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# Raised whenever the format of the cached VBA modules changes, so that older cache files are ignored
+VBA_CACHE_VERSION = 1
+
+# Binary parts kept in the blob store are written into the YML file as this prefix followed by their hash
+BLOB_REFERENCE_PREFIX = 'blob:sha256:'
+
+"""
+Collects the time spent in each phase of a conversion, along with counts
+such as the number of parts and bytes read and written. The instance in
+conversion_metrics is reset before each file is converted, and its values
+are handed back to the main process, which writes them to the metrics 
+file when one is requested. Parts converted on several threads add their
+times together, so phases can add up to more than the elapsed time.
+"""
+class ConversionMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.phases = {}
+        self.counts = {}
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start_time)
+
+    def as_dict(self):
+        return {'phases': dict((k, round(v, 4)) for k, v in self.phases.items()), 'counts': dict(self.counts)}
+
+conversion_metrics = ConversionMetrics()
+
 """
-Configuration function for creating a temporary folder, which
-will store the output of the Excel workbooks as they are 
-decompressed. 
+Configuration function for naming the temporary folder that workbooks
+were originally extracted into. Workbooks are now read and written in 
+memory, but the name is still used as the root of every part key 
+written into the YML files.
 """
 def set_temp_folder():
     return 'output_dir'
@@ -38,27 +100,26 @@ def decompress_file(input_path, output_path):
         with open(output_path, 'wb') as f_out:
             shutil.copyfileobj(f_in, f_out)
 
-# Compress a file and place the output in the same location as the input file 
-def compress_file_in_place(input_path):
-    output_path = None
-    with open(input_path, 'rb') as f_in:
-        output_path = '{0}.gz'.format(input_path)
-        with gzip.open(output_path, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    os.rename(output_path, input_path)
+"""
+Build the YML key for a part of the workbook archive. Keys are rooted at
+the folder named by set_temp_folder and use the separator of the local
+platform, matching the paths the workbook used to be extracted to. Empty,
+current and parent directory components are dropped in the same way as 
+ZipFile.extractall would drop them.
+"""
+def workbook_part_key(temp_folder, member_name):
+    path_list = [x for x in member_name.split('/') if x not in ['', '.', '..']]
+    return os.path.join(temp_folder, *path_list)
 
-# Decompress a file and place the output in the same location as the input file 
-def decompress_file_in_place(input_path):
-    output_path = None
-    with gzip.open(input_path, 'rb') as f_in:
-        output_path = '{0}.gz'.format(input_path)
-        with open(output_path, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    os.rename(output_path, input_path)
+# Recover the name of the archive member from a YML part key
+def workbook_member_name(part_key):
+    path_list = part_key.split(os.path.sep)[1:]
+    return '/'.join(path_list)
+
+# XML parts are pretty printed into the YML file, everything else is stored as base64
+def is_xml_part(member_name):
+    file_name, file_extension = posixpath.splitext(posixpath.basename(member_name))
+    return file_extension in ['.xml', '.vml', '.rels'] or file_name in ['.rels']
 
 """
 Confirm if VBA code is actually present within a module. Modules
@@ -89,6 +150,658 @@ def delete_file_safe(input_file):
     except OSError:
         return False
 
+"""
+Name of the temporary file a generated file is written to before it is
+moved into place. The name holds the process id, so that the watch mode
+and a hook converting at the same time never write the same file.
+"""
+def temp_file_path(file_path):
+    return '{0}.{1}.tmp'.format(file_path, os.getpid())
+
+# Move a temporary file into place, a file that cannot be replaced, such as a workbook open in Excel, is reported as locked
+def replace_file_safe(temp_path, file_path):
+    try:
+        os.replace(temp_path, file_path)
+    except OSError:
+        delete_file_safe(temp_path)
+        return False
+    return True
+
+# Remove the temporary file of an output when writing it fails, leaving the previous output in place
+@contextlib.contextmanager
+def removing_on_error(temp_path):
+    try:
+        yield
+    except BaseException:
+        delete_file_safe(temp_path)
+        raise
+
+
+# Write pretty printed XML into the YML file as the indented lines of a part, a batch of lines at a time
+def write_xml_lines(output_yml, xml_text, indent='  ', cell_encoder=None, checksum=None):
+    lines = [line.strip() for line in xml_text.splitlines()]
+    if checksum is not None:
+        checksum.update_lines(lines)
+    if cell_encoder is not None:
+        lines = cell_encoder.encode_lines(lines)
+    for start in range(0, len(lines), 4096):
+        output_yml.write(''.join([indent + line + "\n" for line in lines[start:start + 4096]]))
+
+"""
+Read the size above which XML parts are streamed from the settings. The
+setting is given in megabytes, and is None when streaming is disabled.
+"""
+def stream_threshold_bytes(settings):
+    threshold = (settings or {}).get('stream_xml_over_mb', 32)
+    if threshold is None or threshold is False:
+        return None
+    return int(threshold * 1024 * 1024)
+
+# Whether an XML part is streamed rather than loaded whole, parts changed by the normalizer never are
+def streams_xml_part(zip_info, stream_xml_bytes, normalizer=None):
+    if stream_xml_bytes is None or zip_info.file_size <= stream_xml_bytes:
+        return False
+    return normalizer is None or not normalizer.applies(zip_info.filename)
+
+"""
+Read the number of threads converting the parts of a single workbook from
+the settings. Parts are converted one at a time by default, and 0 uses
+one thread per CPU core.
+"""
+def part_worker_count(settings):
+    workers = int((settings or {}).get('part_workers', 1) or 0)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+"""
+Raised when a streamed XML part contains something that the streaming
+serializer cannot reproduce exactly, such as text or comments between
+the top level elements. The part is then serialized from a full parse.
+"""
+class XmlStreamFallback(Exception):
+    pass
+
+XMLNS_DECLARATIONS = re.compile(r'^(<[^\s/>]+)((?:\s+xmlns(?::[^\s=]+)?="[^"]*")+)')
+XMLNS_DECLARATION = re.compile(r'\s+xmlns(?::([^\s=]+))?="([^"]*)"')
+
+"""
+lxml declares every namespace in scope on the outermost element when an
+element is serialized on its own. Remove the declarations that were only
+copied from the ancestors, so that the element reads exactly as it would
+inside a serialization of the whole document.
+"""
+def strip_inherited_namespaces(xml_text, element):
+    parent = element.getparent()
+    match = XMLNS_DECLARATIONS.match(xml_text)
+    if parent is None or match is None:
+        return xml_text
+
+    inherited = parent.nsmap
+    own_prefixes = [p for p, uri in element.nsmap.items() if p not in inherited or inherited[p] != uri]
+    kept = []
+    for declaration in XMLNS_DECLARATION.finditer(match.group(2)):
+        if declaration.group(1) in own_prefixes:
+            kept.append(declaration.group(0))
+    return match.group(1) + ''.join(kept) + xml_text[match.end():]
+
+"""
+Serialize the start tag of an element whose content has not been written
+yet. The parser may already have read part of the content, so the element
+is serialized as it stands and cut at the end of the start tag. libxml2 
+escapes '>' inside attribute values, so the first one closes the tag.
+"""
+def serialize_start_tag(element):
+    from lxml import etree
+    xml_text = etree.tostring(element, encoding=str, with_tail=False)
+    start_tag = xml_text[:xml_text.index('>') + 1]
+    if start_tag.endswith('/>'):
+        start_tag = start_tag[:-2] + '>'
+    return strip_inherited_namespaces(start_tag, element)
+
+"""
+Write an XML part into the YML file while it is being parsed, so that 
+memory use stays roughly constant however large the part is. The root
+element and its children (such as sheetData) are written as start and 
+end tags, and every element below them (such as a worksheet row) is 
+written in full once it has been parsed and is then discarded. The lines 
+written are the same as those of the full pretty printed document as 
+long as the two outer levels only hold elements. Anything else raises
+XmlStreamFallback before the part is complete. The one difference is that
+a namespace declared again, unchanged, on an inner element is dropped,
+which leaves the document equivalent.
+"""
+def write_xml_part_streaming(part_file, output_yml, indent='  ', cell_encoder=None, checksum=None):
+    from lxml import etree
+    events = etree.iterparse(part_file, events=('start', 'end'), huge_tree=True)
+    # Each open outer element holds [element, start tag, start tag written, last child written]
+    stack = []
+    depth = 0
+
+    for event, element in events:
+        if event == 'start':
+            depth += 1
+            if depth > 1 and depth <= 3:
+                entry = stack[-1]
+                parent = entry[0]
+                if not entry[2]:
+                    if parent.text is not None:
+                        raise XmlStreamFallback()
+                    write_xml_lines(output_yml, entry[1], indent, cell_encoder, checksum)
+                    entry[2] = True
+                if element.getprevious() is not entry[3]:
+                    raise XmlStreamFallback()
+                release_written_child(entry)
+            if depth <= 2:
+                stack.append([element, serialize_start_tag(element), False, None])
+            continue
+
+        if depth <= 2:
+            entry = stack.pop()
+            if entry[2]:
+                release_written_child(entry)
+                if len(element):
+                    raise XmlStreamFallback()
+                end_tag = '</{0}>'.format(entry[1][1:].split('>')[0].split()[0])
+                write_xml_lines(output_yml, end_tag, indent, cell_encoder, checksum)
+            else:
+                xml_text = etree.tostring(element, pretty_print=True, encoding=str, with_tail=False)
+                write_xml_lines(output_yml, strip_inherited_namespaces(xml_text, element), indent, cell_encoder, checksum)
+            if stack:
+                stack[-1][3] = element
+        elif depth == 3:
+            xml_text = etree.tostring(element, pretty_print=True, encoding=str, with_tail=False)
+            write_xml_lines(output_yml, strip_inherited_namespaces(xml_text, element), indent, cell_encoder, checksum)
+            tail = element.tail
+            element.clear()
+            element.tail = tail
+            stack[-1][3] = element
+        depth -= 1
+
+    root = events.root
+    if root.getprevious() is not None or root.getnext() is not None or root.getroottree().docinfo.doctype:
+        raise XmlStreamFallback()
+
+# Drop the last child written below an outer element once it is certain no text follows it
+def release_written_child(entry):
+    child = entry[3]
+    if child is None:
+        return
+    if child.tail is not None:
+        raise XmlStreamFallback()
+    entry[0].remove(child)
+    entry[3] = None
+
+"""
+Read the encoding of the cells of worksheet parts from the settings. The
+xml encoding writes the pretty printed XML of the sheet, while the cells
+encoding writes each cell of the sheetData element as a single line.
+"""
+def worksheet_encoding(settings):
+    encoding = (settings or {}).get('worksheet_encoding', 'xml')
+    if encoding not in ['xml', 'cells']:
+        raise ValueError('Unknown worksheet encoding: {0}'.format(encoding))
+    return encoding
+
+# Create the encoder for the cells of a part, only worksheets are encoded and only when shared strings were read for the cells encoding
+def part_cell_encoder(member_name, shared_strings):
+    if shared_strings is None or not member_name.startswith('xl/worksheets/') or not member_name.endswith('.xml'):
+        return None
+    return CellEncoder(shared_strings)
+
+# Written on the line after the sheetData start tag when the cells that follow are encoded
+CELLS_MARKER = '!cells'
+
+# The pretty printed lines of a cell holding any of a formula, a value and an inline string without rich text
+CELL_XML = re.compile(
+    r'^<c r="([A-Z]{1,3}[0-9]+)"((?: [A-Za-z_][\w:.-]*="[^"]*")*)(?:/>|>\n'
+    r'(?:<f((?: [A-Za-z_][\w:.-]*="[^"]*")*)(?:/>|>([^<\n]*)</f>)\n)?'
+    r'(?:<v>([^<\n]*)</v>\n|<v(/)>\n)?'
+    r'(?:<is>\n<t( xml:space="preserve")?>([^<\n]*)</t>\n</is>\n)?'
+    r'</c>)$', re.M)
+
+# A cell in the cells encoding, its attributes come first and are followed by the fields standing for its child elements
+CELL_LINE = re.compile(
+    r'^([A-Z]{1,3}[0-9]+)((?: (?!f[=.]|v=|is[=.])[A-Za-z_][\w:.-]*="[^"]*")*)'
+    r'((?: f\.[A-Za-z_][\w:.-]*="[^"]*")*)(?: f="([^"]*)")?(?: v="([^"]*)")?'
+    r'( is\.space="preserve")?(?: is="([^"]*)")?(?: # .*)?$', re.M)
+
+XML_ATTRIBUTE = re.compile(r' ([A-Za-z_][\w:.-]*="[^"]*")')
+FORMULA_FIELD = re.compile(r' f\.([A-Za-z_][\w:.-]*="[^"]*")')
+# Attributes of a cell whose names the fields standing for its child elements would be mistaken for
+FIELD_ATTRIBUTE = re.compile(r' (?:f[=.]|v=|is[=.])')
+# Lines inside sheetData that are neither XML nor a cell, such as the rest of a text spanning lines, are escaped with a backslash
+UNESCAPED_TEXT_LINE = re.compile(r'^(?=[^<])', re.M)
+ESCAPED_TEXT_LINE = re.compile(r'^\\', re.M)
+INVALID_CELL_LINE = re.compile(r'^[^<\\].*$', re.M)
+
+"""
+Read the text of each entry of the shared strings part, which is shown
+next to the index of string cells in the cells encoding. Runs of rich
+text are joined and phonetic hints are left out. The text is only there
+to be read, the index alone is used to rebuild the sheet.
+"""
+def read_shared_strings(zip_ref):
+    try:
+        zip_info = zip_ref.getinfo('xl/sharedStrings.xml')
+    except KeyError:
+        return []
+    with conversion_metrics.phase('shared_strings'), zip_ref.open(zip_info) as part_file:
+        return parse_shared_strings(part_file)
+
+# Read the text of each shared string from the sharedStrings part, leaving out phonetic runs
+def parse_shared_strings(part_file):
+    from lxml import etree
+    namespace = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+    shared_strings = []
+    for event, element in etree.iterparse(part_file, tag=namespace + 'si', huge_tree=True):
+        texts = [x.text or '' for x in element.iter(namespace + 't') if x.getparent().tag != namespace + 'rPh']
+        shared_strings.append(''.join(texts))
+        element.clear()
+    return shared_strings
+
+"""
+Encode the pretty printed lines of a cell matched by CELL_XML as a single
+line, which starts with the reference of the cell followed by its other
+attributes, and then its formula, value and inline string as fields in
+the same attribute syntax. For example
+
+    <c r="B2" s="1" t="s">
+    <v>4</v>
+    </c>
+
+is written as 'B2 s="1" t="s" v="4" # text of shared string 4'. Values
+keep their XML escaping, apart from double quotes, so that the line can
+be turned back into exactly the same lines. The few cells that a line
+cannot give back exactly, such as a cell with an empty formula element,
+an attribute named like one of the fields or text already holding an 
+escaped double quote, are left as XML.
+"""
+def encode_cell(match, shared_strings):
+    reference, attributes, formula_attributes, formula, value, empty_value, inline_space, inline_text = match.groups()
+    empty = formula_attributes is None and value is None and empty_value is None and inline_text is None
+    if (empty and not match.group(0).endswith('/>')) or (formula_attributes == '' and formula is None) or value == '' or FIELD_ATTRIBUTE.search(attributes) or '&quot;' in match.group(0):
+        conversion_metrics.count('xml_cells')
+        return match.group(0)
+    line = reference + attributes
+    if formula_attributes:
+        line += XML_ATTRIBUTE.sub(r' f.\1', formula_attributes)
+    if formula is not None:
+        line += ' f="' + formula.replace('"', '&quot;') + '"'
+    if value is not None:
+        line += ' v="' + value.replace('"', '&quot;') + '"'
+    elif empty_value:
+        line += ' v=""'
+    if inline_space:
+        line += ' is.space="preserve"'
+    if inline_text is not None:
+        line += ' is="' + inline_text.replace('"', '&quot;') + '"'
+    if value and ' t="s"' in attributes and value.isdigit() and int(value) < len(shared_strings):
+        line += ' # ' + '\\n'.join(shared_strings[int(value)].splitlines())
+    return line
+
+# Turn a line matched by CELL_LINE back into the pretty printed lines of the cell
+def decode_cell(match):
+    reference, attributes, formula_attributes, formula, value, inline_space, inline_text = match.groups()
+    cell = '<c r="' + reference + '"' + attributes
+    if not formula_attributes and formula is None and value is None and inline_text is None:
+        if inline_space:
+            raise ValueError('Invalid cell: {0}'.format(match.group(0)))
+        return cell + '/>'
+
+    cell += '>'
+    if formula_attributes:
+        formula_attributes = FORMULA_FIELD.sub(r' \1', formula_attributes)
+    if formula is not None:
+        cell += '\n<f' + formula_attributes + '>' + formula.replace('&quot;', '"') + '</f>'
+    elif formula_attributes:
+        cell += '\n<f' + formula_attributes + '/>'
+    if value:
+        cell += '\n<v>' + value.replace('&quot;', '"') + '</v>'
+    elif value is not None:
+        cell += '\n<v/>'
+    if inline_text is not None:
+        cell += '\n<is>\n<t' + (' xml:space="preserve"' if inline_space else '') + '>' + inline_text.replace('&quot;', '"') + '</t>\n</is>'
+    elif inline_space:
+        raise ValueError('Invalid cell: {0}'.format(match.group(0)))
+    return cell + '\n</c>'
+
+# Turn the lines between the sheetData tags of a worksheet written in the cells encoding back into XML
+def decode_cells_text(cells_text):
+    decoded = CELL_LINE.sub(decode_cell, cells_text)
+    invalid = INVALID_CELL_LINE.search(decoded)
+    if invalid:
+        raise ValueError('Invalid cell: {0}'.format(invalid.group(0)))
+    if '\\' in decoded:
+        decoded = ESCAPED_TEXT_LINE.sub('', decoded)
+    return decoded
+
+"""
+Rewrites the pretty printed lines of a worksheet part into the cells
+encoding as they are written. The lines between the sheetData tags are
+encoded a batch at a time, and lines outside of sheetData are written 
+unchanged. With the check_cells_encoding option, which is meant for 
+debugging, each batch is decoded again to make sure it gives back the 
+very same lines. Should it not, each cell is checked on its own and the
+cells that differ are written as XML.
+"""
+class CellEncoder:
+    # Set from the check_cells_encoding option by each conversion
+    checked = False
+
+    def __init__(self, shared_strings):
+        self.shared_strings = shared_strings
+        self.reset()
+
+    def reset(self):
+        self.state = 'before'
+
+    def encode_lines(self, lines):
+        if self.state == 'after':
+            return lines
+        start = 0
+        head = []
+        if self.state == 'before':
+            try:
+                start = lines.index('<sheetData>') + 1
+            except ValueError:
+                return lines
+            head = lines[:start] + [CELLS_MARKER]
+            self.state = 'cells'
+        try:
+            end = lines.index('</sheetData>', start)
+            self.state = 'after'
+        except ValueError:
+            end = len(lines)
+        if start == end:
+            return head + lines[end:]
+        encoded = self.encode_text('\n'.join(lines[start:end]))
+        return head + encoded.split('\n') + lines[end:]
+
+    def encode_text(self, cells_text):
+        escaped_text = cells_text
+        if UNESCAPED_TEXT_LINE.search(cells_text):
+            escaped_text = UNESCAPED_TEXT_LINE.sub(r'\\', cells_text)
+        encoded = CELL_XML.sub(lambda match: encode_cell(match, self.shared_strings), escaped_text)
+        if not CellEncoder.checked or decode_cells_text(encoded) == cells_text:
+            return encoded
+        conversion_metrics.count('cells_checked_separately')
+        return CELL_XML.sub(self.encode_checked_cell, escaped_text)
+
+    def encode_checked_cell(self, match):
+        encoded = encode_cell(match, self.shared_strings)
+        if decode_cells_text(encoded) == match.group(0):
+            return encoded
+        conversion_metrics.count('xml_cells')
+        return match.group(0)
+
+"""
+Turn a worksheet part written in the cells encoding back into its pretty
+printed XML. Parts without the marker after the sheetData start tag are
+returned unchanged.
+"""
+def decode_cell_lines(xml_text):
+    marker = '<sheetData>\n' + CELLS_MARKER + '\n'
+    start = xml_text.find(marker)
+    if start < 0:
+        return xml_text
+    region_start = start + len(marker)
+    end = xml_text.find('\n</sheetData>', region_start - 1)
+    if end < 0:
+        raise ValueError('The sheetData element of an encoded worksheet is not closed')
+    return xml_text[:start] + '<sheetData>\n' + decode_cells_text(xml_text[region_start:end]) + xml_text[end:]
+
+"""
+Applies the rules of the normalize_parts option, which remove the fields
+Excel changes on every save so that saving a workbook without changing 
+its data leaves its YML unchanged. Each rule names a part, either 
+exactly or as a pattern in the style of exclude_patterns, along with 
+any of these actions:
+
+    drop_part: True                          leave the part out
+    drop: [TotalTime]                        remove these elements
+    pin: {dcterms:modified: '2000-01-01...'} replace the text of these elements
+    sort: [{element: c, by: [i, r], inherit: [i]}]
+                                             sort these elements among their siblings
+
+Element names are written with the prefix the part uses, and a name 
+without a prefix matches in any namespace. Elements are sorted by the
+attributes given in by, comparing numbers by their value and cell 
+references by row and then by column. Attributes listed in inherit 
+default to the value of the previous element, as the sheet index does in
+calcChain.xml, so they are filled in before sorting and left out again 
+wherever they repeat. Parts that are left out are also removed from 
+[Content_Types].xml and from the relationships that point to them, so 
+that the rebuilt workbook stays valid, and Excel creates them again when
+it needs them.
+"""
+class PartNormalizer:
+    actions = ['part', 'drop_part', 'drop', 'pin', 'sort']
+
+    def __init__(self, rules, member_names):
+        self.rules = []
+        for rule in rules:
+            if not isinstance(rule, dict) or not rule.get('part') or any(x not in self.actions for x in rule):
+                raise ValueError('Invalid normalize_parts rule: {0}'.format(rule))
+            self.rules.append((str(rule['part']), compile_path_patterns([rule['part']]), rule))
+
+        self.dropped_parts = set(x for x in member_names if any(rule.get('drop_part') for rule in self.part_rules(x)))
+        # The relationships of a part that is left out go with it
+        for member_name in list(self.dropped_parts):
+            folder, name = posixpath.split(member_name)
+            rels_name = posixpath.join(folder, '_rels', name + '.rels')
+            if rels_name in member_names:
+                self.dropped_parts.add(rels_name)
+
+    def part_rules(self, member_name):
+        return [rule for part, patterns, rule in self.rules if part == member_name or matches_path_pattern(member_name, False, patterns)]
+
+    def drops(self, member_name):
+        return member_name in self.dropped_parts
+
+    # Parts that are changed are always parsed whole rather than streamed
+    def applies(self, member_name):
+        if self.dropped_parts and (member_name == '[Content_Types].xml' or member_name.endswith('.rels')):
+            return True
+        return any(x.get('drop') or x.get('pin') or x.get('sort') for x in self.part_rules(member_name))
+
+    def normalize(self, member_name, tree):
+        root = tree.getroot()
+        if self.dropped_parts:
+            self.remove_references(member_name, root)
+        for rule in self.part_rules(member_name):
+            for name in rule.get('drop') or []:
+                for element in find_named_elements(root, name):
+                    if element.getparent() is not None:
+                        element.getparent().remove(element)
+            for name, value in (rule.get('pin') or {}).items():
+                for element in find_named_elements(root, name):
+                    element.text = '' if value is None else str(value)
+            for sort in rule.get('sort') or []:
+                sort_named_elements(root, sort)
+
+    def remove_references(self, member_name, root):
+        if member_name == '[Content_Types].xml':
+            for element in list(root):
+                if (element.get('PartName') or '').lstrip('/') in self.dropped_parts:
+                    root.remove(element)
+        elif member_name.endswith('.rels'):
+            # The relationships in folder/_rels/ are those of a part in folder, and their targets are relative to it
+            source_folder = posixpath.dirname(posixpath.dirname(member_name))
+            for element in list(root):
+                target = element.get('Target')
+                if target is None or element.get('TargetMode') == 'External':
+                    continue
+                target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(source_folder, target))
+                if target in self.dropped_parts:
+                    root.remove(element)
+
+# Create the normalizer for the parts of an archive, there is none without rules in the settings
+def part_normalizer(settings, zip_ref):
+    rules = (settings or {}).get('normalize_parts')
+    if not rules:
+        return None
+    return PartNormalizer(rules, [x.filename for x in zip_ref.infolist() if not x.is_dir()])
+
+# Find the elements with a name written as prefix:name, or as a local name in any namespace
+def find_named_elements(root, name):
+    prefix, separator, local_name = str(name).rpartition(':')
+    return [x for x in root.iter('{*}' + local_name) if not prefix or x.prefix == prefix]
+
+NUMBER_RUN = re.compile('([0-9]+)')
+
+# Numbers in an attribute are compared by their value, and cell references by row and then by column
+def natural_sort_key(value):
+    value = value or ''
+    if value.isdigit():
+        return (1, ['', int(value), ''])
+    match = CELL_REFERENCE.fullmatch(value)
+    if match is not None:
+        return (0, int(match.group(2)), len(match.group(1)), match.group(1))
+    return (1, [int(x) if x.isdigit() else x for x in NUMBER_RUN.split(value)])
+
+def sort_named_elements(root, sort):
+    from lxml import etree
+    if not isinstance(sort, dict) or not sort.get('element'):
+        raise ValueError('Invalid sort in normalize_parts: {0}'.format(sort))
+    by = sort.get('by') or []
+    inherit = sort.get('inherit') or []
+    siblings = {}
+    for element in find_named_elements(root, sort['element']):
+        siblings.setdefault(element.getparent(), []).append(element)
+
+    for parent, elements in siblings.items():
+        if parent is None:
+            continue
+        # The values of inherited attributes are worked out before sorting and written back afterwards
+        values = {}
+        keys = {}
+        previous = {}
+        key_cache = {}
+        for element in elements:
+            for attribute in inherit:
+                value = element.get(attribute)
+                if value is not None:
+                    previous[attribute] = value
+            values[id(element)] = current = dict((x, previous.get(x)) for x in inherit) if inherit else {}
+            key = []
+            for attribute in by:
+                value = current[attribute] if attribute in current else element.get(attribute)
+                if value not in key_cache:
+                    key_cache[value] = natural_sort_key(value)
+                key.append(key_cache[value])
+            keys[id(element)] = key
+
+        ordered = []
+        # Elements with the same key are ordered by their markup, so that the order in the part never matters
+        for key, group in itertools.groupby(sorted(elements, key=lambda x: keys[id(x)]), key=lambda x: keys[id(x)]):
+            group = list(group)
+            ordered += sorted(group, key=etree.tostring) if len(group) > 1 else group
+
+        # Inherited attributes are written only where their value changes
+        previous = {}
+        for element in ordered:
+            for attribute, value in values[id(element)].items():
+                if value is None or value == previous.get(attribute):
+                    if attribute in element.attrib:
+                        del element.attrib[attribute]
+                elif element.get(attribute) != value:
+                    element.set(attribute, value)
+                previous[attribute] = value
+        ordered = iter(ordered)
+        parent[:] = [next(ordered) if id(x) in keys else x for x in list(parent)]
+
+"""
+Read the layout of the generated files from the settings. The single 
+layout writes one YML file per workbook, while the split layout writes a
+folder holding one file per workbook part and an index.
+"""
+def output_layout(settings):
+    if (settings or {}).get('output_layout', 'single') == 'split':
+        return 'split'
+    return 'single'
+
+# Name of the folder written for a workbook in the split layout
+def split_folder_path(workbook_path):
+    return '{0}.d'.format(workbook_path)
+
+"""
+Extract the VBA modules of a macro enabled workbook as the lines of the
+vba sections of the YML file. The same lines are written into the separate
+VBA file when that option is enabled. Like oletools, every OLE part of the
+archive is searched, which is normally only xl/vbaProject.bin. That part
+is returned as well so that it is not read from the archive twice, while
+other OLE parts, such as large embedded objects, are dropped once their
+modules are extracted and read from the archive again when written.
+"""
+def read_vba_sections(zip_ref, cache_dir=None):
+    vbaCodeList = []
+    ole_parts = {}
+    for zip_info in zip_ref.infolist():
+        if zip_info.is_dir() or is_xml_part(zip_info.filename):
+            continue
+        with zip_ref.open(zip_info) as part_file:
+            if part_file.read(len(OLE_MAGIC)) != OLE_MAGIC:
+                continue
+
+        data = zip_ref.read(zip_info)
+        if zip_info.filename == VBA_PROJECT_PART:
+            ole_parts[zip_info.filename] = data
+        for vba_filename, vba_code in extract_vba_modules(zip_info.filename, data, cache_dir):
+            vbaCodeList += ['vba: ' + "\n", '  filename: "{0}"\n'.format(vba_filename), '  code: |' + "\n"]
+            for line in vba_code.splitlines():
+                vbaCodeList += ['    {0}\n'.format(line)]
+    return vbaCodeList, ole_parts
+
+# Read the folder of the VBA module cache from the settings, there is no cache without settings
+def vba_cache_path(settings):
+    if settings is None:
+        return None
+    return settings.get('vba_cache_dir', '.git/version_xlsx_vba_cache') or None
+
+"""
+Extract the modules holding VBA code from an OLE part with oletools. The
+modules are cached under the hash of the part, as most saves of a workbook
+leave its macros untouched, and in that case oletools is not used at all.
+A cache that cannot be read or written only means extracting them again.
+"""
+def extract_vba_modules(member_name, data, cache_dir=None):
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, '{0}.json'.format(hashlib.sha256(data).hexdigest()))
+        try:
+            with open(cache_file, encoding="utf-8") as file:
+                cached = json.load(file)
+            if isinstance(cached, dict) and cached.get('version') == VBA_CACHE_VERSION:
+                conversion_metrics.count('vba_cache_hits')
+                return cached['modules']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    from oletools.olevba import VBA_Parser, OlevbaBaseException
+    modules = []
+    try:
+        vbaparser = VBA_Parser(member_name, data=data)
+        if vbaparser.detect_vba_macros():
+            for (filename, stream_path, vba_filename, vba_code) in vbaparser.extract_macros():
+                if screen_for_vba(vba_code):
+                    modules.append([vba_filename, vba_code])
+        vbaparser.close()
+    except OlevbaBaseException:
+        # oletools skips OLE parts that it cannot parse when reading a whole workbook
+        return []
+
+    if cache_file is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_path = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+            with open(temp_path, 'w', encoding="utf-8") as file:
+                json.dump({'version': VBA_CACHE_VERSION, 'modules': modules}, file)
+            os.replace(temp_path, cache_file)
+        except OSError:
+            pass
+    return modules
+
 """
 Function used to convert a workbook either XLSX or XLSM into YML.
 VBA code is parsed and separated into a secondary file if that 
@@ -96,260 +809,2990 @@ option has been selected in the configuration file. This would be
 called by a git pre-commit hook to convert spreadsheets before they
 are stored in the repo.
 """
-def write_workbook_to_yml(workbook_path, vba_convert):
+def write_workbook_to_yml(workbook_path, vba_convert, settings=None):
 
     fpath, extension  = os.path.splitext(workbook_path)
-    output_path = set_temp_folder()
 
     if extension not in ['.xlsm']:
         vba_convert = False
 
     ymlFilename = '{0}{1}.yml'.format(fpath, extension)
-    # Remove previously created YML file     
-    if not delete_file_safe(ymlFilename):
+    splitFolder = split_folder_path(workbook_path)
+    layout = output_layout(settings)
+
+    # Remove the YML file or the folder of a workbook that used the other layout, the outputs of this layout are replaced once written
+    if layout == 'split' and not delete_file_safe(ymlFilename):
         return False
+    if layout == 'single' and os.path.isdir(splitFolder):
+        try:
+            shutil.rmtree(splitFolder)
+        except OSError:
+            return False
+
+    stream_xml_bytes = stream_threshold_bytes(settings)
+    blob_store = binary_store_path(settings)
+    cells_encoding = worksheet_encoding(settings) == 'cells'
 
     vbaFilename = '{0}.vba'.format(fpath)
-    vbaCodeList = []
-    # Remove previously created VBA file    
+
+    conversion_metrics.count('bytes_in', os.path.getsize(workbook_path))
+
+    # Parts are read straight out of the archive in central directory order
+    with zipfile.ZipFile(workbook_path,"r") as zip_ref:
+        vbaCodeList = []
+        ole_parts = {}
+        if extension in ['.xlsm']:
+            with conversion_metrics.phase('vba'):
+                vbaCodeList, ole_parts = read_vba_sections(zip_ref, vba_cache_path(settings))
+        shared_strings = read_shared_strings(zip_ref) if cells_encoding else None
+        CellEncoder.checked = bool((settings or {}).get('check_cells_encoding', False))
+        normalizer = part_normalizer(settings, zip_ref)
+        part_workers = part_worker_count(settings)
+
+        if layout == 'split':
+            write_split_parts(zip_ref, splitFolder, extension, vbaCodeList, stream_xml_bytes, ole_parts, shared_strings, normalizer, part_workers)
+        else:
+            temp_path = temp_file_path(ymlFilename)
+            with removing_on_error(temp_path), open(temp_path, 'w', encoding="utf-8") as output_yml:
+                write_yml_document(zip_ref, output_yml, extension, vbaCodeList, stream_xml_bytes, blob_store, ole_parts, shared_strings, True, normalizer, part_workers)
+            if not replace_file_safe(temp_path, ymlFilename):
+                return False
+
     if vba_convert: 
-        if not delete_file_safe(vbaFilename):
+        temp_path = temp_file_path(vbaFilename)
+        with open(temp_path, 'w', encoding="utf-8") as output_vba:
+            for codeLine in vbaCodeList:
+                output_vba.write(codeLine)
+        if not replace_file_safe(temp_path, vbaFilename):
             return False
 
-    with zipfile.ZipFile(workbook_path,"r") as zip_ref:
-        zip_ref.extractall(output_path)
+    for output_path in workbook_output_paths(workbook_path, vba_convert, layout):
+        conversion_metrics.count('bytes_out', os.path.getsize(output_path))
+    return True
 
-    directory = pathlib.Path(output_path)
+"""
+Adds up the CRC32 and size of the content an XML part is rebuilt with,
+which is its lines joined by line breaks, from the lines written for it.
+The YML reader drops blank lines at the end of a block, so a part that
+ends with a blank line is given no checksum.
+"""
+class PartChecksum:
+    def __init__(self):
+        self.reset()
 
-    with open(ymlFilename, 'w', encoding="utf-8") as output_yml:
-        output_yml.write('options: ' + "\n")
-        output_yml.write('  extension: "{0}"\n'.format(extension))
+    def reset(self):
+        self.crc = 0
+        self.size = 0
+        self.ends_blank = False
 
-        if extension in ['.xlsm']:
-            vbaparser = VBA_Parser(workbook_path)
-            if vbaparser.detect_vba_macros():
-                for (filename, stream_path, vba_filename, vba_code) in vbaparser.extract_macros():
-                    if screen_for_vba(vba_code):
-                        vbaC1 = 'vba: ' + "\n"
-                        vbaC2 = '  filename: "{0}"\n'.format(vba_filename)
-                        vbaC3 = '  code: |' + "\n"
-                        output_yml.write(vbaC1)
-                        output_yml.write(vbaC2)
-                        output_yml.write(vbaC3)
-                        vbaCodeList += [vbaC1, vbaC2, vbaC3]
-
-                        for line in vba_code.splitlines():
-                            vbaC4 = '    {0}\n'.format(line)
-                            output_yml.write(vbaC4)
-                            vbaCodeList += [vbaC4]
-
-        for file_path in directory.rglob("*"):
-            file_name, file_extension = os.path.splitext(file_path)
-            if file_path.is_dir():
-                continue
+    def update_lines(self, lines):
+        if not lines:
+            return
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.ends_blank = lines[-1] == ''
 
-            if file_extension in ['.xml', '.vml', '.rels'] or file_path.stem in ['.rels']:
-                
-                temp = etree.parse(file_path) 
-                new_xml = etree.tostring(temp, pretty_print = True, encoding = str) # https://www.geeksforgeeks.org/pretty-printing-xml-in-python/
-                
-                output_yml.write(str(file_path) + ': |' + "\n")
-                for line in new_xml.splitlines():
-                    output_yml.write('  ' + line.strip() + "\n")
-            else:
-                if setting_compress_binary:
-                    compress_file_in_place(file_path)
+    def value(self):
+        if self.ends_blank:
+            return None
+        return (self.crc, self.size)
 
-                with open(file_path, 'rb') as binary_file:
-                    binary_file_data = binary_file.read()
-                    base64_encoded_data = base64.b64encode(binary_file_data)
-                    base64_message = base64_encoded_data.decode('utf-8')
+# The checksums section of a YML file starts with this line, and is the last section of the file
+CHECKSUMS_SECTION = 'checksums: '
 
-                output_yml.write(str(file_path) + ': |' + "\n")
-                output_yml.write('  ' + base64_message + "\n")
+"""
+Format the checksums of the parts of a workbook as the lines of the
+checksums section. Each part lists the CRC32 and size of the content it 
+is rebuilt with, followed by those of the part in the workbook it was 
+converted from when they differ. A workbook holding either of them for 
+every part would be converted into the same YML.
+"""
+def format_checksum_lines(checksums):
+    lines = [CHECKSUMS_SECTION + "\n"]
+    for member_name, pairs in checksums:
+        fields = []
+        for pair in pairs:
+            if pair is not None and '{0:08x} {1}'.format(*pair) not in fields:
+                fields.append('{0:08x} {1}'.format(*pair))
+        lines.append('  {0}: "{1}"\n'.format(json.dumps(member_name), ' '.join(fields)))
+    return lines
 
-    # Cleanup the temporary directory
-    shutil.rmtree(output_path)  
+# The checksums are only looked for at the end of the file, after the parts
+CHECKSUMS_TAIL_BYTES = 1024 * 1024
 
-    if vba_convert: 
-        with open(vbaFilename, 'w', encoding="utf-8") as output_vba:
-            for codeLine in vbaCodeList:
-                output_vba.write(codeLine)
+"""
+Read the checksums section from the end of a YML file in the single 
+layout without reading the parts before it. Returns None when the file
+does not end with a checksums section, such as a file written by an 
+earlier version, or one whose parts end too far from the end.
+"""
+def read_yml_checksums(inputFile):
+    with open(inputFile, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(max(size - CHECKSUMS_TAIL_BYTES, 0))
+        tail = file.read()
+    start = tail.rfind(b'\n' + CHECKSUMS_SECTION.rstrip().encode('utf-8'))
+    if start < 0:
+        return None
+    lines = tail[start + 1:].decode('utf-8').splitlines()
+    if lines[0].rstrip() != CHECKSUMS_SECTION.rstrip():
+        return None
+    checksums = {}
+    for line in lines[1:]:
+        if line.strip() == '':
+            continue
+        if not line.startswith('  "') or '": "' not in line:
+            return None
+        name, value = line.strip().rsplit(': ', 1)
+        checksums[json.loads(name)] = json.loads(value)
+    return checksums
 
+"""
+Check whether the workbook at a path already holds the parts described
+by the checksums of a YML file, comparing them with the CRC32 and size 
+of each member in the central directory of the workbook, without reading
+the members. Returns False when the workbook is missing or unreadable.
+"""
+def workbook_matches_checksums(workbook_path, checksums):
+    try:
+        with zipfile.ZipFile(workbook_path, "r") as zip_ref:
+            members = dict((x.filename, x) for x in zip_ref.infolist() if not x.is_dir())
+    except (OSError, zipfile.BadZipFile):
+        return False
+    if set(members) != set(checksums):
+        return False
+    for member_name, zip_info in members.items():
+        if format_checksum_pair(zip_info.CRC, zip_info.file_size) not in checksum_pairs(checksums[member_name]):
+            return False
     return True
 
+# The CRC32 and size pairs listed for a part in a checksums section
+def checksum_pairs(value):
+    fields = str(value).split()
+    return list(zip(fields[0::2], fields[1::2]))
+
+# A CRC32 and size as they are compared with the pairs of a checksums section
+def format_checksum_pair(crc, size):
+    return ('{0:08x}'.format(crc), str(size))
 
 """
-Function used to convert YML back into a workbook either either XLSX or XLSM 
-as specified by the YML file. This would be called by a git post-checkout 
-hook to convert spreadsheets before they are stored in the repo.
+Check whether the workbook at a path holds the parts decoded from a YML
+file, computing the CRC32 and size of each part as it is read. A part 
+matches when it is the same as the member of the workbook, or when both 
+are listed in its checksums, so that a part edited or merged without its
+checksums is never taken for the part the workbook holds. This reads 
+the parts but neither compresses nor writes them, and stops at the first
+part that differs.
+"""
+def workbook_holds_parts(workbook_path, parts, checksums):
+    try:
+        with zipfile.ZipFile(workbook_path, "r") as zip_ref:
+            members = dict((x.filename, format_checksum_pair(x.CRC, x.file_size)) for x in zip_ref.infolist() if not x.is_dir())
+    except (OSError, zipfile.BadZipFile):
+        return False
+    found = set()
+    with contextlib.closing(parts):
+        for member_name, content in parts:
+            if member_name not in members or member_name in found:
+                return False
+            crc = 0
+            size = 0
+            for data in [content] if isinstance(content, bytes) else content:
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+            pair = format_checksum_pair(crc, size)
+            pairs = checksum_pairs(checksums.get(member_name, ''))
+            if pair != members[member_name] and not (pair in pairs and members[member_name] in pairs):
+                return False
+            found.add(member_name)
+    return found == set(members)
+
+"""
+Yield every member of a workbook archive in order, along with the future
+of its converted XML when it is converted on a pool of threads, or None 
+when it is left for the caller to convert in turn. Parts that are loaded
+whole are converted by render, and a few of them are kept in flight 
+ahead of the member being written, as in ArchivePartWriter, so that the
+output is written in the same order whatever the number of threads.
+"""
+def iter_part_renders(zip_ref, workers, stream_xml_bytes, normalizer, render):
+    members = [x for x in zip_ref.infolist() if not x.is_dir()]
+    if workers <= 1:
+        for zip_info in members:
+            yield zip_info, None
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for zip_info in members:
+            future = None
+            if is_xml_part(zip_info.filename) and not streams_xml_part(zip_info, stream_xml_bytes, normalizer) and not (normalizer is not None and normalizer.drops(zip_info.filename)):
+                future = executor.submit(render, zip_info)
+            pending.append((zip_info, future))
+            while len(pending) > workers * 2:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+# Convert an XML part that is loaded whole into its lines, returning them with the checksum of the part
+def render_xml_part(zip_ref, zip_info, indent, shared_strings, normalizer):
+    checksum = PartChecksum()
+    output = io.StringIO()
+    write_xml_part(zip_ref, zip_info, output, None, '', indent, part_cell_encoder(zip_info.filename, shared_strings), checksum, normalizer)
+    return output.getvalue(), checksum
+
 """
-def convert_yml_to_workbook(inputFile):
+Write the options, the VBA sections and every part of a workbook in the
+single layout into an open YML file, followed by the checksums of the
+parts unless with_checksums is False. The file must support seek, so
+that a streamed XML part can be written again when it falls back to a
+full parse. Binary parts are written inline unless a blob store is
+given, and parts are normalized, or left out, by the normalizer when one
+is given. XML parts loaded whole are converted on part_workers threads.
+"""
+def write_yml_document(zip_ref, output_yml, extension, vbaCodeList, stream_xml_bytes, blob_store=None, ole_parts=None, shared_strings=None, with_checksums=True, normalizer=None, part_workers=1):
     temp_folder = set_temp_folder()
-    fpath0, extension0 = os.path.splitext(inputFile)
-    fpath, extension = os.path.splitext(fpath0)
+    ole_parts = ole_parts or {}
+    checksums = []
+    output_yml.write('options: ' + "\n")
+    output_yml.write('  extension: "{0}"\n'.format(extension))
+    output_yml.write(''.join(vbaCodeList))
 
-    with open(inputFile, encoding="utf-8") as file:
-        inputYML = yaml.safe_load(file)
+    render = lambda zip_info: render_xml_part(zip_ref, zip_info, '  ', shared_strings, normalizer)
+    for zip_info, rendered in iter_part_renders(zip_ref, part_workers, stream_xml_bytes, normalizer, render):
+        if normalizer is not None and normalizer.drops(zip_info.filename):
+            conversion_metrics.count('dropped_parts')
+            continue
 
-    outputExtension = inputYML['options']['extension']
-    outputFilePath = '{0}{1}'.format(fpath, outputExtension)
+        part_key = workbook_part_key(temp_folder, zip_info.filename)
 
-    if not delete_file_safe(outputFilePath):
-        return False
+        if rendered is not None:
+            xml_text, checksum = rendered.result()
+            with conversion_metrics.phase('write_yml'):
+                output_yml.write(part_key + ': |' + "\n")
+                output_yml.write(xml_text)
+            checksums.append((zip_info.filename, xml_part_checksums(zip_info, checksum, normalizer)))
+            continue
 
-    for key in inputYML:
-        if key.startswith(temp_folder):
-            
-            path_list = key.split(os.path.sep)[1:]
-            new_path = os.path.join(temp_folder, *path_list) 
-            
-            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        if is_xml_part(zip_info.filename):
+            cell_encoder = part_cell_encoder(zip_info.filename, shared_strings)
+            checksum = PartChecksum()
+            write_xml_part(zip_ref, zip_info, output_yml, stream_xml_bytes, part_key + ': |' + "\n", '  ', cell_encoder, checksum, normalizer)
+            checksums.append((zip_info.filename, xml_part_checksums(zip_info, checksum, normalizer)))
+            continue
 
-            if str(new_path).endswith(tuple(['.xml', '.vml', '.rels'])):
-                with open(new_path, "w", encoding="utf-8") as f:
-                    f.write(inputYML[key])
+        conversion_metrics.count('binary_parts')
+        checksums.append((zip_info.filename, [(zip_info.CRC, zip_info.file_size)]))
+        with open_binary_part(zip_ref, zip_info, ole_parts) as part_file:
+            if blob_store is not None:
+                with conversion_metrics.phase('blob_store'):
+                    blob_reference = store_blob(blob_store, part_file)
+                output_yml.write(part_key + ': |' + "\n")
+                output_yml.write('  ' + blob_reference + "\n")
             else:
-                with open(new_path, 'wb') as binary_file:
-                    encoded = inputYML[key].encode('utf-8')
-                    file_bytes = base64.b64decode(encoded)
-                    binary_file.write(file_bytes)
+                output_yml.write(part_key + ': |' + "\n")
+                with conversion_metrics.phase('base64'):
+                    write_base64_lines(output_yml, part_file)
 
-                if setting_compress_binary:
-                    decompress_file_in_place(new_path)
-            
-    # https://realpython.com/python-zipfile/#building-a-zip-file-from-a-directory
-    directory = pathlib.Path(temp_folder + '/')
-    with zipfile.ZipFile(outputFilePath, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
-        for file_path in directory.rglob("*"):
-            archive.write(
-                file_path,
-                arcname=file_path.relative_to(directory)
-            )
-
-    # Cleanup the temporary directory
-    shutil.rmtree(temp_folder)  
-
-    return True
+    if with_checksums:
+        output_yml.write(''.join(format_checksum_lines(checksums)))
 
-"""    
-This function confirms if the type of file that we have found when scanning 
-across the directories is a file that we can convert, and that the settings
-specified in the configuration file request that we convert the file
 """
-def validate_file_path(conversion_type, setting_convert_xlsx, setting_convert_xlsm, excluded_list, folder, file):
-    for x in excluded_list:
-        if folder.startswith(x):
-            return False
+The checksums recorded for an XML part, that of the part as it is rebuilt
+and that of the part in the workbook it was converted from. The latter is
+left out for parts changed by the normalizer, as it holds the very fields
+the normalizer removes, so a workbook saved again is rebuilt on checkout.
+"""
+def xml_part_checksums(zip_info, checksum, normalizer=None):
+    if normalizer is not None and normalizer.applies(zip_info.filename):
+        return [checksum.value()]
+    return [checksum.value(), (zip_info.CRC, zip_info.file_size)]
 
-    xlsx_ext = '.xlsx'
-    xlsm_ext = '.xlsm'
-    if conversion_type == 'convert_to_excel':
-        xlsx_ext = '.xlsx.yml'
-        xlsm_ext = '.xlsm.yml'
+# Open a binary part for reading, using the content of the VBA project when it was already read
+def open_binary_part(zip_ref, zip_info, ole_parts):
+    if zip_info.filename in ole_parts:
+        return io.BytesIO(ole_parts[zip_info.filename])
+    return zip_ref.open(zip_info)
 
-    if file.endswith(xlsx_ext) and setting_convert_xlsx:
-        return True
-    if file.endswith(xlsm_ext) and setting_convert_xlsm:
-        return True
-    
-    return False
+# Binary parts are written as base64 lines of 76 characters, each holding 57 bytes
+BASE64_LINE_BYTES = 57
 
+# Binary parts are read, compressed and encoded this many bytes at a time
+BINARY_CHUNK_BYTES = BASE64_LINE_BYTES * 16384
 
 """
-The main loop of the application after we have parsed input arguments.
-Here we read in the settings specified in the configuration file, and 
-then loop across all files in the repo to find files that need to be 
-converted in format. If we cannot convert some files due to permission
-locks, we report this to the calling function as an error. The results 
-of individual file operations are reported through a logging file if 
-this is enabled in the configuration file.
+Write the content of a binary part as indented base64 lines, reading it
+a chunk at a time so that memory use does not depend on the size of the
+part. The content is gzip compressed as it is read when 
+setting_compress_binary is set. An empty part is written as a single
+indented empty line.
 """
-def entry_point(conversion_type):
-    with open('version_sheet_settings.yml', encoding="utf-8") as file:
-        sheetSettings = yaml.safe_load(file)
+def write_base64_lines(output_yml, part_file, indent='  '):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31) if setting_compress_binary else None
+    pending = b''
+    written = False
+    line_chars = BASE64_LINE_BYTES // 3 * 4
+    while True:
+        data = part_file.read(BINARY_CHUNK_BYTES)
+        final = not data
+        if compressor is not None:
+            data = compressor.flush() if final else compressor.compress(data)
+        pending += data
+        usable = len(pending) if final else len(pending) - len(pending) % BASE64_LINE_BYTES
+        if usable:
+            encoded = base64.b64encode(pending[:usable]).decode('ascii')
+            pending = pending[usable:]
+            output_yml.write(''.join([indent + encoded[i:i + line_chars] + "\n" for i in range(0, len(encoded), line_chars)]))
+            written = True
+        if final:
+            break
+    if not written:
+        output_yml.write(indent + "\n")
 
-    # Read configuration settings
-    setting_enabled = sheetSettings['options']['enabled']
-    setting_convert_xlsx = sheetSettings['options']['convert_xlsx']
-    setting_convert_xlsm = sheetSettings['options']['convert_xlsm']
-    setting_convert_vba = sheetSettings['options']['convert_vba_separate_file']
-    setting_enable_logging = sheetSettings['options']['enable_logging']
-    setting_logfile = sheetSettings['options']['logfile']
-    setting_exclude_directories = sheetSettings['exclude_directories']
+"""
+Write the header line and the canonical form of an XML part at the current
+position of the output file. Very large parts are streamed, falling back 
+to a full parse if the layout requires it, in which case the output file 
+is truncated back to the start of the part first. The cells of worksheets
+are written in the cells encoding when a cell encoder is given, and the
+lines are added to the checksum of the part when one is given. Parts
+changed by the normalizer are always parsed in full.
+"""
+def write_xml_part(zip_ref, zip_info, output_file, stream_xml_bytes, header, indent='  ', cell_encoder=None, checksum=None, normalizer=None):
+    from lxml import etree
+    conversion_metrics.count('xml_parts')
+    part_start = output_file.tell()
+    output_file.write(header)
+    normalize = normalizer is not None and normalizer.applies(zip_info.filename)
+    if streams_xml_part(zip_info, stream_xml_bytes, normalizer):
+        try:
+            with conversion_metrics.phase('stream_xml'), zip_ref.open(zip_info) as part_file:
+                write_xml_part_streaming(part_file, output_file, indent, cell_encoder, checksum)
+            conversion_metrics.count('streamed_parts')
+            return
+        except XmlStreamFallback:
+            output_file.seek(part_start)
+            output_file.truncate()
+            output_file.write(header)
+            if cell_encoder is not None:
+                cell_encoder.reset()
+            if checksum is not None:
+                checksum.reset()
 
-    if not setting_enabled:
-        return 0
+    # Parts are parsed from memory, where lxml releases the GIL, so that parts converted on several threads overlap
+    with conversion_metrics.phase('parse_xml'):
+        temp = etree.fromstring(zip_ref.read(zip_info)).getroottree()
+    if normalize:
+        with conversion_metrics.phase('normalize'):
+            normalizer.normalize(zip_info.filename, temp)
+        conversion_metrics.count('normalized_parts')
+    with conversion_metrics.phase('pretty_print'):
+        new_xml = etree.tostring(temp, pretty_print = True, encoding = str) # https://www.geeksforgeeks.org/pretty-printing-xml-in-python/
+    with conversion_metrics.phase('write_yml'):
+        write_xml_lines(output_file, new_xml, indent, cell_encoder, checksum)
 
-    # Append the root directory to the path we retrieved from settings
-    rootdir = '.'
-    exclude_dir = [os.path.join(rootdir, x) for x in setting_exclude_directories]
+# Read the folder of the blob store from the settings, which is None when binary parts are written inline
+def binary_store_path(settings):
+    store = (settings or {}).get('binary_store')
+    if not store:
+        return None
+    return store
 
-    if setting_enable_logging:
-        logfile = open(setting_logfile, 'a', encoding="utf-8")
+# Binary parts are stored below a folder named after the first two characters of their hash
+def blob_path(blob_store, digest):
+    return os.path.join(blob_store, digest[:2], digest)
 
-    convertFailureCount = 0
+"""
+Add a binary part to the blob store and return the reference written into
+the YML file in its place. A part that is already in the store, from this
+or any other workbook, is not written again. The part is read from an
+open file and hashed a chunk at a time while it is written to a temporary
+file, which is then moved into place, so that workbooks converted in 
+parallel can share blobs.
+"""
+def store_blob(blob_store, part_file):
+    os.makedirs(blob_store, exist_ok=True)
+    digest = hashlib.sha256()
+    temp_path = os.path.join(blob_store, 'blob.{0}.tmp'.format(os.getpid()))
+    with open(temp_path, 'wb') as blob_file:
+        for data in iter(lambda: part_file.read(BINARY_CHUNK_BYTES), b''):
+            digest.update(data)
+            blob_file.write(data)
+    file_path = blob_path(blob_store, digest.hexdigest())
+    if os.path.isfile(file_path):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(temp_path, file_path)
+    return BLOB_REFERENCE_PREFIX + digest.hexdigest()
 
-    for subdir, dirs, files in os.walk(rootdir):
-        for file in files:
-            if validate_file_path(conversion_type, setting_convert_xlsx, setting_convert_xlsm, exclude_dir, subdir, file):
-                
-                filepath = os.path.join(subdir, file)
-                print(filepath)
-
-                start_time = time.time()
-                if conversion_type == 'convert_to_excel':
-                    convertResult = convert_yml_to_workbook(filepath)
-                else:
-                    convertResult = write_workbook_to_yml(filepath, setting_convert_vba)
+"""
+Read a binary part back from the blob store as chunks of bytes, the way
+base64 parts are decoded, so that a large blob is never held in memory 
+whole. The content is hashed again as it is read, and a damaged store 
+raises an error after the last chunk instead of producing a workbook 
+that Excel cannot open.
+"""
+def load_blob(blob_store, reference):
+    digest = reference[len(BLOB_REFERENCE_PREFIX):]
+    if not re.fullmatch('[0-9a-f]{64}', digest):
+        raise ValueError('Invalid blob reference: {0}'.format(reference))
+    if blob_store is None:
+        raise ValueError('The binary_store setting is required to read {0}'.format(reference))
+    file_path = blob_path(blob_store, digest)
+    return PartChunks(read_blob_chunks(file_path, digest), os.path.getsize(file_path))
 
-                end_time = time.time()
-                elapsed_time = round(end_time - start_time,3)
-                exec_time = time.ctime()
-                convertResultString = 'Success' if convertResult else 'Failure'
-                log_output = '{0} | {1} | {2} | Execution time: {3} seconds | {4}\n'.format(exec_time, conversion_type, convertResultString, elapsed_time, filepath)
+# Read a blob a chunk at a time, checking its hash once the last chunk has been read
+def read_blob_chunks(file_path, digest):
+    blob_hash = hashlib.sha256()
+    for data in read_file_chunks(file_path):
+        blob_hash.update(data)
+        yield data
+    if blob_hash.hexdigest() != digest:
+        raise ValueError('Blob {0} does not match its hash'.format(digest))
 
-                if not convertResult:
-                    convertFailureCount += 1
+"""
+Write a generated file only when its content changes. What is written is
+compared with the existing file as it arrives, and a temporary file is 
+only opened at the first difference, starting with the part of the 
+existing file that matched. An unchanged file is read once and left 
+untouched, so that its modification time is kept and git does not need 
+to hash it again. Text is written as UTF-8 without translating line 
+breaks, and the file supports the seek and truncate used by write_xml_part.
+"""
+class ChangedFileWriter:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.temp_path = temp_file_path(file_path)
+        self.existing = open(file_path, 'rb') if os.path.isfile(file_path) else None
+        self.temp = None
+        self.position = 0
+        self.changed = False
+        if self.existing is None:
+            self.start_temp()
 
-                if setting_enable_logging:
-                    logfile.write(log_output)
+    # Open the temporary file at the first difference, copying what matched so far
+    def start_temp(self):
+        self.temp = open(self.temp_path, 'wb')
+        if self.existing is not None:
+            self.existing.seek(0)
+            remaining = self.position
+            while remaining:
+                data = self.existing.read(min(remaining, BINARY_CHUNK_BYTES))
+                self.temp.write(data)
+                remaining -= len(data)
+            self.existing.close()
+            self.existing = None
 
-    if setting_enable_logging:
-        logfile.close()
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.temp is None and self.existing.read(len(data)) != data:
+            self.start_temp()
+        if self.temp is not None:
+            self.temp.write(data)
+        self.position += len(data)
 
-    if convertFailureCount > 0:
-        print('Could not convert {0} locked files.'.format(convertFailureCount))
-        return 1
-    return 0
+    def tell(self):
+        return self.position
 
+    def seek(self, position):
+        (self.existing if self.temp is None else self.temp).seek(position)
+        self.position = position
 
-""" 
-The global entry point for the application code is specified here. We parse 
-the input arguments and determnine the requested operation. This is then passed
-to the downstream functions for execution. If an error code is returned (indicated
-by a sys.exit code other than zero) then the git hook will also produce an error 
-and display an error message to the user. 
-"""
-if len(sys.argv) < 2:
-    sys.exit(1)
-
-input_arg = sys.argv[1]
-if input_arg in ['convert_to_excel', 'convert_to_yml']:
-    result = entry_point(input_arg)
-    sys.exit(result)
-elif input_arg in ['convert_to_yml_in_place']:
-    if len(sys.argv) != 3:
-        sys.exit(1)
-    input_file = sys.argv[2]
-    if input_file.endswith(('.xlsx', '.xlsm')):
-        result = write_workbook_to_yml(input_file, False)
-        os.remove(input_file)
-        sys.exit(0)
-else:
-    sys.exit(1)
+    # While still comparing, whatever follows in the existing file is found when the file is closed
+    def truncate(self):
+        if self.temp is not None:
+            self.temp.truncate()
 
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self.temp is None and self.existing.read(1) != b'':
+            self.start_temp()
+        if self.existing is not None:
+            self.existing.close()
+        if self.temp is not None:
+            self.temp.close()
+            if exc_type is not None:
+                delete_file_safe(self.temp_path)
+                return False
+            os.replace(self.temp_path, self.file_path)
+            self.changed = True
+        return False
 
+"""
+Write the parts of a workbook into a folder, one file per part, along
+with an index holding the options, the vba sections and the order of the
+parts in the archive. XML parts hold the same lines as in the single YML
+file, without the indentation, and binary parts are written as they are.
+Parts left out by the normalizer have no file, and XML parts loaded
+whole are converted on part_workers threads. Only the files whose
+content changed are rewritten, and files of parts that are no longer in
+the workbook are removed.
+"""
+def write_split_parts(zip_ref, splitFolder, extension, vbaCodeList, stream_xml_bytes, ole_parts=None, shared_strings=None, normalizer=None, part_workers=1):
+    ole_parts = ole_parts or {}
+    written_paths = set()
+    checksums = []
+    index_lines = ['options: ' + "\n", '  extension: "{0}"\n'.format(extension)] + vbaCodeList
+    index_lines.append('parts: ' + "\n")
+
+    render = lambda zip_info: render_xml_part(zip_ref, zip_info, '', shared_strings, normalizer)
+    for zip_info, rendered in iter_part_renders(zip_ref, part_workers, stream_xml_bytes, normalizer, render):
+        if normalizer is not None and normalizer.drops(zip_info.filename):
+            conversion_metrics.count('dropped_parts')
+            continue
+
+        part_path = workbook_part_key(splitFolder, zip_info.filename)
+        if part_path == os.path.join(splitFolder, SPLIT_INDEX_FILE) or part_path in written_paths:
+            raise ValueError('Part {0} cannot be written in the split layout'.format(zip_info.filename))
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+
+        if rendered is not None:
+            xml_text, checksum = rendered.result()
+            with conversion_metrics.phase('write_yml'), ChangedFileWriter(part_path) as part_file:
+                part_file.write(xml_text)
+            checksums.append((zip_info.filename, xml_part_checksums(zip_info, checksum, normalizer)))
+        elif is_xml_part(zip_info.filename):
+            checksum = PartChecksum()
+            with ChangedFileWriter(part_path) as part_file:
+                write_xml_part(zip_ref, zip_info, part_file, stream_xml_bytes, '', '', part_cell_encoder(zip_info.filename, shared_strings), checksum, normalizer)
+            checksums.append((zip_info.filename, xml_part_checksums(zip_info, checksum, normalizer)))
+        else:
+            conversion_metrics.count('binary_parts')
+            checksums.append((zip_info.filename, [(zip_info.CRC, zip_info.file_size)]))
+            with conversion_metrics.phase('write_yml'), open_binary_part(zip_ref, zip_info, ole_parts) as binary_file, ChangedFileWriter(part_path) as part_file:
+                shutil.copyfileobj(binary_file, part_file, BINARY_CHUNK_BYTES)
+
+        if not part_file.changed:
+            conversion_metrics.count('unchanged_parts')
+        written_paths.add(part_path)
+        index_lines.append('  - {0}\n'.format(json.dumps(zip_info.filename)))
+
+    index_lines += format_checksum_lines(checksums)
+    index_path = os.path.join(splitFolder, SPLIT_INDEX_FILE)
+    with ChangedFileWriter(index_path) as index_file:
+        index_file.write(''.join(index_lines))
+    written_paths.add(index_path)
+
+    # Remove the files of parts that were deleted from the workbook, and any folders left empty
+    for subdir, dirs, files in os.walk(splitFolder, topdown=False):
+        for file in files:
+            file_path = os.path.join(subdir, file)
+            if file_path not in written_paths:
+                os.remove(file_path)
+        if subdir != splitFolder and not os.listdir(subdir):
+            os.rmdir(subdir)
+
+
+"""
+Raised by the streaming YML reader when a file does not follow the exact
+layout written by write_workbook_to_yml, for instance after it has been
+edited by hand. The caller falls back to a full YAML loader in this case.
+"""
+class YmlLayoutError(ValueError):
+    pass
+
+# Plain YAML keys may not start with an indicator character or contain a comment or mapping marker
+def check_yml_key(key):
+    if key == '' or key != key.strip() or key[0] in '-?:,[]{}#&*!|>\'"%@`':
+        raise YmlLayoutError('Unexpected key: {0}'.format(key))
+    if ': ' in key or ' #' in key:
+        raise YmlLayoutError('Unexpected key: {0}'.format(key))
+    return key
+
+"""
+Parse the value of a single line mapping entry such as the workbook 
+extension. Double quoted strings without escapes are unquoted directly
+and any other scalar is handed to the YAML loader.
+"""
+def parse_yml_scalar(value):
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"' and '"' not in value[1:-1] and '\\' not in value:
+        return value[1:-1]
+    import yaml
+    return yaml.safe_load(value)
+
+"""
+Turn the lines of a literal block scalar ('key: |') indented by the given
+number of spaces into its text, following the YAML rules for the default
+clip chomping: blank lines inside the block are kept and trailing blank 
+lines are dropped, leaving a single final line break. The last line has
+no line break when the block ends the file without one.
+"""
+def parse_yml_block_lines(lines, indent, final_line_break=True):
+    prefix = ' ' * indent
+    content = []
+    blank_lines = 0
+    for line in lines:
+        if line.startswith(prefix) and len(line) > indent:
+            # YAML takes the indentation of a block from its first indented line
+            if line[indent] == ' ' and not content:
+                raise YmlLayoutError('Unexpected indentation in block')
+            content.extend([''] * blank_lines)
+            content.append(line[indent:])
+            blank_lines = 0
+        elif line.strip(' ') == '':
+            blank_lines += 1
+        else:
+            raise YmlLayoutError('Unexpected line in block: {0}'.format(line))
+
+    if not content:
+        return ''
+    text = '\n'.join(content)
+    if blank_lines or final_line_break:
+        text += '\n'
+    if '\x85' in text or '\u2028' in text or '\u2029' in text:
+        raise YmlLayoutError('Unexpected line break character in block')
+    return text
+
+"""
+Reads a YML file in large chunks rather than line by line. The options
+and vba sections are read a line at a time, but the parts that make up 
+nearly all of the file are cut out of the buffer as a single block and
+unindented with one string replacement whenever the block has the exact
+layout written by write_workbook_to_yml.
+"""
+class YmlReader:
+    chunk_size = 1024 * 1024
+    # A top level block ends at the first line that starts with something other than a space
+    block_end = re.compile(r'\n[^ \n]')
+    # Parts are written as lines with exactly two spaces of indentation and no blank lines
+    irregular_line = re.compile(r'\n(?!  [^ \n])')
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ''
+        self.pos = 0
+        self.pending_line = None
+
+    # The character before the current position is kept, as blocks are found by the line break that precedes them
+    def read_chunk(self):
+        chunk = self.file.read(self.chunk_size)
+        keep = max(self.pos - 1, 0)
+        self.buffer = self.buffer[keep:] + chunk
+        self.pos -= keep
+        return chunk != ''
+
+    def readline(self):
+        if self.pending_line is not None:
+            line, self.pending_line = self.pending_line, None
+            return line
+        end = self.buffer.find('\n', self.pos)
+        while end < 0:
+            if not self.read_chunk():
+                line, self.buffer, self.pos = self.buffer[self.pos:], '', 0
+                return line
+            end = self.buffer.find('\n', self.pos)
+        line = self.buffer[self.pos:end + 1]
+        self.pos = end + 1
+        return line
+
+    def unread(self, line):
+        self.pending_line = line
+
+    """
+    Read the literal block of a top level part, indented by two spaces. 
+    The block is collected a chunk at a time so that a large part is only
+    joined together once.
+    """
+    def read_part_block(self):
+        block = ''.join(self.iter_part_block())
+
+        if block == '':
+            return ''
+        final_line_break = block.endswith('\n')
+        body = '\n' + (block[:-1] if final_line_break else block)
+        if self.irregular_line.search(body) is None:
+            text = body.replace('\n  ', '\n')[1:]
+            if final_line_break:
+                text += '\n'
+            if '\x85' in text or '\u2028' in text or '\u2029' in text:
+                raise YmlLayoutError('Unexpected line break character in block')
+            return text
+        return parse_yml_block_lines(body[1:].split('\n'), 2, final_line_break)
+
+    """
+    Yield the raw text of the literal block of a top level part, with its
+    indentation, as it is read a chunk at a time. Used directly for binary 
+    parts, whose base64 lines are decoded without joining the block.
+    """
+    def iter_part_block(self):
+        if self.pending_line is not None:
+            self.buffer = '\n' + self.pending_line + self.buffer[self.pos:]
+            self.pos = 1
+            self.pending_line = None
+
+        start = self.pos
+        search_from = max(self.pos - 1, 0)
+        while True:
+            match = self.block_end.search(self.buffer, search_from)
+            if match:
+                end = match.start() + 1
+                self.pos = end
+                yield self.buffer[start:end]
+                return
+            self.pos = len(self.buffer)
+            yield self.buffer[start:]
+            if not self.read_chunk():
+                return
+            start = self.pos
+            search_from = self.pos - 1
+
+    """
+    Read a literal block nested inside a section, such as the code of a
+    VBA module, which is indented by the given number of spaces.
+    """
+    def read_nested_block(self, indent):
+        prefix = ' ' * indent
+        lines = []
+        final_line_break = True
+        line = self.readline()
+        while line:
+            text = line.rstrip('\n')
+            if text.strip(' ') != '' and not text.startswith(prefix):
+                self.unread(line)
+                break
+            lines.append(text)
+            final_line_break = line.endswith('\n')
+            line = self.readline()
+        return parse_yml_block_lines(lines, indent, final_line_break)
+
+"""
+Read a block of two space indented entries such as the options and vba
+sections. Entries either hold a single line scalar or a literal block
+indented by four spaces.
+"""
+def read_yml_mapping(reader):
+    mapping = {}
+    line = reader.readline()
+    while line:
+        text = line.rstrip('\n')
+        if text.strip(' ') == '':
+            line = reader.readline()
+            continue
+        if not text.startswith('  ') or text.startswith('   '):
+            reader.unread(line)
+            break
+
+        entry = text[2:]
+        if entry.endswith(': |'):
+            mapping[check_yml_key(entry[:-3])] = reader.read_nested_block(4)
+        else:
+            # Quoted keys are used for the member names in the checksums section
+            if entry.startswith('"') and '": ' in entry:
+                name, value = entry.split('": ', 1)
+                mapping[parse_yml_scalar(name + '"')] = parse_yml_scalar(value.strip())
+                line = reader.readline()
+                continue
+            if ': ' not in entry:
+                raise YmlLayoutError('Unexpected entry: {0}'.format(entry))
+            name, value = entry.split(': ', 1)
+            mapping[check_yml_key(name)] = parse_yml_scalar(value.strip())
+        line = reader.readline()
+    return mapping
+
+"""
+Stream a YML file written by write_workbook_to_yml one top level key at 
+a time, without building the whole document in memory. The file starts
+with the options section, optionally followed by vba sections, and then
+holds one literal block per workbook part. Sections yield a dictionary
+and parts yield their text. Parts whose key is accepted by stream_key
+instead yield an iterator over the raw text of their block, which is
+only valid until the next item is requested. A YmlLayoutError is raised
+as soon as the file departs from this layout.
+"""
+def iter_yml_document(file, stream_key=None):
+    reader = YmlReader(file)
+    first_key = True
+    line = reader.readline()
+    while line:
+        text = line.rstrip('\n')
+        if text.strip(' ') == '':
+            line = reader.readline()
+            continue
+        if text.startswith(' '):
+            raise YmlLayoutError('Unexpected indentation: {0}'.format(text))
+
+        if text.endswith(': |'):
+            key = check_yml_key(text[:-3])
+            streamed = stream_key is not None and stream_key(key)
+            value = reader.iter_part_block() if streamed else reader.read_part_block()
+        elif text.endswith(':') or text.endswith(': '):
+            key = check_yml_key(text.rstrip(' ')[:-1])
+            streamed = False
+            value = read_yml_mapping(reader)
+        else:
+            raise YmlLayoutError('Unexpected line: {0}'.format(text))
+
+        if first_key and key != 'options':
+            raise YmlLayoutError('The options section must come first')
+        first_key = False
+        yield key, value
+        # Whatever the caller did not read of a streamed block is skipped
+        if streamed:
+            for chunk in value:
+                pass
+        line = reader.readline()
+
+"""
+Load a complete YML file with the fastest YAML loader available. This is 
+only used for files that the streaming reader cannot handle, and prefers
+the libyaml based loader over the pure Python one when it is installed.
+"""
+def load_yml_document(file):
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(file, Loader=loader)
+
+"""
+Function used to convert YML back into a workbook either either XLSX or XLSM 
+as specified by the YML file. This would be called by a git post-checkout 
+hook to convert spreadsheets before they are stored in the repo.
+"""
+def convert_yml_to_workbook(inputFile, settings=None):
+    if os.path.basename(inputFile) == SPLIT_INDEX_FILE:
+        return convert_split_yml_to_workbook(inputFile, settings)
+
+    fpath0, extension0 = os.path.splitext(inputFile)
+    fpath, extension = os.path.splitext(fpath0)
+
+    conversion_metrics.count('bytes_in', os.path.getsize(inputFile))
+
+    checksums = read_yml_checksums(inputFile)
+
+    # Files in the layout written by this script are streamed a part at a time
+    try:
+        with open(inputFile, encoding="utf-8") as file:
+            key, options = next(iter_yml_document(file))
+        return write_workbook_from_yml(fpath, options, lambda: read_yml_items(inputFile), os.path.getsize(inputFile), settings, checksums)
+    except (YmlLayoutError, StopIteration):
+        pass
+
+    conversion_metrics.count('yaml_fallback')
+    with conversion_metrics.phase('read_yml'), open(inputFile, encoding="utf-8") as file:
+        inputYML = load_yml_document(file)
+    return write_workbook_from_yml(fpath, inputYML['options'], lambda: iter(inputYML.items()), os.path.getsize(inputFile), settings, inputYML.get('checksums'))
+
+# Stream the items of a YML file after its options, reading binary parts a chunk at a time
+def read_yml_items(inputFile):
+    with open(inputFile, encoding="utf-8") as file:
+        yml_items = iter_yml_document(file, is_binary_part_key)
+        next(yml_items)
+        for item in yml_items:
+            yield item
+
+"""
+Rebuild a workbook from the folder written in the split layout. The index
+is small and is loaded whole, and the part files are then read one at a
+time in the order the index lists them.
+"""
+def convert_split_yml_to_workbook(indexFile, settings=None):
+    splitFolder = os.path.dirname(indexFile)
+    fpath, extension = os.path.splitext(splitFolder[:-len('.d')])
+
+    conversion_metrics.count('bytes_in', os.path.getsize(indexFile))
+    with conversion_metrics.phase('read_yml'), open(indexFile, encoding="utf-8") as file:
+        index = load_yml_document(file)
+    return write_workbook_parts(fpath, index['options'], lambda: read_split_parts(splitFolder, index.get('parts') or []), settings, index.get('checksums'))
+
+"""
+The chunks of bytes of a binary part, along with the largest size the 
+part can have when it is known, so that an archive member written from 
+them only makes room for sizes over 2 GiB when the part may need it.
+"""
+class PartChunks:
+    def __init__(self, chunks, max_size=None):
+        self.chunks = iter(chunks)
+        self.max_size = max_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+# Read the part files of a workbook written in the split layout as member name and content pairs, binary parts are read as chunks of bytes
+def read_split_parts(splitFolder, member_names):
+    for member_name in member_names:
+        part_path = workbook_part_key(splitFolder, member_name)
+        if not is_xml_part(member_name):
+            conversion_metrics.count('bytes_in', os.path.getsize(part_path))
+            yield member_name, PartChunks(read_file_chunks(part_path), os.path.getsize(part_path))
+            continue
+        with conversion_metrics.phase('read_yml'), open(part_path, 'rb') as part_file:
+            file_bytes = part_file.read()
+        conversion_metrics.count('bytes_in', len(file_bytes))
+        if is_xml_part(member_name) and CELLS_MARKER.encode('utf-8') in file_bytes:
+            with conversion_metrics.phase('decode_cells'):
+                file_bytes = decode_cell_lines(file_bytes.decode('utf-8')).encode('utf-8')
+        yield member_name, file_bytes
+
+# Read a file a chunk at a time, so that a large binary part is never held in memory whole
+def read_file_chunks(file_path):
+    with open(file_path, 'rb') as part_file:
+        for data in iter(lambda: part_file.read(BINARY_CHUNK_BYTES), b''):
+            yield data
+
+# Binary parts are read from the YML file a chunk at a time
+def is_binary_part_key(key):
+    return key.startswith(set_temp_folder()) and not is_xml_part(workbook_member_name(key))
+
+"""
+Decode the parts of a YML file into member name and content pairs, binary
+parts are decoded as chunks of bytes unless they are read from the blob
+store. text_size is the size of the YML text holding the parts, which
+bounds the size of a binary part decoded from a streamed block.
+"""
+def decode_yml_parts(yml_items, blob_store=None, text_size=None):
+    temp_folder = set_temp_folder()
+    for key, value in timed_items(yml_items, 'read_yml'):
+        if not key.startswith(temp_folder) or not (isinstance(value, str) or hasattr(value, '__next__')):
+            continue
+
+        member_name = workbook_member_name(key)
+        if is_xml_part(member_name):
+            if CELLS_MARKER in value:
+                with conversion_metrics.phase('decode_cells'):
+                    value = decode_cell_lines(value)
+            file_bytes = value.encode('utf-8')
+        else:
+            text_chunks = iter([value]) if isinstance(value, str) else value
+            blob_reference, text_chunks = read_blob_reference(text_chunks)
+            if blob_reference is not None:
+                with conversion_metrics.phase('blob_store'):
+                    file_bytes = load_blob(blob_store, blob_reference)
+            else:
+                text_length = len(value) if isinstance(value, str) else text_size
+                # Base64 holds three bytes in every four characters, a compressed part can be any size
+                max_size = None if setting_compress_binary or text_length is None else text_length * 3 // 4
+                file_bytes = PartChunks(decode_base64_chunks(text_chunks), max_size)
+
+        yield member_name, file_bytes
+
+# The start of a binary block tells a blob reference from base64, and only a short block can be a reference
+def read_blob_reference(text_chunks):
+    head = ''
+    for chunk in text_chunks:
+        head += chunk
+        if len(head) > len(BLOB_REFERENCE_PREFIX) + 80:
+            break
+    if head.strip().startswith(BLOB_REFERENCE_PREFIX):
+        return (head + ''.join(text_chunks)).strip(), None
+    return None, itertools.chain([head], text_chunks)
+
+# Base64 decoding skips any other character, such as the line breaks and indentation of the block
+NON_BASE64_CHARACTERS = re.compile(r'[^A-Za-z0-9+/=]+')
+
+"""
+Decode the base64 text of a binary part given as an iterator of text
+chunks into chunks of bytes, decompressing them as they are decoded when
+setting_compress_binary is set. Only whole groups of four characters 
+are decoded at a time, the rest is kept for the next chunk.
+"""
+def decode_base64_chunks(text_chunks):
+    decompressor = None
+    pending = ''
+    for text in text_chunks:
+        start_time = time.perf_counter()
+        pending += text.replace('\n', '').replace(' ', '')
+        usable = len(pending) - len(pending) % 4
+        try:
+            data = base64.b64decode(pending[:usable], validate=True)
+        except binascii.Error:
+            # Lines edited by hand may hold other characters, which are skipped as before
+            pending = NON_BASE64_CHARACTERS.sub('', pending)
+            usable = len(pending) - len(pending) % 4
+            data = base64.b64decode(pending[:usable])
+        pending = pending[usable:]
+        # An empty part is written as an empty block even when compressing
+        if setting_compress_binary and data:
+            decompressor = decompressor or zlib.decompressobj(47)
+        if decompressor is not None:
+            data = decompressor.decompress(data)
+        conversion_metrics.add_time('base64', time.perf_counter() - start_time)
+        if data:
+            yield data
+    if pending:
+        raise ValueError('Incomplete base64 data')
+    if decompressor is not None:
+        data = decompressor.flush()
+        if not decompressor.eof:
+            raise ValueError('Incomplete compressed data')
+        if data:
+            yield data
+
+# Iterate over items while adding the time spent producing each one to a phase of the metrics
+def timed_items(items, phase):
+    iterator = iter(items)
+    while True:
+        start_time = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            conversion_metrics.add_time(phase, time.perf_counter() - start_time)
+        yield item
+
+# Write the workbook described by the options and the parts of a YML file of text_size bytes, read_items returns the items of the file each time it is called
+def write_workbook_from_yml(fpath, options, read_items, text_size, settings=None, checksums=None):
+    blob_store = binary_store_path(settings)
+    return write_workbook_parts(fpath, options, lambda: decode_yml_parts(read_items(), blob_store, text_size), settings, checksums)
+
+"""
+Write a workbook from its parts, which are written into the archive as 
+they arrive, except that Excel expects the content types part to be the 
+first member of the archive. Any parts that come before it are held back
+until it has been written. read_parts returns the parts each time it is
+called. When the checksums of the parts are given and the existing 
+workbook matches them, the parts are read once to check that they match
+as well, and the workbook is left untouched when they do. The workbook 
+is written to a temporary file first, and replaces the existing one once
+it is complete.
+"""
+def write_workbook_parts(fpath, options, read_parts, settings=None, checksums=None):
+    outputExtension = options['extension']
+    outputFilePath = '{0}{1}'.format(fpath, outputExtension)
+
+    # A workbook that already holds every part is left as it is
+    if checksums and workbook_matches_checksums(outputFilePath, checksums):
+        if workbook_holds_parts(outputFilePath, read_parts(), checksums):
+            conversion_metrics.count('unchanged_workbooks')
+            return True
+
+    temp_path = temp_file_path(outputFilePath)
+    with removing_on_error(temp_path):
+        write_workbook_archive(temp_path, read_parts(), settings)
+    conversion_metrics.count('bytes_out', os.path.getsize(temp_path))
+    return replace_file_safe(temp_path, outputFilePath)
+
+# Write the parts of a workbook into an archive at a path or in an open binary file, with the content types part first
+def write_workbook_archive(output, parts, settings=None):
+    level, parallel = compression_profile(settings)
+    held_parts = []
+    with zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=level) as archive:
+        writer = ArchivePartWriter(archive, level, parallel, store_extensions(settings))
+        for member_name, file_bytes in parts:
+            conversion_metrics.count('xml_parts' if is_xml_part(member_name) else 'binary_parts')
+            # Parts given as chunks of bytes are streamed into the archive, unless they have to be held back
+            if not isinstance(file_bytes, bytes):
+                if held_parts is None:
+                    writer.write_chunks(member_name, file_bytes)
+                    continue
+                file_bytes = b''.join(file_bytes)
+            if member_name == '[Content_Types].xml':
+                writer.write(member_name, file_bytes)
+                for held_name, held_bytes in held_parts or []:
+                    writer.write(held_name, held_bytes)
+                held_parts = None
+            elif held_parts is not None:
+                held_parts.append((member_name, file_bytes))
+            else:
+                writer.write(member_name, file_bytes)
+
+        # Without a content types part the held parts are written in their original order
+        for held_name, held_bytes in held_parts or []:
+            writer.write(held_name, held_bytes)
+        writer.close()
+
+# Compression level and whether large members are deflated in parallel, for each profile
+COMPRESSION_PROFILES = {
+    'fast': (1, False),
+    'balanced': (6, True),
+    'max': (9, True)
+}
+
+# Read the compression profile used to rebuild workbooks from the settings
+def compression_profile(settings):
+    profile = (settings or {}).get('compression_profile', 'balanced')
+    if profile not in COMPRESSION_PROFILES:
+        raise ValueError('Unknown compression profile: {0}'.format(profile))
+    return COMPRESSION_PROFILES[profile]
+
+# Read the extensions of parts that are already compressed, which are stored without compressing them again
+def store_extensions(settings):
+    extensions = (settings or {}).get('store_extensions', ['.png', '.jpg', '.jpeg', '.gif'])
+    return [x.lower() for x in extensions or []]
+
+# Deflate a member the same way as zipfile, so that the archive is identical whichever thread compressed it
+def deflate_member(file_bytes, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(file_bytes) + compressor.flush()
+
+"""
+Stands in for the compressor of a member opened for writing in a ZipFile,
+and hands over data that was already deflated by a worker thread. zipfile
+still computes the CRC and sizes from the uncompressed data.
+"""
+class PrecompressedDeflate:
+    def __init__(self, compressed):
+        self.compressed = compressed
+
+    def compress(self, data):
+        compressed, self.compressed = self.compressed, b''
+        return compressed
+
+    def flush(self):
+        return b''
+
+"""
+Check that zipfile takes data deflated by another thread. This relies on
+the private compressor of the file opened for writing, so a small member
+is written through it and read back. When this fails, members are
+deflated by zipfile one at a time instead.
+"""
+def precompressed_deflate_works():
+    data = b'version_xlsx ' * 64
+    compressed = deflate_member(data, 6)
+    buffer = io.BytesIO()
+    try:
+        with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+            zinfo = zipfile.ZipInfo('probe.xml')
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            zinfo.file_size = len(data)
+            with archive.open(zinfo, mode='w') as dest:
+                if not hasattr(dest, '_compressor'):
+                    return False
+                dest._compressor = PrecompressedDeflate(compressed)
+                dest.write(data)
+        with zipfile.ZipFile(buffer) as archive:
+            return archive.getinfo('probe.xml').compress_size == len(compressed) and archive.read('probe.xml') == data
+    except Exception:
+        return False
+
+"""
+Write members into a workbook archive in order. With a parallel profile, 
+members above PARALLEL_DEFLATE_BYTES are deflated by a pool of threads,
+as zlib releases the GIL while compressing, and a few members are kept
+in flight ahead of the one being written. Members with an extension in 
+the store list are written without compression. Where zipfile does not
+take members deflated by another thread, they are all deflated serially.
+"""
+class ArchivePartWriter:
+    PARALLEL_DEFLATE_BYTES = 64 * 1024
+    # Whether precompressed_deflate_works, checked once by the first parallel writer
+    precompressed_supported = None
+
+    def __init__(self, archive, level, parallel, store_list):
+        self.archive = archive
+        self.level = level
+        self.store_list = store_list
+        if parallel and ArchivePartWriter.precompressed_supported is None:
+            ArchivePartWriter.precompressed_supported = precompressed_deflate_works()
+        self.workers = min(os.cpu_count() or 1, 8) if parallel and ArchivePartWriter.precompressed_supported else 1
+        self.executor = None
+        if self.workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = collections.deque()
+
+    def write(self, member_name, file_bytes):
+        if posixpath.splitext(member_name)[1].lower() in self.store_list:
+            self.pending.append((member_name, file_bytes, zipfile.ZIP_STORED, None))
+        elif self.executor is not None and len(file_bytes) > self.PARALLEL_DEFLATE_BYTES:
+            future = self.executor.submit(deflate_member, file_bytes, self.level)
+            self.pending.append((member_name, file_bytes, zipfile.ZIP_DEFLATED, future))
+        else:
+            self.pending.append((member_name, file_bytes, zipfile.ZIP_DEFLATED, None))
+
+        while len(self.pending) > self.workers * 2:
+            self.write_next()
+
+    def write_next(self):
+        with conversion_metrics.phase('write_zip'):
+            self.write_member(*self.pending.popleft())
+
+    # Write a member from chunks of bytes as they arrive, after the members already in flight
+    def write_chunks(self, member_name, chunks):
+        # zipfile needs zip64 sizes up front for a member that grows past 2 GiB, which is only possible when the size is not bounded below that
+        max_size = getattr(chunks, 'max_size', None)
+        force_zip64 = max_size is None or max_size * 1.05 > zipfile.ZIP64_LIMIT
+        while self.pending:
+            self.write_next()
+        # Opened by name, the member is deflated at the level of the archive
+        zinfo = member_name
+        if posixpath.splitext(member_name)[1].lower() in self.store_list:
+            zinfo = zipfile.ZipInfo(member_name, date_time=time.localtime(time.time())[:6])
+            zinfo.compress_type = zipfile.ZIP_STORED
+            zinfo.external_attr = 0o600 << 16
+        with self.archive.open(zinfo, mode='w', force_zip64=force_zip64) as dest:
+            for data in chunks:
+                with conversion_metrics.phase('write_zip'):
+                    dest.write(data)
+
+    def write_member(self, member_name, file_bytes, compress_type, future):
+        if future is None:
+            self.archive.writestr(member_name, file_bytes, compress_type=compress_type)
+            return
+
+        zinfo = zipfile.ZipInfo(member_name, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = compress_type
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = len(file_bytes)
+        with self.archive.open(zinfo, mode='w') as dest:
+            dest._compressor = PrecompressedDeflate(future.result())
+            dest.write(file_bytes)
+
+    def close(self):
+        while self.pending:
+            self.write_next()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+"""
+Compute the SHA-256 digest of a file. The file is read in fixed size
+blocks so that large workbooks are never held in memory while hashing.
+"""
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+"""
+The manifest records the state of every workbook at the time it was last
+converted, along with the state of the files generated from it. It lets
+repeated runs skip workbooks that have not been edited since. A missing
+or unreadable manifest simply means that every workbook is converted.
+"""
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict):
+        return {}
+    return manifest
+
+"""
+Write the manifest through a temporary file so that an interrupted run
+never leaves a truncated manifest behind. Failing to save the manifest
+is not an error, the next run will just convert more workbooks.
+"""
+def save_manifest(manifest_path, manifest):
+    temp_path = temp_file_path(manifest_path)
+    try:
+        with open(temp_path, 'w', encoding="utf-8") as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+        os.replace(temp_path, manifest_path)
+    except OSError:
+        return False
+    return True
+
+"""
+List the files generated by write_workbook_to_yml for a workbook. In the
+split layout this is every file found in the folder of the workbook.
+"""
+def workbook_output_paths(workbook_path, vba_convert, layout='single'):
+    fpath, extension = os.path.splitext(workbook_path)
+    output_paths = ['{0}{1}.yml'.format(fpath, extension)]
+    if layout == 'split':
+        output_paths = []
+        for subdir, dirs, files in os.walk(split_folder_path(workbook_path)):
+            output_paths += [os.path.join(subdir, file) for file in files]
+        output_paths.sort()
+    if vba_convert and extension in ['.xlsm']:
+        output_paths.append('{0}.vba'.format(fpath))
+    return output_paths
+
+# Record the size, modification time and hash of a file for the manifest
+def file_state(file_path, file_hash=None):
+    stat = os.stat(file_path)
+    if file_hash is None:
+        file_hash = hash_file(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_hash}
+
+"""
+Compare a file against the state stored in the manifest. The size and
+modification time are checked first, and the file is only hashed when
+they differ. Returns None if the file no longer matches, otherwise the
+(possibly refreshed) state to store back into the manifest.
+"""
+def match_file_state(file_path, state):
+    if not isinstance(state, dict) or not os.path.isfile(file_path):
+        return None
+    stat = os.stat(file_path)
+    if stat.st_size != state.get('size'):
+        return None
+    if stat.st_mtime_ns == state.get('mtime_ns'):
+        return state
+    file_hash = hash_file(file_path)
+    if file_hash != state.get('sha256'):
+        return None
+    return file_state(file_path, file_hash)
+
+# Raised whenever the files written for a workbook change, so that workbooks converted by older versions are converted again
+OUTPUT_FORMAT_VERSION = 1
+
+"""
+Fingerprint of the settings that change the files written for a workbook,
+stored in its manifest entry. Workbooks converted with other settings, or
+by another version of the output format, are converted again even when
+they did not change. Settings are read as the conversion reads them, so 
+leaving out a setting and giving its default value are the same.
+"""
+def output_fingerprint(settings):
+    options = {
+        'version': OUTPUT_FORMAT_VERSION,
+        'compress_binary': setting_compress_binary,
+        'worksheet_encoding': worksheet_encoding(settings),
+        'normalize_parts': (settings or {}).get('normalize_parts') or None,
+        'binary_store': binary_store_path(settings),
+        'stream_xml_bytes': stream_threshold_bytes(settings)
+    }
+    return hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+"""
+Build the manifest entry for a workbook that has just been converted,
+covering the workbook itself and every file that was generated from it.
+"""
+def build_manifest_entry(workbook_path, vba_convert, layout='single', fingerprint=None):
+    outputs = {}
+    for output_path in workbook_output_paths(workbook_path, vba_convert, layout):
+        if os.path.isfile(output_path):
+            outputs[os.path.normpath(output_path)] = file_state(output_path)
+    return {
+        'workbook': file_state(workbook_path),
+        'vba_convert': vba_convert,
+        'layout': layout,
+        'fingerprint': fingerprint,
+        'outputs': outputs
+    }
+
+"""
+Confirm that a workbook and the files generated from it still match the
+manifest entry written when it was last converted, with the same output
+settings. The entry is updated in place when only modification times have
+moved, so that the next run can rely on the cheaper stat comparison again.
+"""
+def workbook_is_current(entry, workbook_path, vba_convert, layout='single', fingerprint=None):
+    if not isinstance(entry, dict) or entry.get('vba_convert') != vba_convert:
+        return False
+    if entry.get('layout', 'single') != layout or entry.get('fingerprint') != fingerprint:
+        return False
+
+    workbook_state = match_file_state(workbook_path, entry.get('workbook'))
+    if workbook_state is None:
+        return False
+
+    outputs = entry.get('outputs', {})
+    output_paths = workbook_output_paths(workbook_path, vba_convert, layout)
+    # Files added to the folder of a split workbook since it was converted are not in the entry
+    if len(output_paths) != len(outputs):
+        return False
+
+    output_states = {}
+    for output_path in output_paths:
+        output_key = os.path.normpath(output_path)
+        output_state = match_file_state(output_path, outputs.get(output_key))
+        if output_state is None:
+            return False
+        output_states[output_key] = output_state
+
+    entry['workbook'] = workbook_state
+    entry['outputs'] = output_states
+    return True
+
+"""    
+This function confirms if the type of file that we have found when scanning 
+across the directories is a file that we can convert, and that the settings
+specified in the configuration file request that we convert the file
+"""
+def validate_file_path(conversion_type, setting_convert_xlsx, setting_convert_xlsm, excluded_list, folder, file, exclude_patterns=None):
+    for x in excluded_list:
+        if folder.startswith(x):
+            return False
+
+    # The index of a split workbook stands for the YML file of the single layout
+    if conversion_type == 'convert_to_excel' and file == SPLIT_INDEX_FILE:
+        folder, file = os.path.split(os.path.normpath(folder))
+        file = '{0}.yml'.format(file[:-len('.d')]) if file.endswith('.d') else file
+
+    # Workbooks embedded in the parts of a split workbook are not converted on their own
+    if [x for x in os.path.normpath(folder).split(os.sep) if x.endswith(('.xlsx.d', '.xlsm.d'))]:
+        return False
+
+    xlsx_ext = '.xlsx'
+    xlsm_ext = '.xlsm'
+    if conversion_type == 'convert_to_excel':
+        xlsx_ext = '.xlsx.yml'
+        xlsm_ext = '.xlsm.yml'
+
+    if file.endswith(xlsx_ext) and setting_convert_xlsx:
+        return not matches_path_patterns(folder, file, exclude_patterns)
+    if file.endswith(xlsm_ext) and setting_convert_xlsm:
+        return not matches_path_patterns(folder, file, exclude_patterns)
+    
+    return False
+
+
+# List every file in the tree as a folder and file name pair
+def walk_candidate_files(rootdir):
+    for subdir, dirs, files in os.walk(rootdir):
+        for file in files:
+            yield subdir, file
+
+"""
+Compile gitignore style patterns, such as those of the exclude_patterns
+and materialize_patterns settings, into regular expressions matched
+against paths relative to the root of the repo. A pattern without a
+slash matches a file or folder of that name at any depth, and a pattern
+with a slash is anchored to the root. A pattern ending with a slash only
+matches folders. * and ? never match a slash, while ** matches any
+number of folders. Negated patterns are not supported. Each pattern is
+returned with whether it only matches folders.
+"""
+def compile_path_patterns(patterns):
+    compiled = []
+    for pattern in patterns or []:
+        pattern = str(pattern).strip()
+        if not pattern or pattern.startswith('#'):
+            continue
+        if pattern.startswith('!'):
+            raise ValueError('Negated patterns are not supported: {0}'.format(pattern))
+        folder_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+
+        regex = ''
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith('**/', i):
+                regex += '(?:.*/)?'
+                i += 3
+            elif pattern.startswith('**', i):
+                regex += '.*'
+                i += 2
+            elif pattern[i] == '*':
+                regex += '[^/]*'
+                i += 1
+            elif pattern[i] == '?':
+                regex += '[^/]'
+                i += 1
+            elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+                end = pattern.index(']', i + 2)
+                characters = pattern[i + 1:end]
+                if characters.startswith('!'):
+                    characters = '^' + characters[1:]
+                regex += '[' + characters.replace('\\', '\\\\') + ']'
+                i = end + 1
+            else:
+                regex += re.escape(pattern[i])
+                i += 1
+        if not anchored:
+            regex = '(?:.*/)?' + regex
+        compiled.append((re.compile(regex + '$'), folder_only))
+    return compiled
+
+# Whether a path relative to the root, using forward slashes, matches any of the compiled patterns
+def matches_path_pattern(relative_path, is_folder, patterns):
+    for regex, folder_only in patterns:
+        if (is_folder or not folder_only) and regex.match(relative_path):
+            return True
+    return False
+
+# Whether a file, or any of the folders above it, matches the compiled patterns
+def matches_path_patterns(folder, file, patterns):
+    if not patterns:
+        return False
+    path_list = [x for x in os.path.normpath(folder).split(os.sep) if x not in ['', '.']]
+    for i in range(len(path_list)):
+        if matches_path_pattern('/'.join(path_list[:i + 1]), True, patterns):
+            return True
+    return matches_path_pattern('/'.join(path_list + [file]), False, patterns)
+
+"""
+Whether the workbook rebuilt from a YML file, or from the index of a 
+split workbook, should be materialized. Workbooks matching the patterns
+are, and so are workbooks that already exist, so that a workbook that 
+was materialized on request is never left out of date by a checkout.
+"""
+def workbook_is_materialized(folder, file, patterns, include_existing=True):
+    if file == SPLIT_INDEX_FILE:
+        folder, file = os.path.split(os.path.normpath(folder))
+        file = file[:-len('.d')]
+    else:
+        file = file[:-len('.yml')]
+    if include_existing and os.path.isfile(os.path.join(folder, file)):
+        return True
+    return matches_path_patterns(folder, file, patterns)
+
+# Only files with these endings can be converted, so the scan cache does not record any other files
+SCAN_FILE_ENDINGS = ('.xlsx', '.xlsm', '.yml')
+
+# Folders whose modification time is this recent are not cached, as they could still change within the same timestamp
+SCAN_CACHE_RACY_SECONDS = 2.0
+
+"""
+List the files in the tree that could be converted as folder and file 
+name pairs. Excluded folders, either listed in exclude_directories or
+matched by exclude_patterns, are never entered. The folders of workbooks
+written in the split layout are not entered either, and only their index
+file is listed. When a scan cache is given, the folders and candidate 
+files of each folder are recorded along with its modification time, and
+a folder whose modification time has not changed since is not listed 
+again. Its subfolders are still checked, as changes inside them do not 
+change the modification time of the folder. The cache is updated in 
+place, and True is returned as the last value when it has changed.
+"""
+def scan_candidate_files(rootdir, exclude_dir, exclude_patterns=None, scan_cache=None):
+    scan_start_time = time.time()
+    candidates = []
+    cache_changed = False
+    visited = set()
+    stack = [(rootdir, '')]
+    while stack:
+        folder, relative_folder = stack.pop()
+        visited.add(relative_folder)
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+        except OSError:
+            continue
+
+        cached = scan_cache.get(relative_folder) if scan_cache is not None else None
+        if cached is not None and cached[0] == mtime_ns:
+            dirs, files = cached[1], cached[2]
+        else:
+            dirs = []
+            files = []
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.name)
+                        elif entry.name.endswith(SCAN_FILE_ENDINGS):
+                            files.append(entry.name)
+            except OSError:
+                continue
+            dirs.sort()
+            files.sort()
+            if scan_cache is not None:
+                if mtime_ns / 1e9 < scan_start_time - SCAN_CACHE_RACY_SECONDS:
+                    scan_cache[relative_folder] = [mtime_ns, dirs, files]
+                    cache_changed = True
+                elif scan_cache.pop(relative_folder, None) is not None:
+                    cache_changed = True
+
+        candidates += [(folder, file) for file in files]
+        for name in reversed(dirs):
+            subdir = os.path.join(folder, name)
+            relative_subdir = relative_folder + '/' + name if relative_folder else name
+            if [x for x in exclude_dir if subdir.startswith(x)] or matches_path_pattern(relative_subdir, True, exclude_patterns or []):
+                continue
+            # Only the index of a split workbook is needed, its parts are read when it is rebuilt
+            if name.endswith(('.xlsx.d', '.xlsm.d')):
+                if os.path.isfile(os.path.join(subdir, SPLIT_INDEX_FILE)):
+                    candidates.append((subdir, SPLIT_INDEX_FILE))
+                continue
+            stack.append((subdir, relative_subdir))
+
+    # Folders that were removed or are now excluded are dropped from the cache
+    if scan_cache is not None:
+        for relative_folder in [x for x in scan_cache if x not in visited]:
+            del scan_cache[relative_folder]
+            cache_changed = True
+    return candidates, cache_changed
+
+"""
+Run a git command in the current repository and return its output split
+on the NUL characters that separate paths when the -z option is used.
+Returns None if git is not available or the command fails, so that the
+caller can fall back to scanning the whole tree.
+"""
+def run_git_z(args):
+    try:
+        result = subprocess.run(['git'] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        print('git {0} failed, scanning all files instead'.format(args[0]))
+        return None
+    return [os.fsdecode(x) for x in result.stdout.split(b'\0') if x]
+
+# Convert a path reported by git into a folder and file name pair below the root directory
+def split_git_path(rootdir, git_path):
+    folder, file = posixpath.split(git_path)
+    return os.path.join(rootdir, *folder.split('/')) if folder else rootdir, file
+
+"""
+List the workbooks that git reports as changed in the working tree, using
+a single git status call. Workbooks are normally listed in .gitignore, and
+git cannot tell whether an ignored file has changed, so ignored workbooks
+are always listed. The manifest used by incremental conversion then skips
+the ones that have not changed since they were last converted.
+"""
+def list_changed_workbooks(rootdir):
+    entries = run_git_z(['status', '--porcelain=v1', '-z', '--untracked-files=all', '--ignored=matching', '--', '*.xlsx', '*.xlsm'])
+    if entries is None:
+        return None
+
+    candidates = []
+    skip_next = False
+    for entry in entries:
+        if skip_next:
+            skip_next = False
+            continue
+        status, git_path = entry[:2], entry[3:]
+        # Renames and copies are followed by the original path, which is not needed
+        if 'R' in status or 'C' in status:
+            skip_next = True
+        if os.path.isfile(git_path):
+            candidates.append(split_git_path(rootdir, git_path))
+    return candidates
+
+"""
+List the YML files that differ between the commits before and after a
+checkout, using a single git diff call, so that only the workbooks that 
+changed are rebuilt. There is no previous commit on the first checkout
+of a clone, which git reports as a ref made of zeros, and in that case
+None is returned so that every workbook is rebuilt.
+"""
+def list_checkout_yml_files(rootdir, from_ref, to_ref):
+    if from_ref.strip('0') == '':
+        return None
+    entries = run_git_z(['diff', '--name-only', '-z', '--no-renames', from_ref, to_ref, '--', '*.xlsx.yml', '*.xlsm.yml', '*.xlsx.d/*', '*.xlsm.d/*'])
+    if entries is None:
+        return None
+
+    # A change to any part of a split workbook means rebuilding it from its index
+    yml_paths = []
+    for git_path in entries:
+        path_list = git_path.split('/')
+        for i, x in enumerate(path_list[:-1]):
+            if x.endswith(('.xlsx.d', '.xlsm.d')):
+                git_path = '/'.join(path_list[:i + 1] + [SPLIT_INDEX_FILE])
+                break
+        if git_path not in yml_paths and os.path.isfile(git_path):
+            yml_paths.append(git_path)
+    return [split_git_path(rootdir, git_path) for git_path in yml_paths]
+
+# The files that hold the YML of a workbook in either layout, so that switching layouts also stages the removal of the old files
+def workbook_stage_paths(workbook_path, vba_convert):
+    fpath, extension = os.path.splitext(workbook_path)
+    stage_paths = ['{0}{1}.yml'.format(fpath, extension), split_folder_path(workbook_path)]
+    if vba_convert and extension in ['.xlsm']:
+        stage_paths.append('{0}.vba'.format(fpath))
+    return stage_paths
+
+"""
+Stage the given files and folders with a single git add call, instead of
+adding the whole working tree. The paths are passed on stdin as literal
+pathspecs, so that there is no limit on their number and names holding
+wildcard characters are not expanded. Git cannot add a path that does 
+not exist, so the paths that were removed are instead dropped from the
+index with a single git rm call, which leaves paths that were never 
+tracked alone. Returns False when git fails.
+"""
+def stage_paths(paths):
+    existing_paths = [os.path.normpath(x) for x in paths if os.path.exists(x)]
+    missing_paths = [os.path.normpath(x) for x in paths if not os.path.exists(x)]
+    for args, pathspecs in [(['add', '--all'], existing_paths), (['rm', '--cached', '-r', '-q', '--ignore-unmatch'], missing_paths)]:
+        if not pathspecs:
+            continue
+        stdin = b'\0'.join(os.fsencode(':(literal)' + x) for x in pathspecs)
+        try:
+            result = subprocess.run(['git'] + args + ['--pathspec-from-file=-', '--pathspec-file-nul'], input=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            print('Could not run git {0}: {1}'.format(args[0], e))
+            return False
+        if result.returncode != 0:
+            print('git {0} failed: {1}'.format(args[0], result.stderr.decode('utf-8', 'replace').strip()))
+            return False
+    return True
+
+"""
+Peak resident set size of the current process in megabytes, or None 
+where it cannot be measured. On Linux this is the high water mark since
+reset_peak_rss was last called, elsewhere it is the peak of the whole 
+process so far.
+"""
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status', encoding="utf-8") as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    if sys.platform == 'darwin':
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+# Reset the peak resident set size to the current one, so that the peak of each file is measured on its own, only possible on Linux
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return False
+    return True
+
+# Append records to the metrics file as JSON Lines, one object per line
+def write_metrics_records(metrics_path, records):
+    with open(metrics_path, 'a', encoding="utf-8") as metrics_file:
+        for record in records:
+            metrics_file.write(json.dumps(record, sort_keys=True) + "\n")
+
+"""
+Build the summary record of a run from the records of the files it 
+converted. Phase times and counts are added up across files, and the 
+slowest files are listed so that they stand out across many runs.
+"""
+def build_run_summary(conversion_type, file_records, run_phases, elapsed_time, jobs):
+    results = {}
+    phases = {}
+    counts = {}
+    peaks = [peak_rss_mb()]
+    for record in file_records:
+        results[record['result']] = results.get(record['result'], 0) + 1
+        for name, value in record.get('phases', {}).items():
+            phases[name] = round(phases.get(name, 0.0) + value, 4)
+        for name, value in record.get('counts', {}).items():
+            counts[name] = counts.get(name, 0) + value
+        peaks.append(record.get('peak_rss_mb'))
+
+    slowest = sorted([x for x in file_records if x['result'] != 'Skipped'], key=lambda x: x['seconds'], reverse=True)[:5]
+    return {
+        'type': 'run',
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'conversion_type': conversion_type,
+        'jobs': jobs,
+        'seconds': elapsed_time,
+        'files': results,
+        'run_phases': dict((k, round(v, 4)) for k, v in run_phases.items()),
+        'phases': phases,
+        'counts': counts,
+        'slowest_files': [{'file': x['file'], 'seconds': x['seconds']} for x in slowest],
+        'peak_rss_mb': max([x for x in peaks if x is not None] or [None])
+    }
+
+# Format a single line of the logging file
+def format_log_line(conversion_type, convertResultString, elapsed_time, filepath):
+    exec_time = time.ctime()
+    return '{0} | {1} | {2} | Execution time: {3} seconds | {4}\n'.format(exec_time, conversion_type, convertResultString, elapsed_time, filepath)
+
+"""
+Convert a single file and time the conversion. This runs either in the
+main process or in a worker process when several jobs are requested, so
+it only takes and returns plain values. Any error raised while converting
+is reported as a failure rather than stopping the other conversions. The
+manifest entry is None unless one was requested and the conversion worked.
+The metrics hold the time spent in each phase of the conversion.
+"""
+def convert_file_job(job_args):
+    conversion_type, filepath, vba_convert, record_manifest, settings = job_args
+    start_time = time.time()
+    manifest_entry = None
+    conversion_metrics.reset()
+    reset_peak_rss()
+    try:
+        if conversion_type == 'convert_to_excel':
+            convertResult = convert_yml_to_workbook(filepath, settings)
+        else:
+            convertResult = write_workbook_to_yml(filepath, vba_convert, settings)
+            if convertResult and record_manifest:
+                manifest_entry = build_manifest_entry(filepath, vba_convert, output_layout(settings), output_fingerprint(settings))
+    except Exception as e:
+        print('Error converting {0}: {1}'.format(filepath, e))
+        convertResult = False
+    end_time = time.time()
+    elapsed_time = round(end_time - start_time,3)
+    metrics = conversion_metrics.as_dict()
+    metrics['peak_rss_mb'] = peak_rss_mb()
+    return convertResult, elapsed_time, manifest_entry, metrics
+
+# Read the configuration file from the root of the repo
+def read_settings():
+    import yaml
+    with open('version_sheet_settings.yml', encoding="utf-8") as file:
+        return yaml.safe_load(file)
+
+"""
+Hold a lock file under .git while converting, so that the watch mode and
+a git hook started while it is converting wait for each other instead of
+writing the same files. Outside a git repo nothing is locked.
+"""
+@contextlib.contextmanager
+def conversion_lock(lock_path=os.path.join('.git', 'version_xlsx.lock')):
+    if not os.path.isdir(os.path.dirname(lock_path)):
+        yield
+        return
+    with open(lock_path, 'a+b') as lock_file:
+        if os.name == 'nt':
+            import msvcrt
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ten attempts, keep waiting for the other conversion
+                    pass
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+# Run a conversion while holding the conversion lock
+def entry_point(conversion_type, **kwargs):
+    with conversion_lock():
+        return convert_repo(conversion_type, **kwargs)
+
+"""
+The main loop of the application after we have parsed input arguments.
+Here we read in the settings specified in the configuration file, and 
+then loop across all files in the repo to find files that need to be 
+converted in format. If we cannot convert some files due to permission
+locks, we report this to the calling function as an error. The results 
+of individual file operations are reported through a logging file if 
+this is enabled in the configuration file. When rebuilding workbooks,
+materialize_patterns or the patterns given to the materialize command 
+limit which workbooks are rebuilt.
+"""
+def convert_repo(conversion_type, force=False, jobs=1, changed=False, from_ref=None, to_ref=None, metrics_file=None, paths=None, materialize=None, stage=False):
+    run_start_time = time.perf_counter()
+    sheetSettings = read_settings()
+
+    # Read configuration settings
+    setting_enabled = sheetSettings['options']['enabled']
+    setting_convert_xlsx = sheetSettings['options']['convert_xlsx']
+    setting_convert_xlsm = sheetSettings['options']['convert_xlsm']
+    setting_convert_vba = sheetSettings['options']['convert_vba_separate_file']
+    setting_enable_logging = sheetSettings['options']['enable_logging']
+    setting_logfile = sheetSettings['options']['logfile']
+    setting_exclude_directories = sheetSettings['exclude_directories']
+    setting_exclude_patterns = compile_path_patterns(sheetSettings.get('exclude_patterns'))
+    setting_scan_cache_file = sheetSettings['options'].get('scan_cache_file', '.git/version_xlsx_scan_cache.json')
+    setting_materialize_patterns = sheetSettings.get('materialize_patterns')
+    setting_incremental = sheetSettings['options'].get('incremental', True)
+    setting_manifest_file = sheetSettings['options'].get('manifest_file', '.git/version_xlsx_manifest.json')
+    setting_output_layout = output_layout(sheetSettings['options'])
+    setting_output_fingerprint = output_fingerprint(sheetSettings['options'])
+    setting_metrics_file = metrics_file or sheetSettings['options'].get('metrics_file')
+
+    if not setting_enabled:
+        return 0
+
+    # Append the root directory to the path we retrieved from settings
+    rootdir = '.'
+    exclude_dir = [os.path.join(rootdir, x) for x in setting_exclude_directories]
+
+    if setting_enable_logging:
+        logfile = open(setting_logfile, 'a', encoding="utf-8")
+
+    # Workbooks are only skipped when converting to YML, and never when forced
+    use_manifest = setting_incremental and not force and conversion_type == 'convert_to_yml'
+    manifest = load_manifest(setting_manifest_file) if setting_incremental else {}
+    loaded_manifest = json.dumps(manifest, sort_keys=True)
+
+    # Without materialize_patterns every workbook is rebuilt, while the materialize command only rebuilds the workbooks it was given
+    materialize_patterns = None
+    if conversion_type == 'convert_to_excel' and materialize is not None:
+        materialize_patterns = compile_path_patterns(materialize)
+    elif conversion_type == 'convert_to_excel' and setting_materialize_patterns is not None:
+        materialize_patterns = compile_path_patterns(setting_materialize_patterns)
+    not_materialized_count = 0
+
+    convertFailureCount = 0
+    pending = []
+    staged = []
+    stage_failed = False
+    metrics_records = []
+    run_metrics = ConversionMetrics()
+    scan_start_time = time.perf_counter()
+
+    # Ask git for the affected files when requested, otherwise scan the whole tree
+    candidates = None
+    if paths is not None:
+        candidates = [os.path.split(x) for x in paths]
+    elif changed and conversion_type == 'convert_to_yml':
+        candidates = list_changed_workbooks(rootdir)
+    elif from_ref and to_ref and conversion_type == 'convert_to_excel':
+        candidates = list_checkout_yml_files(rootdir, from_ref, to_ref)
+    if candidates is None:
+        # The scan cache is stored the same way as the manifest
+        scan_cache = load_manifest(setting_scan_cache_file) if setting_scan_cache_file else None
+        candidates, scan_cache_changed = scan_candidate_files(rootdir, exclude_dir, setting_exclude_patterns, scan_cache)
+        if scan_cache_changed:
+            with run_metrics.phase('save_scan_cache'):
+                save_manifest(setting_scan_cache_file, scan_cache)
+
+    for subdir, file in candidates:
+        if validate_file_path(conversion_type, setting_convert_xlsx, setting_convert_xlsm, exclude_dir, subdir, file, setting_exclude_patterns):
+            
+            if materialize_patterns is not None and not workbook_is_materialized(subdir, file, materialize_patterns, materialize is None):
+                not_materialized_count += 1
+                continue
+
+            filepath = os.path.join(subdir, file)
+            manifest_key = os.path.normpath(filepath)
+
+            if use_manifest and workbook_is_current(manifest.get(manifest_key), filepath, setting_convert_vba, setting_output_layout, setting_output_fingerprint):
+                if setting_enable_logging:
+                    logfile.write(format_log_line(conversion_type, 'Skipped', 0.0, filepath))
+                metrics_records.append({'type': 'file', 'conversion_type': conversion_type, 'file': filepath, 'result': 'Skipped', 'seconds': 0.0})
+                # The YML of a skipped workbook may have been written by an earlier run and not staged yet
+                staged += workbook_stage_paths(filepath, setting_convert_vba)
+                continue
+
+            print(filepath)
+            pending.append(filepath)
+
+    run_metrics.add_time('scan', time.perf_counter() - scan_start_time)
+    convert_start_time = time.perf_counter()
+    if not_materialized_count and materialize is None:
+        print('{0} workbooks are not materialized, use materialize to rebuild them.'.format(not_materialized_count))
+
+    record_manifest = setting_incremental and conversion_type == 'convert_to_yml'
+    job_args = [(conversion_type, filepath, setting_convert_vba, record_manifest, sheetSettings['options']) for filepath in pending]
+
+    if jobs > 1 and len(pending) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as executor:
+            results = list(executor.map(convert_file_job, job_args))
+    else:
+        results = [convert_file_job(args) for args in job_args]
+    run_metrics.add_time('convert', time.perf_counter() - convert_start_time)
+
+    for filepath, (convertResult, elapsed_time, manifest_entry, metrics) in zip(pending, results):
+        if record_manifest:
+            manifest_key = os.path.normpath(filepath)
+            if manifest_entry is not None:
+                manifest[manifest_key] = manifest_entry
+            else:
+                manifest.pop(manifest_key, None)
+
+        if not convertResult:
+            convertFailureCount += 1
+        else:
+            staged += workbook_stage_paths(filepath, setting_convert_vba)
+
+        convertResultString = 'Success' if convertResult else 'Failure'
+        if setting_enable_logging:
+            logfile.write(format_log_line(conversion_type, convertResultString, elapsed_time, filepath))
+
+        metrics['type'] = 'file'
+        metrics['time'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        metrics['conversion_type'] = conversion_type
+        metrics['file'] = filepath
+        metrics['result'] = convertResultString
+        metrics['seconds'] = elapsed_time
+        metrics_records.append(metrics)
+
+    if setting_enable_logging:
+        logfile.close()
+
+    # Only the files written for the workbooks of this run are staged, along with any new blobs of the binary store
+    if stage and conversion_type == 'convert_to_yml':
+        blob_store = binary_store_path(sheetSettings['options'])
+        if staged and blob_store:
+            staged.append(blob_store)
+        with run_metrics.phase('stage'):
+            stage_failed = bool(staged) and not stage_paths(staged)
+
+    # A run that found nothing to convert leaves the manifest untouched
+    if record_manifest and json.dumps(manifest, sort_keys=True) != loaded_manifest:
+        with run_metrics.phase('save_manifest'):
+            save_manifest(setting_manifest_file, manifest)
+
+    # Metrics are only written when requested, and failing to write them does not fail the hook
+    if setting_metrics_file:
+        elapsed_time = round(time.perf_counter() - run_start_time, 3)
+        metrics_records.append(build_run_summary(conversion_type, metrics_records, run_metrics.phases, elapsed_time, jobs))
+        try:
+            write_metrics_records(setting_metrics_file, metrics_records)
+        except OSError as e:
+            print('Could not write metrics to {0}: {1}'.format(setting_metrics_file, e))
+
+    if convertFailureCount > 0:
+        print('Could not convert {0} locked files.'.format(convertFailureCount))
+        return 1
+    if stage_failed:
+        print('Could not stage the converted files.')
+        return 1
+    return 0
+
+
+"""
+Watches a folder tree for workbooks that are written, using the inotify
+interface of the Linux kernel through ctypes. Every folder is watched, 
+and folders created later are added as they appear. Excluded folders,
+folders matching exclude_patterns and the folders of workbooks written 
+in the split layout are skipped. Running out of watches raises OSError
+with ENOSPC, from the constructor or from read_paths.
+"""
+class InotifyWatcher:
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, rootdir, exclude_dir, exclude_patterns=None):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.exclude_dir = exclude_dir
+        self.exclude_patterns = exclude_patterns
+        self.folders = {}
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        try:
+            self.add_tree(rootdir)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add_tree(self, folder):
+        for subdir, dirs, files in os.walk(folder):
+            dirs[:] = [x for x in dirs if not watch_skips_folder(os.path.join(subdir, x), self.exclude_dir, self.exclude_patterns)]
+            self.add_folder(subdir)
+
+    def add_folder(self, folder):
+        import ctypes
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for {0}'.format(folder))
+        self.folders[wd] = folder
+
+    """
+    Wait up to timeout seconds, or forever if it is None, and return the 
+    paths of the workbooks written meanwhile. None is returned when the
+    kernel dropped events, in which case the whole tree must be scanned.
+    """
+    def read_paths(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+            folder = self.folders.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and not watch_skips_folder(path, self.exclude_dir, self.exclude_patterns):
+                    self.add_tree(path)
+                    # Workbooks may have been written into the folder before it was watched
+                    paths += [os.path.join(subdir, file) for subdir, file in walk_candidate_files(path) if watch_matches_file(file)]
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO) and watch_matches_file(name):
+                paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+"""
+Watches a folder tree by comparing the size and modification time of 
+every workbook at a fixed interval. This is used where inotify is not 
+available, and returns the paths of the workbooks that changed.
+"""
+class PollingWatcher:
+    def __init__(self, rootdir, exclude_dir, interval, exclude_patterns=None):
+        self.rootdir = rootdir
+        self.exclude_dir = exclude_dir
+        self.exclude_patterns = exclude_patterns
+        self.interval = interval
+        self.states = self.scan()
+
+    def scan(self):
+        states = {}
+        for subdir, dirs, files in os.walk(self.rootdir):
+            dirs[:] = [x for x in dirs if not watch_skips_folder(os.path.join(subdir, x), self.exclude_dir, self.exclude_patterns)]
+            for file in files:
+                if watch_matches_file(file):
+                    path = os.path.join(subdir, file)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    states[path] = (stat.st_size, stat.st_mtime_ns)
+        return states
+
+    def read_paths(self, timeout):
+        time.sleep(self.interval)
+        states = self.scan()
+        paths = [path for path, state in states.items() if self.states.get(path) != state]
+        self.states = states
+        return paths
+
+    def close(self):
+        pass
+
+# Excluded folders, folders matching the compiled exclude patterns and the folders of split workbooks are never watched
+def watch_skips_folder(folder, exclude_dir, exclude_patterns=None):
+    for x in exclude_dir:
+        if folder.startswith(x):
+            return True
+    if folder.endswith(('.xlsx.d', '.xlsm.d')):
+        return True
+    # Folders are walked from the root, so only the folder itself needs to be matched
+    relative_folder = '/'.join(x for x in os.path.normpath(folder).split(os.sep) if x not in ['', '.'])
+    return matches_path_pattern(relative_folder, True, exclude_patterns or [])
+
+# Workbooks are watched, but not the lock files that Excel keeps next to open workbooks
+def watch_matches_file(file):
+    return file.endswith(('.xlsx', '.xlsm')) and not file.startswith('~$')
+
+"""
+Stay resident and convert workbooks to YML as soon as they are saved, so
+that the pre-commit hook finds them already converted and only needs to
+confirm it through the manifest. Workbooks written in quick succession 
+are converted together once no more changes arrive for settle seconds.
+inotify is used on Linux, and other platforms poll the tree every 
+interval seconds, as does Linux once the inotify watches allowed for the
+user run out. Runs until interrupted with Ctrl+C.
+"""
+def watch(jobs=1, interval=2.0, settle=1.0):
+    sheetSettings = read_settings()
+
+    rootdir = '.'
+    exclude_dir = [os.path.join(rootdir, x) for x in sheetSettings['exclude_directories']]
+    exclude_patterns = compile_path_patterns(sheetSettings.get('exclude_patterns'))
+
+    watcher = None
+    if sys.platform.startswith('linux'):
+        try:
+            watcher = InotifyWatcher(rootdir, exclude_dir, exclude_patterns)
+        except (OSError, AttributeError) as e:
+            print('inotify is not available, polling for changes instead: {0}'.format(e))
+    if watcher is None:
+        watcher = PollingWatcher(rootdir, exclude_dir, interval, exclude_patterns)
+
+    print('Watching for saved workbooks, press Ctrl+C to stop.')
+    # Workbooks saved while nothing was watching are caught up first
+    entry_point('convert_to_yml', jobs=jobs)
+
+    pending = set()
+    try:
+        while True:
+            try:
+                paths = watcher.read_paths(settle if pending else None)
+            except OSError as e:
+                # New folders cannot be watched once the limit of fs.inotify.max_user_watches is reached
+                if e.errno != errno.ENOSPC or isinstance(watcher, PollingWatcher):
+                    raise
+                print('Warning: ran out of inotify watches, polling for changes instead: {0}'.format(e))
+                watcher.close()
+                watcher = PollingWatcher(rootdir, exclude_dir, interval, exclude_patterns)
+                paths = None
+            if paths is None:
+                pending = set()
+                entry_point('convert_to_yml', jobs=jobs)
+            elif paths:
+                pending.update(paths)
+            elif pending:
+                entry_point('convert_to_yml', jobs=jobs, paths=sorted(x for x in pending if os.path.isfile(x)))
+                pending = set()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        watcher.close()
+
+# Largest payload of a single packet in the pkt-line format used by git filter processes
+PKT_LINE_MAX_DATA = 65516
+
+"""
+Read one packet in git's pkt-line format, which is a four digit hex 
+length, counting the length itself, followed by the payload. A flush
+packet is returned as None, and EOFError is raised once git closes the
+stream between packets.
+"""
+def read_pkt_line(stream):
+    header = stream.read(4)
+    if not header:
+        raise EOFError()
+    if len(header) < 4:
+        raise ValueError('Truncated packet header')
+    length = int(header, 16)
+    if length == 0:
+        return None
+    if length < 4:
+        raise ValueError('Invalid packet length: {0}'.format(length))
+    data = b''
+    while len(data) < length - 4:
+        chunk = stream.read(length - 4 - len(data))
+        if not chunk:
+            raise ValueError('Truncated packet')
+        data += chunk
+    return data
+
+# Read text packets up to the next flush packet, without their line endings
+def read_pkt_text_list(stream):
+    lines = []
+    while True:
+        data = read_pkt_line(stream)
+        if data is None:
+            return lines
+        lines.append(data.decode('utf-8').rstrip('\n'))
+
+# Read the content sent as binary packets up to the next flush packet
+def read_pkt_content(stream):
+    chunks = []
+    while True:
+        data = read_pkt_line(stream)
+        if data is None:
+            return b''.join(chunks)
+        chunks.append(data)
+
+def write_pkt_flush(stream):
+    stream.write(b'0000')
+
+def write_pkt_text_list(stream, lines):
+    for line in lines:
+        data = (line + '\n').encode('utf-8')
+        stream.write('{0:04x}'.format(len(data) + 4).encode('ascii') + data)
+    write_pkt_flush(stream)
+
+def write_pkt_content(stream, content):
+    for start in range(0, len(content), PKT_LINE_MAX_DATA):
+        data = content[start:start + PKT_LINE_MAX_DATA]
+        stream.write('{0:04x}'.format(len(data) + 4).encode('ascii') + data)
+    write_pkt_flush(stream)
+
+"""
+Convert the content of a workbook into a YML document, as the clean side
+of the git filter. This writes the same single layout document as
+write_workbook_to_yml, except that binary parts are always written
+inline so that the document holds everything needed to rebuild the
+workbook. Checksums are left out, as git itself tracks whether the
+workbook in the working tree matches, and the checksums of the workbook
+it was converted from would change once git checks it out again. Content
+that is not a zip archive, such as a document that was already
+converted, is returned unchanged.
+"""
+def clean_workbook_bytes(pathname, content, settings=None):
+    if not content.startswith(b'PK'):
+        return content
+    extension = os.path.splitext(pathname)[1]
+    conversion_metrics.count('bytes_in', len(content))
+    output_yml = io.StringIO()
+    with zipfile.ZipFile(io.BytesIO(content), "r") as zip_ref:
+        vbaCodeList = []
+        ole_parts = {}
+        if extension in ['.xlsm']:
+            with conversion_metrics.phase('vba'):
+                vbaCodeList, ole_parts = read_vba_sections(zip_ref, vba_cache_path(settings))
+        shared_strings = read_shared_strings(zip_ref) if worksheet_encoding(settings) == 'cells' else None
+        CellEncoder.checked = bool((settings or {}).get('check_cells_encoding', False))
+        write_yml_document(zip_ref, output_yml, extension, vbaCodeList, stream_threshold_bytes(settings), None, ole_parts, shared_strings, False, part_normalizer(settings, zip_ref), part_worker_count(settings))
+    yml_bytes = output_yml.getvalue().encode('utf-8')
+    conversion_metrics.count('bytes_out', len(yml_bytes))
+    return yml_bytes
+
+"""
+Rebuild the content of a workbook from a YML document, as the smudge side
+of the git filter. Documents in the generated layout are streamed, and
+anything else is loaded with the YAML loader, as in convert_yml_to_workbook.
+Content that is already a zip archive is returned unchanged.
+"""
+def smudge_workbook_bytes(content, settings=None):
+    if content.startswith(b'PK'):
+        return content
+    conversion_metrics.count('bytes_in', len(content))
+    yml_text = content.decode('utf-8')
+    blob_store = binary_store_path(settings)
+    output = io.BytesIO()
+    try:
+        yml_items = iter_yml_document(io.StringIO(yml_text), is_binary_part_key)
+        next(yml_items)
+        write_workbook_archive(output, decode_yml_parts(yml_items, blob_store, len(content)), settings)
+    except (YmlLayoutError, StopIteration):
+        conversion_metrics.count('yaml_fallback')
+        with conversion_metrics.phase('read_yml'):
+            inputYML = load_yml_document(io.StringIO(yml_text))
+        output = io.BytesIO()
+        write_workbook_archive(output, decode_yml_parts(iter(inputYML.items()), blob_store), settings)
+    workbook_bytes = output.getvalue()
+    conversion_metrics.count('bytes_out', len(workbook_bytes))
+    return workbook_bytes
+
+"""
+Serve git's long running filter process protocol on stdin and stdout. Git
+starts this once per command, such as an add or a checkout, and sends it 
+a clean request for every workbook it stores and a smudge request for 
+every workbook it writes into the working tree. Workbooks are converted 
+in memory and only the workbooks git touches are converted. Workbooks 
+whose conversion is disabled in the settings are passed through as they
+are. A failed conversion is reported to git as an error for that file
+alone, and messages are written to stderr as stdout carries the protocol.
+"""
+def filter_process(stdin=None, stdout=None):
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    sheetSettings = read_settings()
+    settings = sheetSettings['options']
+    enabled_extensions = []
+    if settings['enabled']:
+        enabled_extensions = [x for x, setting in [('.xlsx', 'convert_xlsx'), ('.xlsm', 'convert_xlsm')] if settings[setting]]
+
+    welcome = read_pkt_text_list(stdin)
+    if welcome[:1] != ['git-filter-client'] or 'version=2' not in welcome[1:]:
+        sys.stderr.write('Unsupported filter protocol: {0}\n'.format(welcome))
+        return 1
+    write_pkt_text_list(stdout, ['git-filter-server', 'version=2'])
+    capabilities = read_pkt_text_list(stdin)
+    write_pkt_text_list(stdout, [x for x in capabilities if x in ['capability=clean', 'capability=smudge']])
+    stdout.flush()
+
+    logfile = open(settings['logfile'], 'a', encoding="utf-8") if settings['enable_logging'] else None
+    try:
+        while True:
+            try:
+                headers = read_pkt_text_list(stdin)
+            except EOFError:
+                return 0
+            request = dict(x.split('=', 1) for x in headers if '=' in x)
+            content = read_pkt_content(stdin)
+            command = request.get('command')
+            pathname = request.get('pathname', '')
+
+            start_time = time.time()
+            conversion_metrics.reset()
+            try:
+                if os.path.splitext(pathname)[1] not in enabled_extensions:
+                    result = content
+                elif command == 'clean':
+                    result = clean_workbook_bytes(pathname, content, settings)
+                elif command == 'smudge':
+                    result = smudge_workbook_bytes(content, settings)
+                else:
+                    raise ValueError('Unknown filter command: {0}'.format(command))
+            except Exception as e:
+                sys.stderr.write('Error converting {0}: {1}\n'.format(pathname, e))
+                result = None
+            elapsed_time = round(time.time() - start_time, 3)
+
+            if result is None:
+                write_pkt_text_list(stdout, ['status=error'])
+            else:
+                write_pkt_text_list(stdout, ['status=success'])
+                write_pkt_content(stdout, result)
+                # An empty list keeps the status sent before the content
+                write_pkt_flush(stdout)
+            stdout.flush()
+
+            if logfile is not None:
+                conversion_type = 'convert_to_excel' if command == 'smudge' else 'convert_to_yml'
+                logfile.write(format_log_line(conversion_type, 'Failure' if result is None else 'Success', elapsed_time, pathname))
+                logfile.flush()
+    finally:
+        if logfile is not None:
+            logfile.close()
+
+# A binary part is compared by the hash of its content, and its size when the content is inline
+BinaryPart = collections.namedtuple('BinaryPart', ['digest', 'size'])
+
+# Worksheets are compared cell by cell, every other XML part line by line
+def is_worksheet_part(member_name):
+    return member_name.startswith('xl/worksheets/') and member_name.endswith('.xml')
+
+"""
+Read the parts of a workbook from a YML file, or from the folder or index
+of the split layout, to compare them. XML parts are read as text, with 
+cells encoded worksheets decoded back to XML so that both encodings
+compare alike, and binary parts are reduced to the hash of their content
+as they are read. The VBA sections are returned as filename and code 
+pairs. A path that does not exist, such as the /dev/null git passes for
+an added or deleted file, reads as a workbook without parts.
+"""
+def read_diff_parts(path):
+    parts = {}
+    vba_modules = []
+    if path == os.devnull or not os.path.exists(path):
+        return parts, vba_modules
+    if os.path.isdir(path):
+        path = os.path.join(path, SPLIT_INDEX_FILE)
+    if os.path.basename(path) == SPLIT_INDEX_FILE:
+        return read_split_diff_parts(path)
+
+    try:
+        with open(path, encoding="utf-8") as file:
+            for key, value in iter_yml_document(file, is_binary_part_key):
+                add_diff_item(parts, vba_modules, key, value)
+        return parts, vba_modules
+    except YmlLayoutError:
+        parts.clear()
+        del vba_modules[:]
+
+    with open(path, encoding="utf-8") as file:
+        document = load_yml_document(file)
+    if not isinstance(document, dict) or 'options' not in document:
+        raise ValueError('{0} is not a workbook YML file'.format(path))
+    for key, value in document.items():
+        add_diff_item(parts, vba_modules, key, value)
+    return parts, vba_modules
+
+# Add a top level item of a YML file to the parts and VBA modules being read for comparison
+def add_diff_item(parts, vba_modules, key, value):
+    if key == 'vba' and isinstance(value, dict):
+        vba_modules.append((value.get('filename') or '', value.get('code') or ''))
+    elif key.startswith(set_temp_folder()) and (isinstance(value, str) or hasattr(value, '__next__')):
+        member_name = workbook_member_name(key)
+        if is_xml_part(member_name):
+            parts[member_name] = decode_cell_lines(value) if CELLS_MARKER in value else value
+        else:
+            parts[member_name] = binary_part_digest(iter([value]) if isinstance(value, str) else value)
+
+# Hash the content of a binary block, a blob reference already names the hash of its content
+def binary_part_digest(text_chunks):
+    blob_reference, text_chunks = read_blob_reference(text_chunks)
+    if blob_reference is not None:
+        return BinaryPart(blob_reference[len(BLOB_REFERENCE_PREFIX):], None)
+    digest = hashlib.sha256()
+    size = 0
+    for data in decode_base64_chunks(text_chunks):
+        digest.update(data)
+        size += len(data)
+    return BinaryPart(digest.hexdigest(), size)
+
+# The VBA sections come before the list of parts in the index, which the streaming reader stops at
+def read_split_diff_parts(indexFile):
+    splitFolder = os.path.dirname(indexFile)
+    parts = {}
+    vba_modules = []
+    try:
+        with open(indexFile, encoding="utf-8") as file:
+            for key, value in iter_yml_document(file):
+                add_diff_item(parts, vba_modules, key, value)
+    except YmlLayoutError:
+        pass
+    with open(indexFile, encoding="utf-8") as file:
+        index = load_yml_document(file)
+
+    for member_name in index.get('parts') or []:
+        part_path = workbook_part_key(splitFolder, member_name)
+        if is_xml_part(member_name):
+            with open(part_path, encoding="utf-8", newline="") as part_file:
+                text = part_file.read()
+            parts[member_name] = decode_cell_lines(text) if CELLS_MARKER in text else text
+        else:
+            digest = hashlib.sha256()
+            for data in read_file_chunks(part_path):
+                digest.update(data)
+            parts[member_name] = BinaryPart(digest.hexdigest(), os.path.getsize(part_path))
+    return parts, vba_modules
+
+"""
+Find the name of the sheet each worksheet part holds, from the sheets
+listed in the workbook part and the targets of their relationships. The
+names label the cells in the output, and worksheets without a name are
+labelled with their part.
+"""
+def read_sheet_names(parts):
+    from lxml import etree
+    workbook_text = parts.get('xl/workbook.xml')
+    rels_text = parts.get('xl/_rels/workbook.xml.rels')
+    if not isinstance(workbook_text, str) or not isinstance(rels_text, str):
+        return {}
+    try:
+        targets = {}
+        for relationship in etree.fromstring(rels_text.encode('utf-8')).iter('{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'):
+            target = relationship.get('Target') or ''
+            targets[relationship.get('Id')] = target[1:] if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        sheet_names = {}
+        for sheet in etree.fromstring(workbook_text.encode('utf-8')).iter('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheet'):
+            relationship_id = sheet.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
+            if relationship_id in targets:
+                sheet_names[targets[relationship_id]] = sheet.get('name')
+        return sheet_names
+    except etree.XMLSyntaxError:
+        return {}
+
+# Read the shared strings of a workbook being compared, an empty list when it has none
+def read_diff_shared_strings(parts):
+    text = parts.get('xl/sharedStrings.xml')
+    if not isinstance(text, str):
+        return []
+    return parse_shared_strings(io.BytesIO(text.encode('utf-8')))
+
+# The fields of a cell that are compared, in the order they are reported
+CELL_FIELDS = ['formula', 'value', 'type', 'style']
+
+"""
+Read the cells of a worksheet into a dictionary from cell reference to 
+its formula, value, type and style. Shared strings are resolved to their
+text and inline strings to the text they hold, so that a cell whose text
+changes shows that text rather than an index. The rest of a shared 
+formula is only written on its first cell, and the others show the index
+that links them to it. The pretty printed lines of each cell are read 
+with the pattern of the cells encoding, and a worksheet holding a cell 
+that does not match it, such as one with rich inline text, is parsed as
+XML instead.
+"""
+def read_sheet_cells(xml_text, shared_strings):
+    cells = {}
+    for match in CELL_XML.finditer(xml_text):
+        reference, attributes, formula_attributes, formula, value, empty_value, inline_space, inline_text = match.groups()
+        attributes = COMMON_CELL_ATTRIBUTES.get(attributes) or dict(CELL_ATTRIBUTE.findall(attributes))
+        fields = {}
+        if formula:
+            fields['formula'] = unescape_xml_text(formula)
+        elif formula_attributes is not None:
+            fields['formula'] = 'shared formula {0}'.format(dict(CELL_ATTRIBUTE.findall(formula_attributes)).get('si'))
+        if inline_text is not None:
+            value = unescape_xml_text(inline_text)
+        elif value is not None:
+            value = unescape_xml_text(value)
+        elif empty_value:
+            value = ''
+        cell_type = attributes.get('t')
+        if cell_type == 's' and value is not None and value.isdigit() and int(value) < len(shared_strings):
+            value = shared_strings[int(value)]
+        if value is not None:
+            fields['value'] = value
+        if cell_type is not None:
+            fields['type'] = cell_type
+        if 's' in attributes:
+            fields['style'] = attributes['s']
+        cells[reference] = fields
+    if len(cells) != xml_text.count('<c ') + xml_text.count('<c>') + xml_text.count('<c/>'):
+        return parse_sheet_cells(xml_text, shared_strings)
+    return cells
+
+CELL_ATTRIBUTE = re.compile(r' ([A-Za-z_][\w:.-]*)="([^"]*)"')
+
+# The attributes most cells have are looked up rather than parsed
+COMMON_CELL_ATTRIBUTES = {'': {}, ' t="s"': {'t': 's'}, ' t="str"': {'t': 'str'}, ' t="b"': {'t': 'b'}, ' t="e"': {'t': 'e'}}
+
+# Text taken from the XML lines is only unescaped when it holds a reference
+def unescape_xml_text(text):
+    if '&' not in text:
+        return text
+    import html
+    return html.unescape(text)
+
+# Parse the cells of a worksheet as XML, giving the same fields as read_sheet_cells
+def parse_sheet_cells(xml_text, shared_strings):
+    from lxml import etree
+    namespace = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+    formula_tag, value_tag, inline_tag = namespace + 'f', namespace + 'v', namespace + 'is'
+    cells = {}
+    for event, element in etree.iterparse(io.BytesIO(xml_text.encode('utf-8')), tag=namespace + 'c', huge_tree=True):
+        fields = {}
+        value = None
+        for child in element:
+            if child.tag == formula_tag:
+                fields['formula'] = child.text or 'shared formula {0}'.format(child.get('si'))
+            elif child.tag == value_tag:
+                value = child.text or ''
+            elif child.tag == inline_tag:
+                value = ''.join(x.text or '' for x in child.iter(namespace + 't') if x.getparent().tag != namespace + 'rPh')
+        cell_type = element.get('t')
+        if cell_type == 's' and value is not None and value.isdigit() and int(value) < len(shared_strings):
+            value = shared_strings[int(value)]
+        if value is not None:
+            fields['value'] = value
+        if cell_type is not None:
+            fields['type'] = cell_type
+        if element.get('s') is not None:
+            fields['style'] = element.get('s')
+        cells[element.get('r')] = fields
+        element.clear()
+    return cells
+
+CELL_REFERENCE = re.compile(r'([A-Z]+)([0-9]+)')
+
+# Cells are reported by row and then by column
+def cell_sort_key(reference):
+    match = CELL_REFERENCE.fullmatch(reference or '')
+    if match is None:
+        return (0, 0, reference or '')
+    return (int(match.group(2)), len(match.group(1)), match.group(1))
+
+# Fields are quoted as JSON strings so that text holding line breaks stays on the line of its cell
+def quote_cell_field(value):
+    return 'null' if value is None else json.encoder.encode_basestring(value)
+
+def format_cell_fields(fields):
+    return ', '.join([x + ': ' + quote_cell_field(fields[x]) for x in CELL_FIELDS if x in fields])
+
+# Compare the cells of two versions of a worksheet, only the cells that changed are sorted and formatted
+def diff_sheet_cells(old_cells, new_cells, label):
+    changed = [x for x, fields in new_cells.items() if old_cells.get(x) != fields]
+    changed += [x for x in old_cells if x not in new_cells]
+    lines = []
+    for reference in sorted(changed, key=cell_sort_key):
+        old_fields = old_cells.get(reference)
+        new_fields = new_cells.get(reference)
+        if old_fields is None:
+            lines.append('+ {0}!{1} {2}'.format(label, reference, format_cell_fields(new_fields)))
+        elif new_fields is None:
+            lines.append('- {0}!{1} {2}'.format(label, reference, format_cell_fields(old_fields)))
+        else:
+            changes = []
+            for name in CELL_FIELDS:
+                if old_fields.get(name) != new_fields.get(name):
+                    changes.append('{0}: {1} -> {2}'.format(name, quote_cell_field(old_fields.get(name)), quote_cell_field(new_fields.get(name))))
+            lines.append('~ {0}!{1} {2}'.format(label, reference, ', '.join(changes)))
+    return lines
+
+# Split a worksheet into the markup before its cells, and the markup after them
+def split_sheet_markup(xml_text):
+    start = xml_text.find('<sheetData')
+    end = xml_text.rfind('</sheetData>')
+    if start < 0:
+        return xml_text, ''
+    if end < 0:
+        end = xml_text.find('>', start) + 1
+    else:
+        end += len('</sheetData>')
+    return xml_text[:start], xml_text[end:]
+
+# The start of each row in the pretty printed lines of a worksheet, which always begins a line
+SHEET_ROW = re.compile(r'\n<row(?: [^>\n]*)?>')
+ROW_NUMBER = re.compile(r' r="([0-9]+)"')
+
+# Split the rows of a worksheet by their number, None when a row has no number of its own
+def split_sheet_rows(xml_text):
+    start = xml_text.find('<sheetData>')
+    end = xml_text.rfind('</sheetData>')
+    if start < 0 or end < start:
+        return None
+    start += len('<sheetData>')
+    positions = []
+    numbers = []
+    for match in SHEET_ROW.finditer(xml_text, start - 1, end):
+        number = ROW_NUMBER.search(match.group(0))
+        if number is None:
+            return None
+        positions.append(match.start() + 1)
+        numbers.append(number.group(1))
+    if len(positions) != xml_text.count('<row', start, end):
+        return None
+    positions.append(end)
+    rows = dict((x, xml_text[positions[i]:positions[i + 1]]) for i, x in enumerate(numbers))
+    if len(rows) != len(numbers):
+        return None
+    return start, end, rows
+
+# The indexes of the shared strings whose text differs between two versions
+def changed_string_indexes(old_strings, new_strings):
+    count = max(len(old_strings), len(new_strings))
+    return set(x for x in range(count) if x >= len(old_strings) or x >= len(new_strings) or old_strings[x] != new_strings[x])
+
+# Find the rows holding a cell that uses one of the given shared strings, by the position where each row starts
+def rows_using_strings(xml_text, positions, string_indexes):
+    import bisect
+    pattern = re.compile(r' t="s"[^>\n]*>\n(?:<f[^\n]*\n)?<v>(?:{0})</v>'.format('|'.join(str(x) for x in sorted(string_indexes))))
+    return set(bisect.bisect_right(positions, x.start()) - 1 for x in pattern.finditer(xml_text))
+
+"""
+Reduce two versions of a worksheet to the rows that differ between them,
+so that only those are read cell by cell. Rows are matched by their 
+number and compared as text, and a row whose text is the same is kept 
+when it uses a shared string whose text changed. Both versions are kept 
+whole when their rows cannot be matched.
+"""
+def changed_sheet_rows(old_text, new_text, changed_strings):
+    old_split = split_sheet_rows(old_text)
+    new_split = split_sheet_rows(new_text)
+    if old_split is None or new_split is None:
+        return old_text, new_text
+    old_start, old_end, old_rows = old_split
+    new_start, new_end, new_rows = new_split
+
+    changed = set(x for x in old_rows if x not in new_rows)
+    changed.update(number for number, row_text in new_rows.items() if old_rows.get(number) != row_text)
+    if changed_strings:
+        numbers = list(new_rows)
+        positions = list(itertools.accumulate([new_text.find('<row', new_start)] + [len(x) for x in new_rows.values()]))
+        changed.update(numbers[x] for x in rows_using_strings(new_text, positions, changed_strings) if 0 <= x < len(numbers))
+    old_changed = ''.join(row_text for number, row_text in old_rows.items() if number in changed)
+    new_changed = ''.join(row_text for number, row_text in new_rows.items() if number in changed)
+    return old_text[:old_start] + old_changed + old_text[old_end:], new_text[:new_start] + new_changed + new_text[new_end:]
+
+# The markup of a worksheet without its cells, as the cells are compared separately
+def join_sheet_markup(xml_text):
+    before, after = split_sheet_markup(xml_text)
+    return before + after.lstrip('\n')
+
+"""
+Compare two texts line by line, returning the changed lines with one
+line of context and a header giving the line number in the old text.
+The lines both texts start and end with are skipped before the lines 
+in between are matched, as only a small part of a large text usually
+changes.
+"""
+def diff_text_lines(old_text, new_text):
+    import difflib
+    old_lines = old_text.splitlines()
+    new_lines = new_text.splitlines()
+    start = 0
+    while start < len(old_lines) and start < len(new_lines) and old_lines[start] == new_lines[start]:
+        start += 1
+    end = 0
+    while end < len(old_lines) - start and end < len(new_lines) - start and old_lines[-1 - end] == new_lines[-1 - end]:
+        end += 1
+    start = max(start - 1, 0)
+    end = max(end - 1, 0)
+    old_lines = old_lines[start:len(old_lines) - end]
+    new_lines = new_lines[start:len(new_lines) - end]
+
+    lines = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for group in matcher.get_grouped_opcodes(1):
+        lines.append('@@ line {0}'.format(start + group[0][1] + 1))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                lines += ['  ' + x for x in old_lines[i1:i2]]
+                continue
+            lines += ['- ' + x for x in old_lines[i1:i2]]
+            lines += ['+ ' + x for x in new_lines[j1:j2]]
+    return lines
+
+# Describe a part that was added or removed, or a binary part that changed
+def describe_diff_part(content):
+    if isinstance(content, BinaryPart):
+        if content.size is None:
+            return 'binary sha256:{0}'.format(content.digest)
+        return 'binary sha256:{0}, {1} bytes'.format(content.digest, content.size)
+    return '{0} lines'.format(content.count('\n'))
+
+"""
+Compare two versions of a workbook in the YML layout and return the lines
+of a report on what changed. Parts whose text or content hash is the 
+same in both versions are skipped without being parsed. Worksheets report
+the cells whose formula, value, type or style changed, along with any 
+change to the markup around the cells, other XML parts report the lines
+that changed, and binary parts their hash. The shared strings are not 
+listed themselves, as their text shows in the cells that use them.
+"""
+def diff_workbook_yml(old_path, new_path):
+    old_parts, old_vba = read_diff_parts(old_path)
+    new_parts, new_vba = read_diff_parts(new_path)
+    lines = []
+
+    strings_changed = old_parts.get('xl/sharedStrings.xml') != new_parts.get('xl/sharedStrings.xml')
+    old_strings = read_diff_shared_strings(old_parts) if strings_changed else None
+    new_strings = read_diff_shared_strings(new_parts) if strings_changed else None
+    changed_strings = changed_string_indexes(old_strings, new_strings) if strings_changed else set()
+    sheet_names = read_sheet_names(old_parts)
+    sheet_names.update(read_sheet_names(new_parts))
+
+    member_names = list(new_parts) + [x for x in old_parts if x not in new_parts]
+    for member_name in member_names:
+        old_content = old_parts.get(member_name)
+        new_content = new_parts.get(member_name)
+        # Shared strings can change the text of a worksheet whose own markup did not change
+        resolves_strings = strings_changed and is_worksheet_part(member_name) and 't="s"' in (new_content or old_content)
+        if old_content == new_content and not resolves_strings:
+            continue
+        label = sheet_names.get(member_name) or member_name
+        heading = member_name if label == member_name else '{0} ({1})'.format(member_name, label)
+
+        if is_worksheet_part(member_name) and not isinstance(old_content, BinaryPart) and not isinstance(new_content, BinaryPart):
+            if old_strings is None:
+                old_strings = read_diff_shared_strings(old_parts)
+                new_strings = read_diff_shared_strings(new_parts)
+            old_rows, new_rows = old_content, new_content
+            if old_content is not None and new_content is not None:
+                old_rows, new_rows = changed_sheet_rows(old_content, new_content, changed_strings)
+            old_cells = read_sheet_cells(old_rows, old_strings) if old_rows is not None else {}
+            new_cells = read_sheet_cells(new_rows, new_strings) if new_rows is not None else {}
+            part_lines = diff_sheet_cells(old_cells, new_cells, label)
+            if old_content is not None and new_content is not None:
+                part_lines += diff_text_lines(join_sheet_markup(old_content), join_sheet_markup(new_content))
+            if not part_lines and old_content is not None and new_content is not None:
+                continue
+        elif old_content is None or new_content is None:
+            part_lines = []
+        elif member_name == 'xl/sharedStrings.xml':
+            part_lines = ['(changed strings are shown in the cells that use them)']
+        elif isinstance(old_content, BinaryPart) or isinstance(new_content, BinaryPart):
+            part_lines = ['- ' + describe_diff_part(old_content), '+ ' + describe_diff_part(new_content)]
+        else:
+            part_lines = diff_text_lines(old_content, new_content)
+
+        if old_content is None:
+            lines.append('+ {0} ({1})'.format(heading, describe_diff_part(new_content)))
+        elif new_content is None:
+            lines.append('- {0} ({1})'.format(heading, describe_diff_part(old_content)))
+        else:
+            lines.append('~ ' + heading)
+        lines += ['  ' + x for x in part_lines]
+
+    old_modules = dict(old_vba)
+    new_modules = dict(new_vba)
+    for filename in list(new_modules) + [x for x in old_modules if x not in new_modules]:
+        old_code = old_modules.get(filename)
+        new_code = new_modules.get(filename)
+        if old_code == new_code:
+            continue
+        prefix = '+' if old_code is None else '-' if new_code is None else '~'
+        lines.append('{0} vba {1}'.format(prefix, filename))
+        lines += ['  ' + x for x in diff_text_lines(old_code or '', new_code or '')]
+    return lines
+
+"""
+Write a workbook in the YML layout as text suited to a line based diff, 
+for use as a git textconv driver. Each worksheet is written as the markup
+around its cells with one line per cell in between, giving its formula,
+value, type and style with shared strings resolved, so that a change to
+a cell changes a single line however the XML was printed. Binary parts
+are written as the hash of their content, and other XML parts as they
+are. Git can cache the result for each version of a file.
+"""
+def textconv_workbook_yml(path):
+    parts, vba_modules = read_diff_parts(path)
+    shared_strings = read_diff_shared_strings(parts)
+    sheet_names = read_sheet_names(parts)
+    lines = []
+    for filename, code in vba_modules:
+        lines.append('vba {0}'.format(filename))
+        lines += ['    ' + x for x in code.splitlines()]
+    for member_name, content in parts.items():
+        if isinstance(content, BinaryPart):
+            lines.append('part {0} sha256:{1}'.format(member_name, content.digest))
+        elif member_name == 'xl/sharedStrings.xml':
+            lines.append('part {0} sha256:{1}'.format(member_name, hashlib.sha256(content.encode('utf-8')).hexdigest()))
+        elif is_worksheet_part(member_name):
+            label = sheet_names.get(member_name) or member_name
+            lines.append('part {0} ({1})'.format(member_name, label) if label != member_name else 'part ' + member_name)
+            before, after = split_sheet_markup(content)
+            lines += ['    ' + x for x in before.splitlines()]
+            prefix = '    ' + label + '!'
+            lines += [prefix + x + ' ' + format_cell_fields(fields) for x, fields in read_sheet_cells(content, shared_strings).items()]
+            lines += ['    ' + x for x in after.splitlines()]
+        else:
+            lines.append('part ' + member_name)
+            lines += ['    ' + x for x in content.splitlines()]
+    return lines
+
+# Write lines to stdout as UTF-8 whatever the encoding of the console, as git reads them as bytes
+def write_output_lines(lines):
+    output = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="\n", write_through=True)
+    try:
+        output.write(''.join([x + '\n' for x in lines]))
+    finally:
+        output.detach()
+
+"""
+Read the value that follows an option such as --jobs from the list of
+input arguments, returning the default if the option was not given.
+"""
+def read_option_value(args, name, default=None):
+    if name not in args:
+        return default
+    index = args.index(name)
+    if index + 1 >= len(args):
+        return default
+    return args[index + 1]
+
+""" 
+The global entry point for the application code is specified here. We parse 
+the input arguments and determnine the requested operation. This is then passed
+to the downstream functions for execution. If an error code is returned (indicated
+by a sys.exit code other than zero) then the git hook will also produce an error 
+and display an error message to the user. 
+"""
+def main(argv):
+    if len(argv) < 2:
+        return 1
+
+    input_arg = argv[1]
+    options = argv[2:]
+    if input_arg in ['convert_to_excel', 'convert_to_yml']:
+        try:
+            jobs = int(read_option_value(options, '--jobs', 1))
+        except ValueError:
+            return 1
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+        from_ref = read_option_value(options, '--from')
+        to_ref = read_option_value(options, '--to')
+        metrics_file = read_option_value(options, '--metrics')
+        return entry_point(input_arg, force='--force' in options, jobs=jobs, changed='--changed' in options, from_ref=from_ref, to_ref=to_ref, metrics_file=metrics_file, stage='--stage' in options)
+    elif input_arg in ['watch']:
+        try:
+            jobs = int(read_option_value(options, '--jobs', 1))
+            interval = float(read_option_value(options, '--interval', 2.0))
+        except ValueError:
+            return 1
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+        return watch(jobs=jobs, interval=interval)
+    elif input_arg in ['materialize']:
+        try:
+            jobs = int(read_option_value(options, '--jobs', 1))
+        except ValueError:
+            return 1
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+        # Paths are given relative to the root of the repo, in the form used by the local platform
+        patterns = [x.replace(os.sep, '/') for i, x in enumerate(options) if not x.startswith('--') and (i == 0 or options[i - 1] != '--jobs')]
+        patterns = [x[2:] if x.startswith('./') else x for x in patterns]
+        if not patterns:
+            return 1
+        return entry_point('convert_to_excel', jobs=jobs, materialize=patterns)
+    elif input_arg in ['filter-process']:
+        return filter_process()
+    elif input_arg in ['diff']:
+        # Git runs an external diff driver with the path, then the file, hash and mode of each version
+        if len(options) == 7:
+            path, old_path, new_path = options[0], options[1], options[4]
+        elif len(options) == 2:
+            path, old_path, new_path = None, options[0], options[1]
+        else:
+            return 1
+        lines = diff_workbook_yml(old_path, new_path)
+        if lines:
+            header = ['--- a/' + path, '+++ b/' + path] if path is not None else ['--- ' + old_path, '+++ ' + new_path]
+            write_output_lines(header + lines)
+        return 0
+    elif input_arg in ['textconv']:
+        if len(options) != 1:
+            return 1
+        write_output_lines(textconv_workbook_yml(options[0]))
+        return 0
+    elif input_arg in ['convert_to_yml_in_place']:
+        if len(argv) != 3:
+            return 1
+        input_file = argv[2]
+        if input_file.endswith(('.xlsx', '.xlsm')):
+            result = write_workbook_to_yml(input_file, False)
+            os.remove(input_file)
+        return 0
+    return 1
 
 
+# Required so that worker processes start correctly from the PyInstaller executable
+if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main(sys.argv))